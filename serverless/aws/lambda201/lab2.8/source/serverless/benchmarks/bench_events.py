@@ -0,0 +1,68 @@
+# How long it takes to get the parameters out of each kind of event, comparing the json.loads
+# cascade the handlers used to run with events.decode.
+# Run it from the serverless directory:
+#   python benchmarks/bench_events.py --number 100000
+import os
+import sys
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import events
+
+
+# The cascade from comments.get (webhook.post and comments.post had near copies of it)
+def old_decode(event):
+    event_json = None
+    if "httpMethod" in event and event['httpMethod'] == "GET":
+        if "page" in event['queryStringParameters']:
+            try:
+                event_json = json.loads(event['queryStringParameters'])
+            except:
+                event_json = event['queryStringParameters']
+    else:
+        if "body" in event:
+            try:
+                event_json = json.loads(event['body'])
+            except:
+                pass
+        else:
+            try:
+                event_json = json.loads(event)
+            except:
+                event_json = event
+    return event_json
+
+
+def new_decode(event):
+    return events.decode(event).params
+
+
+comment = {"page": "first-post", "name": "Ada", "comment": "Nice post " * 20}
+
+SHAPES = {
+    'api_gateway_post': {"httpMethod": "POST", "headers": {"Content-Type": "application/json"},
+                         "queryStringParameters": None, "body": json.dumps(comment)},
+    'api_gateway_get': {"httpMethod": "GET", "headers": {}, "queryStringParameters": {"page": "first-post"}, "body": None},
+    'direct_dict': dict(comment),
+    'sam_local_dict_body': {"httpMethod": "POST", "body": dict(comment)},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    print('{0:<22} {1:>10} {2:>10}'.format('shape', 'old us', 'new us'))
+    for name, event in sorted(SHAPES.items()):
+        old = timeit.timeit(lambda: old_decode(event), number=args.number)
+        new = timeit.timeit(lambda: new_decode(event), number=args.number)
+        print('{0:<22} {1:>10.3f} {2:>10.3f}'.format(
+            name, old * 1e6 / args.number, new * 1e6 / args.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+# End to end benchmark of the blog pipeline, run entirely on this machine.
+# For every combination of post and comment counts we:
+#  - make a Hugo style repo with that many posts and serve it from a bare repo (a file:// clone_url)
+#  - post the comments through comments.post, one request each and then as one batch
+#  - read every page through comments.get, cold and then from the cache
+#  - send webhook.post a ping and a badly signed push, which should both be turned away cheaply
+#  - send a signed push and run the build worker (the cold full build), then push a change to one post
+#    and build again (the incremental build)
+#  - feed dynamo_stream.fake_webhook a burst of stream records and run the rebuild it queues
+# DynamoDB, S3 and Lambda are the in-process fakes in fakes.py and /opt/hugo is fake_hugo.py,
+# so the numbers are the cost of our own code plus git, not of AWS or hugo.
+# We report the latency of each step, the per-phase metrics the webhook records, bytes moved,
+# how many calls each fake service got and how often the hugo render cache hit.
+# Needs pygit2, boto3 and git. Run it from the serverless directory:
+#   python benchmarks/bench_pipeline.py --posts 10,100 --comments 100,1000
+import os
+import sys
+import io
+import json
+import hmac
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+# Keep the handlers quiet, they read log_level when they are imported and on every invocation.
+# The handler modules expect the handler Lambda puts on the root logger.
+os.environ.setdefault('log_level', 'WARNING')
+logging.basicConfig()
+
+import fakes
+from comments import comments
+from dynamo_stream import dynamo_stream
+from github_webhook import webhook
+from github_webhook import worker
+from github_webhook import metrics
+from github_webhook import scanner
+from github_webhook import workspace
+from github_webhook import signatures
+from github_webhook import build_queue
+
+FULL_NAME = 'bench/blog'
+SECRET = 'bench-secret'
+COMMENTS_TABLE = 'bench-comments'
+REBUILD_TABLE = 'bench-rebuilds'
+
+
+def git(cwd, *args):
+    subprocess.check_call(['git', '-c', 'user.name=Bench', '-c', 'user.email=bench@example.com'] + list(args),
+                          cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def git_output(cwd, *args):
+    return subprocess.check_output(['git'] + list(args), cwd=cwd).decode('utf-8').strip()
+
+
+def post_text(index, revision=0):
+    return ('---\ntitle: "Post {0}"\ndate: 2019-01-01\n---\n\n'
+            'Revision {1}. {2}\n\n### Comments\n').format(index, revision, 'Some words about the post. ' * 40)
+
+
+# A repo that looks enough like our blog for the pipeline: posts with the comments marker,
+# a config, a layout and a static file. Returns (work tree, bare repo).
+def make_site(root, posts):
+    work = os.path.join(root, 'site')
+    os.makedirs(os.path.join(work, 'content', 'posts'))
+    os.makedirs(os.path.join(work, 'layouts', '_default'))
+    os.makedirs(os.path.join(work, 'static', 'css'))
+    for i in range(posts):
+        with open(os.path.join(work, 'content', 'posts', 'post-%05d.md' % i), 'w') as f:
+            f.write(post_text(i))
+    with open(os.path.join(work, 'config.toml'), 'w') as f:
+        f.write('title = "Bench"\n')
+    with open(os.path.join(work, 'layouts', '_default', 'single.html'), 'w') as f:
+        f.write('{{ .Content }}\n')
+    with open(os.path.join(work, 'static', 'css', 'site.css'), 'w') as f:
+        f.write('body { color: black; }\n')
+    git(work, 'init', '-q')
+    git(work, 'checkout', '-q', '-b', 'master')
+    git(work, 'add', '-A')
+    git(work, 'commit', '-q', '-m', 'Initial site')
+    bare = os.path.join(root, 'blog.git')
+    git(root, 'clone', '-q', '--bare', work, bare)
+    git(work, 'remote', 'add', 'origin', bare)
+    return work, bare
+
+
+# Change one post and push it. Returns the push payload GitHub would send for it.
+def push_change(work, index, revision):
+    path = 'content/posts/post-%05d.md' % index
+    before = git_output(work, 'rev-parse', 'HEAD')
+    with open(os.path.join(work, path), 'w') as f:
+        f.write(post_text(index, revision))
+    git(work, 'commit', '-q', '-am', 'Edit post %d' % index)
+    git(work, 'push', '-q', 'origin', 'master')
+    return before, git_output(work, 'rev-parse', 'HEAD'), {'added': [], 'modified': [path], 'removed': []}
+
+
+def push_body(bare, before, after, commits):
+    return {
+        'ref': 'refs/heads/master',
+        'before': before,
+        'after': after,
+        'forced': False,
+        'commits': commits,
+        'repository': {'full_name': FULL_NAME, 'clone_url': 'file://' + bare},
+    }
+
+
+# The API Gateway event GitHub's delivery turns into
+def github_event(body, github_event='push', secret=SECRET):
+    raw = json.dumps(body)
+    signature = 'sha256=' + hmac.new(secret.encode('utf-8'), raw.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {
+        'httpMethod': 'POST',
+        'headers': {'X-GitHub-Event': github_event, 'X-Hub-Signature-256': signature},
+        'queryStringParameters': None,
+        'body': raw,
+    }
+
+
+def stream_event(pages):
+    return {'Records': [{
+        'eventSource': 'aws:dynamodb',
+        'dynamodb': {'NewImage': {'page': {'S': page}}},
+    } for page in pages]}
+
+
+class Context(object):
+    function_name = 'webhook'
+
+
+class Timings(object):
+    def __init__(self):
+        self.steps = []
+
+    # Time fn once per call, filed under name
+    def run(self, name, fn, *args):
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = (time.time() - start) * 1000
+            for step in self.steps:
+                if step['name'] == name:
+                    step['times'].append(elapsed)
+                    break
+            else:
+                self.steps.append({'name': name, 'times': [elapsed]})
+
+    def summary(self):
+        rows = []
+        for step in self.steps:
+            times = sorted(step['times'])
+            rows.append({
+                'step': step['name'],
+                'calls': len(times),
+                'mean_ms': sum(times) / len(times),
+                'p50_ms': times[len(times) // 2],
+                'p99_ms': times[min(len(times) - 1, int(round((len(times) - 1) * 0.99)))],
+                'total_ms': sum(times),
+            })
+        return rows
+
+
+@contextlib.contextmanager
+def environment(values):
+    saved = dict((k, os.environ.get(k)) for k in values)
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def run_scenario(posts, comment_count, batch_size):
+    root = tempfile.mkdtemp(prefix='bench-pipeline-')
+    uninstall = None
+    try:
+        work, bare = make_site(root, posts)
+        queue_file = os.path.join(root, 'builds.jsonl')
+        s3 = fakes.FakeS3()
+        dynamo = fakes.FakeDynamo(rebuild_tables=[REBUILD_TABLE])
+        lambda_client = fakes.FakeLambda({'comments': comments.get_many, 'webhook': webhook.post})
+        uninstall = fakes.install(s3, dynamo, lambda_client)
+
+        # Every scenario starts from a cold container
+        webhook.workspaces = workspace.WorkspaceManager(root=os.path.join(root, 'workspaces'))
+        webhook.hugo_binary = os.path.join(HERE, 'fake_hugo.py')
+        # libgit2 can't do shallow fetches over the local transport, so the file:// remote
+        # gets the whole history. It is only a commit or two here anyway.
+        webhook.fetch_depth = 0
+        comments.page_cache.clear()
+        scanner.reset()
+        signatures.reset()
+
+        env = {
+            'table_name': COMMENTS_TABLE,
+            'github_secrets': SECRET,
+            'build_queue_file': queue_file,
+            'output_bucket': 'bench-site',
+            'comment_function': 'comments',
+            'webhook_function': 'webhook',
+            'rebuild_table': REBUILD_TABLE,
+            'rebuild_window': '0',
+            'full_name': FULL_NAME,
+            'clone_url': 'file://' + bare,
+        }
+        timings = Timings()
+        queue = build_queue.FileQueue(queue_file)
+        pages = ['post-%05d' % i for i in range(posts)]
+        stdout = io.StringIO()
+        with environment(env), metrics.Collector() as collector, contextlib.redirect_stdout(stdout):
+            # Comments, first one request each and then the same number again in batches
+            for i in range(comment_count):
+                body = {'page': pages[i % posts], 'name': 'Reader %d' % i, 'comment': 'Comment %d' % i}
+                timings.run('comments.post', comments.post,
+                            {'httpMethod': 'POST', 'queryStringParameters': None, 'body': json.dumps(body)}, None)
+            entries = [{'page': pages[i % posts], 'name': 'Importer', 'comment': 'Imported %d' % i}
+                       for i in range(comment_count)]
+            for i in range(0, len(entries), batch_size):
+                timings.run('comments.post batch', comments.post,
+                            {'httpMethod': 'POST', 'queryStringParameters': None,
+                             'body': json.dumps(entries[i:i + batch_size])}, None)
+
+            # Reads, the first for each page goes to the table and the second comes from the cache
+            for label in ['comments.get cold', 'comments.get cached']:
+                for page in pages:
+                    timings.run(label, comments.get,
+                                {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'page': page}}, None)
+
+            # Requests the webhook should turn away without doing any real work
+            head = git_output(work, 'rev-parse', 'HEAD')
+            body = push_body(bare, '0' * 40, head, [])
+            timings.run('webhook.post ping', webhook.post, github_event(body, 'ping'), None)
+            try:
+                timings.run('webhook.post bad signature', webhook.post, github_event(body, secret='wrong'), None)
+            except Exception:
+                pass
+
+            # A push, then the cold full build
+            timings.run('webhook.post push', webhook.post, github_event(body), None)
+            timings.run('build full', worker.drain_queue, queue, Context())
+
+            # An edit to one post, then the incremental build
+            before, after, commit = push_change(work, 0, 1)
+            timings.run('webhook.post push', webhook.post, github_event(push_body(bare, before, after, [commit])), None)
+            timings.run('build incremental', worker.drain_queue, queue, Context())
+
+            # A burst of new comments arriving through the stream
+            timings.run('dynamo_stream.fake_webhook', dynamo_stream.fake_webhook,
+                        stream_event(pages[:min(posts, 10)]), None)
+            timings.run('build comments', worker.drain_queue, queue, Context())
+
+        return {
+            'posts': posts,
+            'comments': comment_count,
+            'steps': timings.summary(),
+            'phases': collector.summary(),
+            'render_cache': dict(Counter(r.get('render_cache') for r in collector.records if 'render_cache' in r)),
+            'lambda_invokes': dict(lambda_client.calls),
+            'lambda_payload_bytes': lambda_client.payload_bytes,
+            's3_calls': dict(s3.calls),
+            's3_bytes_uploaded': s3.bytes_in,
+            'dynamodb_calls': dict(dynamo.calls()),
+        }
+    finally:
+        if uninstall:
+            uninstall()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def print_report(result):
+    print('\n== {posts} posts, {comments} comments =='.format(**result))
+    print('{0:<30} {1:>6} {2:>10} {3:>10} {4:>10}'.format('step', 'calls', 'mean ms', 'p50 ms', 'p99 ms'))
+    for row in result['steps']:
+        print('{step:<30} {calls:>6} {mean_ms:>10.2f} {p50_ms:>10.2f} {p99_ms:>10.2f}'.format(**row))
+    print('{0:<30} {1:>6} {2:>10} {3:>10} {4:>10}'.format('webhook phase', 'runs', 'mean', 'p50', 'max'))
+    for name in sorted(result['phases']):
+        stats = result['phases'][name]
+        print('{0:<30} {count:>6} {mean:>10.2f} {p50:>10.2f} {max:>10.2f}'.format(name, **stats))
+    print('lambda invokes: {0} ({1} payload bytes)'.format(result['lambda_invokes'], result['lambda_payload_bytes']))
+    print('s3 calls: {0} ({1} bytes uploaded)'.format(result['s3_calls'], result['s3_bytes_uploaded']))
+    print('dynamodb calls: {0}'.format(result['dynamodb_calls']))
+    print('render cache: {0}'.format(result['render_cache']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--posts', default='10,100')
+    parser.add_argument('--comments', default='100,1000')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON instead of tables')
+    args = parser.parse_args()
+
+    results = []
+    for posts in [int(n) for n in args.posts.split(',')]:
+        for comment_count in [int(n) for n in args.comments.split(',')]:
+            result = run_scenario(posts, comment_count, args.batch_size)
+            results.append(result)
+            if not args.json:
+                print_report(result)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
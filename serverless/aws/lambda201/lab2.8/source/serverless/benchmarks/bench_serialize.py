@@ -0,0 +1,74 @@
+# Compares how comments.get used to serialize a page of comments (appending to a second list
+# of formatted comments, then json.dumps) with comments_json and the streaming iter_comments_json,
+# and the old DecimalEncoder with the new one on raw DynamoDB items full of numbers.
+# Needs boto3 for the comments module imports. Run it from the serverless directory:
+#   python benchmarks/bench_serialize.py --counts 10,1000,10000
+import os
+import sys
+import json
+import timeit
+import decimal
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The handler modules expect the handler Lambda puts on the root logger
+logging.basicConfig()
+from comments import comments
+
+
+class OldDecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            if abs(o) % 1 > 0:
+                return float(o)
+            else:
+                return int(o)
+        return super(OldDecimalEncoder, self).default(o)
+
+
+def old_body(items):
+    modified_items = []
+    for item in items:
+        modified_items.append(comments.format_comment(item))
+    return json.dumps(modified_items)
+
+
+def make_items(count):
+    return [{
+        "uuid": "%032d" % i,
+        "page": "first-post",
+        "name": "Reader %d" % i,
+        "comment": "Great post, thanks for writing it up. " * 3,
+        "created": decimal.Decimal(1560000000000 + i),
+        "score": decimal.Decimal('%d.5' % i),
+    } for i in range(count)]
+
+
+def per_call(fn, number):
+    return timeit.timeit(fn, number=number) * 1000 / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', default='10,1000,10000')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    print('{0:>7} {1:>14} {2:>14} {3:>14} {4:>14} {5:>14}'.format(
+        'items', 'old body ms', 'new body ms', 'stream ms', 'old items ms', 'new items ms'))
+    for count in [int(n) for n in args.counts.split(',')]:
+        items = make_items(count)
+        assert json.loads(old_body(items)) == json.loads(''.join(comments.iter_comments_json(items)))
+        print('{0:>7} {1:>14.3f} {2:>14.3f} {3:>14.3f} {4:>14.3f} {5:>14.3f}'.format(
+            count,
+            per_call(lambda: old_body(items), args.number),
+            per_call(lambda: comments.comments_json(items), args.number),
+            per_call(lambda: ''.join(comments.iter_comments_json(items)), args.number),
+            per_call(lambda: json.dumps(items, cls=OldDecimalEncoder), args.number),
+            per_call(lambda: comments.encoder.encode(items), args.number)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Compares the old signature check (a fresh HMAC for every key, no early exit) with
+# signatures.verify as the number of keys in github_secrets grows.
+# Run it from the serverless directory:
+#   python benchmarks/bench_signatures.py --body-kb 64 --keys 1,8,32,128
+import os
+import sys
+import hmac
+import json
+import timeit
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from github_webhook import signatures
+from common import events
+
+
+# The loop webhook.post used to run
+def old_verify(event, github_secrets):
+    secure = False
+    signature = event['headers']['X-Hub-Signature']
+    for k in github_secrets.split(','):
+        computed_hash = hmac.new(k.encode('ascii'), event['body'].encode('ascii'), hashlib.sha1)
+        computed_signature = '='.join(['sha1', computed_hash.hexdigest()])
+        hmac.compare_digest(computed_signature.encode('ascii'), signature.encode('ascii'))
+        if hmac.compare_digest(computed_signature.encode('ascii'), signature.encode('ascii')):
+            secure = True
+    return secure
+
+
+def make_event(body, secret):
+    raw = body.encode('utf-8')
+    return {
+        "body": body,
+        "headers": {
+            "X-Hub-Signature": 'sha1=' + hmac.new(secret.encode('ascii'), raw, hashlib.sha1).hexdigest(),
+            "X-Hub-Signature-256": 'sha256=' + hmac.new(secret.encode('ascii'), raw, hashlib.sha256).hexdigest(),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--body-kb', type=int, default=64)
+    parser.add_argument('--keys', default='1,8,32,128')
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    body = json.dumps({"repository": {"full_name": "student00/blog"}, "padding": "x" * (args.body_kb * 1024)})
+    print('{0:>6} {1:>12} {2:>12} {3:>12}'.format('keys', 'old ms', 'cold ms', 'warm ms'))
+    for count in [int(n) for n in args.keys.split(',')]:
+        keys = ['secret-%d' % i for i in range(count)]
+        # The matching key is last, the worst case for both loops
+        github_secrets = ','.join(keys)
+        event = make_event(body, keys[-1])
+
+        old = timeit.timeit(lambda: old_verify(event, github_secrets), number=args.number)
+
+        def cold():
+            signatures.reset()
+            signatures.verify(events.decode(event), github_secrets, hint='student00/blog')
+        cold_time = timeit.timeit(cold, number=args.number)
+
+        signatures.reset()
+        request = events.decode(event)
+        signatures.verify(request, github_secrets, hint='student00/blog')
+        warm = timeit.timeit(lambda: signatures.verify(request, github_secrets, hint='student00/blog'), number=args.number)
+
+        print('{0:>6} {1:>12.3f} {2:>12.3f} {3:>12.3f}'.format(
+            count, old * 1000 / args.number, cold_time * 1000 / args.number, warm * 1000 / args.number))
+
+
+if __name__ == '__main__':
+    main()
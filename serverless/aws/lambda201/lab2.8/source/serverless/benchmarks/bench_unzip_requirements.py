@@ -0,0 +1,146 @@
+# Cold start cost of unzip_requirements.py (the serverless-python-requirements helper that
+# unpacks .requirements.zip) as the archive grows, in number of members and in size.
+# For every archive we time, in a fresh python process each like a new container:
+#   extract cold    extract mode with an empty /tmp, for each number of --workers
+#   extract warm    extract mode when an earlier container left a complete extraction, checked
+#                   against the manifest by size and then by CRC
+#   lazy            lazy mode, which extracts nothing until a native extension is imported
+# The archives are made up: members of the same size holding text that compresses about
+# as well as Python source does. Run it from the serverless directory:
+#   python benchmarks/bench_unzip_requirements.py --members 100,1000,5000 --size-mb 5,50
+import os
+import sys
+import json
+import random
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN = os.path.join(os.path.dirname(HERE), 'node_modules', 'serverless-python-requirements')
+
+CHILD = '''
+import time, json
+start = time.perf_counter()
+import unzip_requirements
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({'ms': elapsed, 'extracted': getattr(unzip_requirements, 'extracted', None)}))
+'''
+
+WORDS = ['def', 'return', 'self', 'import', 'class', 'if', 'else', 'for', 'in', 'None', 'True',
+         'value', 'result', 'name', 'path', 'data', 'request', 'response', 'config', '(', ')',
+         ':', '=', '.', ',', '\n    ', '\n        ', '\n']
+
+
+# About a megabyte of something that deflates like source code, which members are cut from
+def make_text(seed=1):
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < 1024 * 1024:
+        word = rng.choice(WORDS) + ' '
+        parts.append(word)
+        length += len(word)
+    return ''.join(parts).encode('utf-8')
+
+
+def make_archive(path, members, size_mb, text):
+    member_size = max(1, size_mb * 1024 * 1024 // members)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(members):
+            offset = (i * 7919) % max(1, len(text) - member_size)
+            data = text[offset:offset + member_size]
+            while len(data) < member_size:
+                data += text[:member_size - len(data)]
+            archive.writestr('pkg{0}/module_{1:05d}.py'.format(i % 20, i), data)
+    return os.path.getsize(path)
+
+
+def run_child(task_root, target, mode, workers=1, verify='size'):
+    env = dict(os.environ)
+    env.update({
+        'LAMBDA_TASK_ROOT': task_root,
+        'UNZIP_REQUIREMENTS_DIR': target,
+        'UNZIP_REQUIREMENTS_MODE': mode,
+        'UNZIP_REQUIREMENTS_WORKERS': str(workers),
+        'UNZIP_REQUIREMENTS_VERIFY': verify,
+        'PYTHONPATH': PLUGIN,
+    })
+    env.pop('IS_LOCAL', None)
+    output = subprocess.check_output([sys.executable, '-S', '-c', CHILD], env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def clear(target):
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+
+def measure(task_root, target, runs, worker_counts):
+    rows = {}
+    for workers in worker_counts:
+        times = []
+        for _ in range(runs):
+            clear(target)
+            times.append(run_child(task_root, target, 'extract', workers)['ms'])
+        rows['extract cold w{0}'.format(workers)] = median(times)
+    # The last cold run left a complete extraction behind
+    rows['extract warm size'] = median([run_child(task_root, target, 'extract')['ms'] for _ in range(runs)])
+    rows['extract warm crc'] = median([run_child(task_root, target, 'extract', verify='crc')['ms']
+                                       for _ in range(runs)])
+    clear(target)
+    times = []
+    for _ in range(runs):
+        clear(target)
+        times.append(run_child(task_root, target, 'lazy')['ms'])
+    rows['lazy'] = median(times)
+    clear(target)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', default='100,1000,5000')
+    parser.add_argument('--size-mb', default='5,50')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    worker_counts = [int(w) for w in args.workers.split(',')]
+    text = make_text()
+    root = tempfile.mkdtemp(prefix='bench-unzip-')
+    results = []
+    try:
+        for size_mb in [int(s) for s in args.size_mb.split(',')]:
+            for members in [int(m) for m in args.members.split(',')]:
+                task_root = os.path.join(root, 'task')
+                os.makedirs(task_root, exist_ok=True)
+                archive_bytes = make_archive(os.path.join(task_root, '.requirements.zip'), members, size_mb, text)
+                rows = measure(task_root, os.path.join(root, 'sls-py-req'), args.runs, worker_counts)
+                results.append({'members': members, 'size_mb': size_mb, 'archive_bytes': archive_bytes,
+                                'timings_ms': rows})
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('cpus: {0}'.format(os.cpu_count()))
+    columns = list(results[0]['timings_ms']) if results else []
+    print('{0:>8} {1:>8} {2:>10}  '.format('members', 'MB', 'zip MB') +
+          ' '.join('{0:>18}'.format(c) for c in columns))
+    for r in results:
+        print('{0:>8} {1:>8} {2:>10.1f}  '.format(r['members'], r['size_mb'], r['archive_bytes'] / 1048576.0) +
+              ' '.join('{0:>18.1f}'.format(r['timings_ms'][c]) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
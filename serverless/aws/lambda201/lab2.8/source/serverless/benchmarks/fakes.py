@@ -0,0 +1,197 @@
+# In-process stand-ins for the AWS services the blog pipeline talks to, for the local
+# benchmarks. They only understand the calls our functions make and they count every one
+# of them so the benchmarks can report how much work each request really caused.
+# install() points common.clients at them, so the handlers run unchanged.
+import io
+import json
+from collections import Counter
+
+from common import clients
+
+
+class ServiceError(Exception):
+    """ Looks enough like a botocore ClientError for our error handling"""
+
+    def __init__(self, code):
+        super(ServiceError, self).__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+        self.calls = Counter()
+        self.bytes_in = 0
+
+    def get_object(self, Bucket, Key):
+        self.calls['get_object'] += 1
+        if Key not in self.objects:
+            raise ServiceError('NoSuchKey')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls['put_object'] += 1
+        body = Body.encode('utf-8') if isinstance(Body, str) else Body
+        self.bytes_in += len(body)
+        self.objects[Key] = body
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        self.calls['upload_file'] += 1
+        with open(Filename, 'rb') as f:
+            body = f.read()
+        self.bytes_in += len(body)
+        self.objects[Key] = body
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls['delete_objects'] += 1
+        for o in Delete['Objects']:
+            self.objects.pop(o['Key'], None)
+        return {}
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        self.calls['list_objects_v2'] += 1
+        return {'Contents': [{'Key': k} for k in sorted(self.objects)], 'IsTruncated': False}
+
+
+# The low level client behind a FakeCommentsTable, for BatchWriteItem
+class FakeDynamoClient(object):
+    def __init__(self, tables):
+        self.tables = tables
+
+    def batch_write_item(self, RequestItems):
+        for name, requests in RequestItems.items():
+            table = self.tables[name]
+            table.calls['batch_write_item'] += 1
+            for request in requests:
+                table.items.append(request['PutRequest']['Item'])
+        return {'UnprocessedItems': {}}
+
+
+class _Meta(object):
+    def __init__(self, client):
+        self.client = client
+
+
+# The comments table and its page-created-index
+class FakeCommentsTable(object):
+    def __init__(self, name, client):
+        self.name = name
+        self.items = []
+        self.calls = Counter()
+        self.meta = _Meta(client)
+
+    def put_item(self, Item):
+        self.calls['put_item'] += 1
+        self.items.append(Item)
+        return {}
+
+    def scan(self, **kwargs):
+        self.calls['scan'] += 1
+        return {'Items': list(self.items)}
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None, ScanIndexForward=True):
+        self.calls['query'] += 1
+        page = KeyConditionExpression.get_expression()['values'][1]
+        items = sorted([i for i in self.items if i['page'] == page and 'created' in i],
+                       key=lambda i: (i['created'], i['uuid']), reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            uuids = [i['uuid'] for i in items]
+            items = items[uuids.index(ExclusiveStartKey['uuid']) + 1:]
+        response = {'Items': items[:Limit] if Limit else items}
+        if Limit and len(items) > Limit:
+            last = items[Limit - 1]
+            response['LastEvaluatedKey'] = {'uuid': last['uuid'], 'page': last['page'], 'created': last['created']}
+        return response
+
+
+# The rebuild table, understands just the update expressions common/rebuilds.py uses
+class FakeRebuildTable(object):
+    def __init__(self, name):
+        self.name = name
+        self.sites = {}
+        self.calls = Counter()
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None,
+                    ReturnValues=None):
+        self.calls['update_item'] += 1
+        values = ExpressionAttributeValues or {}
+        item = self.sites.setdefault(Key['site'], {})
+        old = dict(item)
+        last_trigger = item.get('last_trigger')
+        if ConditionExpression and ':cutoff' in values and last_trigger is not None and last_trigger > values[':cutoff']:
+            raise ServiceError('ConditionalCheckFailedException')
+        if ConditionExpression and ':lease' in values and last_trigger != values[':lease']:
+            raise ServiceError('ConditionalCheckFailedException')
+        if 'ADD pages' in UpdateExpression:
+            item['pages'] = item.get('pages', set()) | values[':pages']
+        if 'SET full_rebuild' in UpdateExpression:
+            item['full_rebuild'] = True
+        if 'SET last_trigger' in UpdateExpression:
+            item['last_trigger'] = values[':now']
+            item.pop('pages', None)
+            item.pop('full_rebuild', None)
+        if UpdateExpression == 'REMOVE last_trigger':
+            item.pop('last_trigger', None)
+        return {'Attributes': old if ReturnValues == 'ALL_OLD' else dict(item)}
+
+
+class FakeDynamo(object):
+    def __init__(self, rebuild_tables=()):
+        self.tables = {}
+        self.client = FakeDynamoClient(self.tables)
+        self.rebuild_tables = set(rebuild_tables)
+
+    def Table(self, name):
+        if name not in self.tables:
+            if name in self.rebuild_tables:
+                self.tables[name] = FakeRebuildTable(name)
+            else:
+                self.tables[name] = FakeCommentsTable(name, self.client)
+        return self.tables[name]
+
+    def calls(self):
+        total = Counter()
+        for table in self.tables.values():
+            total.update(table.calls)
+        return total
+
+
+# Runs the handler a function name maps to, in this process. Asynchronous (Event) invokes
+# run straight away too, the benchmarks want everything finished when the call returns.
+class FakeLambda(object):
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.calls = Counter()
+        self.payload_bytes = 0
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse'):
+        self.calls[FunctionName] += 1
+        self.payload_bytes += len(Payload)
+        result = self.handlers[FunctionName](json.loads(Payload), None)
+        body = json.dumps(result).encode('utf-8')
+        self.payload_bytes += len(body)
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200, 'Payload': io.BytesIO(body)}
+
+
+# Stands in for the boto3 module inside common.clients
+class FakeBoto3(object):
+    def __init__(self, s3, dynamo, lambda_client):
+        self.services = {'s3': s3, 'dynamodb': dynamo, 'lambda': lambda_client}
+
+    def client(self, service, region_name=None):
+        return self.services[service]
+
+    def resource(self, service, region_name=None):
+        return self.services[service]
+
+
+# Point common.clients at the fakes. Returns a function that puts boto3 back.
+def install(s3, dynamo, lambda_client):
+    real = clients.boto3
+    clients.boto3 = FakeBoto3(s3, dynamo, lambda_client)
+    clients.reset()
+
+    def uninstall():
+        clients.boto3 = real
+        clients.reset()
+    return uninstall
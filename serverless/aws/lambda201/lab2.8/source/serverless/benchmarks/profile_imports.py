@@ -0,0 +1,196 @@
+# What the webhook imports on a cold start, per request type, in milliseconds.
+# Each run is a fresh python -X importtime process (a cold container) that imports
+# webhook.py and handles one request:
+#   import          just the import, the init phase Lambda bills for
+#   ping            GitHub's ping event
+#   bad-signature   a push signed with the wrong secret
+#   other-branch    a properly signed push to a branch we don't build
+#   push            a properly signed push that gets queued (to a file queue, in AWS the SQS
+#                   client would bring boto3 in at this point)
+#   build           a push plus everything the worker needs to build (pygit2, boto3, runner, publisher)
+# We print the import time and the wall time (import plus handling the request) for each
+# request type and which of the heavy modules it loaded, then the modules behind one of them,
+# slowest first. Times are the median over --runs processes.
+# Modules common/lazy.py loads run their own code outside the import statement, so -X importtime
+# only shows what they import in turn. The wall time still covers all of it.
+# Needs the webhook's dependencies installed. Run it from the serverless directory:
+#   python benchmarks/profile_imports.py --runs 5 --detail ping
+import os
+import sys
+import hmac
+import json
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ['import', 'ping', 'bad-signature', 'other-branch', 'push', 'build']
+
+HEAVY = ['pygit2', 'boto3', 'botocore', 'subprocess', 'concurrent.futures', 'mimetypes']
+
+SECRET = 'profile-secret'
+
+MARK = '-- profile start --'
+
+# Runs in the child. Everything it needs for itself is imported before the mark so only
+# what the webhook pulls in is counted.
+CHILD = '''
+import sys, json, time, logging
+logging.basicConfig()
+sys.path.insert(0, {root!r})
+scenario, event = json.load(sys.stdin)
+sys.stderr.write({mark!r} + '\\n')
+sys.stderr.flush()
+start = time.perf_counter()
+from github_webhook import webhook
+if scenario != 'import':
+    try:
+        webhook.post(event, None)
+    except Exception:
+        pass
+if scenario == 'build':
+    webhook.pygit2.Repository
+    webhook.runner.run_command
+    webhook.publisher.publish
+    webhook.clients.boto3.client
+wall_ms = (time.perf_counter() - start) * 1000
+from common import lazy
+json.dump({{'wall_ms': wall_ms, 'loaded': [h for h in {heavy!r} if lazy.loaded(h)]}}, sys.stdout)
+'''
+
+
+def signed_event(body, github_event='push', secret=SECRET):
+    raw = json.dumps(body)
+    signature = 'sha256=' + hmac.new(secret.encode('utf-8'), raw.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {
+        'httpMethod': 'POST',
+        'headers': {'X-GitHub-Event': github_event, 'X-Hub-Signature-256': signature},
+        'queryStringParameters': None,
+        'body': raw,
+    }
+
+
+def scenario_event(scenario):
+    body = {
+        'ref': 'refs/heads/master',
+        'before': '0' * 40,
+        'after': '1' * 40,
+        'commits': [],
+        'repository': {'full_name': 'profile/blog', 'clone_url': 'https://example.com/profile/blog.git'},
+    }
+    if scenario == 'ping':
+        return signed_event(body, 'ping')
+    if scenario == 'bad-signature':
+        return signed_event(body, secret='wrong')
+    if scenario == 'other-branch':
+        body['ref'] = 'refs/heads/feature'
+    return signed_event(body)
+
+
+# Turn -X importtime output into {module: (self ms, cumulative ms, depth)} for everything after the mark
+def parse_importtime(stderr):
+    modules = {}
+    started = False
+    for line in stderr.splitlines():
+        if line == MARK:
+            started = True
+            continue
+        if not started or not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # the header line
+        name = fields[2].strip()
+        depth = (len(fields[2]) - len(fields[2].lstrip()) - 1) // 2
+        modules[name] = (self_us / 1000.0, cumulative_us / 1000.0, depth)
+    return modules
+
+
+def run_once(scenario, queue_file):
+    env = dict(os.environ)
+    env.update({
+        'github_secrets': SECRET,
+        'build_queue_file': queue_file,
+        'log_level': 'WARNING',
+        'AWS_DEFAULT_REGION': env.get('AWS_DEFAULT_REGION', 'us-east-1'),
+    })
+    env.pop('build_queue_url', None)
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD.format(root=ROOT, mark=MARK, heavy=HEAVY)],
+                           input=json.dumps([scenario, scenario_event(scenario)]).encode('utf-8'),
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=True)
+    return parse_importtime(child.stderr.decode('utf-8')), json.loads(child.stdout.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def profile(scenario, count, queue_file):
+    runs = [run_once(scenario, queue_file) for _ in range(count)]
+    samples = [modules for modules, _ in runs]
+    names = set()
+    for sample in samples:
+        names.update(sample)
+    modules = {}
+    for name in names:
+        present = [s[name] for s in samples if name in s]
+        modules[name] = {
+            'self_ms': median([p[0] for p in present]),
+            'cumulative_ms': median([p[1] for p in present]),
+            'depth': present[0][2],
+        }
+    totals = [sum(m[0] for m in s.values()) for s in samples]
+    return {
+        'scenario': scenario,
+        'import_ms': median(totals),
+        'wall_ms': median([child['wall_ms'] for _, child in runs]),
+        'modules': len(modules),
+        'heavy': runs[0][1]['loaded'],
+        'per_module': modules,
+    }
+
+
+def print_summary(results):
+    print('{0:<14} {1:>10} {2:>8} {3:>8}  {4}'.format('request', 'import ms', 'wall ms', 'modules',
+                                                     'heavy modules loaded'))
+    for r in results:
+        print('{0:<14} {1:>10.1f} {2:>8.1f} {3:>8}  {4}'.format(r['scenario'], r['import_ms'], r['wall_ms'],
+                                                             r['modules'], ', '.join(r['heavy']) or '-'))
+
+
+def print_detail(result, top):
+    print('')
+    print('Slowest modules for {0} (ms)'.format(result['scenario']))
+    print('{0:>10} {1:>10}  {2}'.format('self', 'cumulative', 'module'))
+    rows = sorted(result['per_module'].items(), key=lambda item: item[1]['cumulative_ms'], reverse=True)
+    for name, m in rows[:top]:
+        print('{0:>10.2f} {1:>10.2f}  {2}{3}'.format(m['self_ms'], m['cumulative_ms'], '  ' * m['depth'], name))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--detail', default='ping', help='the request type to break down per module')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    queue_file = os.path.join(tempfile.mkdtemp(prefix='profile-imports-'), 'builds.jsonl')
+    results = [profile(s, args.runs, queue_file) for s in args.scenarios.split(',')]
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print_summary(results)
+    for r in results:
+        if r['scenario'] == args.detail:
+            print_detail(r, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,53 @@
 from __future__ import print_function # Python 2/3 compatibility
-import boto3
 import json
 import decimal
 import uuid
 import logging
 import os
+import time
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key, Attr
+from common import clients
+from common import events
+from common import logs
+from common import cache
 
 # Setup our standard logger. We re-use the same format in most places so we have a standard presentation
+# The level comes from the log_level environment variable, see common/logs.py
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(logs.level())
 logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s'))
 
+# The global secondary index on the page attribute, sorted by the created attribute, see serverless.yml
+# Querying it only reads the comments for the page we ask for instead of the whole table
+# and hands them back oldest first, so pages of results always come in the same order.
+# Comments stored before we had created aren't in it until backfill_created has been run.
+page_index = 'page-created-index'
+
+# How many page queries get_many runs at once
+query_workers = 8
+
+# Posting a list of comments writes them with BatchWriteItem, which takes at most 25 items.
+# DynamoDB can hand some of a batch back unprocessed when it is busy, we retry those
+# with an exponential backoff starting at batch_backoff seconds, at most batch_retries times.
+batch_size = 25
+batch_retries = 5
+batch_backoff = 0.05
+
+# How many batches we write at once
+batch_workers = 4
+
+# get keeps the responses for the pages it served recently so browsers polling a popular post
+# don't all go to DynamoDB. An entry lives for cache_ttl seconds, and post drops the entry for
+# the page it adds to. Other containers can't see that (and in serverless.yml post and get are
+# separate functions) so they may serve a page without the new comment for up to cache_ttl
+# seconds. Set comment_cache_ttl to 0 to turn the cache off.
+cache_ttl = int(os.environ.get('comment_cache_ttl', 10))
+cache_size = 256
+page_cache = cache.TTLCache(max_size=cache_size, ttl=cache_ttl)
+
 
 # Firefox sends an OPTIONS request before sending a POST requestion
 # We have to respond with the below information of Firefox will never send the POST
@@ -20,89 +57,295 @@ logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s]
 # If would be more secure to define the specific domains that could call/add comments
 # but we don't know what those domains will be currently
 def cors_response(message, status_code):
-    return {
+    return cors_body(encoder.encode(message), status_code)
+
+# The same response for a body that is already JSON, see get. etag is added as the ETag
+# header (and exposed to scripts on other domains) when we have one.
+def cors_body(body, status_code, etag=None):
+    response = {
         'statusCode': str(status_code),
-        'body': json.dumps(message),
+        'body': body,
         'headers': {
             'Content-Type': 'application/json',
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type, X-Experience-API-Version,Authorization',
+            'Access-Control-Allow-Headers': 'Content-Type, X-Experience-API-Version,Authorization,If-None-Match',
             'Access-Control-Allow-Methods': 'POST, OPTIONS, GET, PUT'
             },
         }
+    if etag:
+        response['headers']['ETag'] = etag
+        response['headers']['Access-Control-Expose-Headers'] = 'ETag'
+    return response
+
+# The version of a response, a hash of exactly what we send back. Any change to the comments
+# on the page changes the body so it changes the ETag too.
+def make_etag(body):
+    return '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+# True if the If-None-Match header the browser sent includes our ETag. It can be a list and
+# browsers may send back a weak (W/) version of the tag we gave them.
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == etag or tag == 'W/' + etag:
+            return True
+    return False
+
+# Send the cached (status, body, etag) for a request, or a 304 with no body
+# when the browser already has it
+def conditional_response(cached, if_none_match):
+    status_code, body, etag = cached
+    if etag_matches(if_none_match, etag):
+        return cors_body('', 304, etag)
+    return cors_body(body, status_code, etag)
+
+# DynamoDB hands numbers back as Decimal which json can't serialize. Whole numbers become
+# an int and anything else a float. Comparing with its integral value is cheaper than
+# working out abs(o) % 1, which takes two rounds of Decimal arithmetic.
+def decimal_value(o):
+    return int(o) if o == o.to_integral_value() else float(o)
 
 # Helper class to convert a DynamoDB item to JSON.
 class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, decimal.Decimal):
-            if abs(o) % 1 > 0:
-                return float(o)
-            else:
-                return int(o)
+            return decimal_value(o)
         return super(DecimalEncoder, self).default(o)
 
+# One encoder made when the container starts. json.dumps(cls=DecimalEncoder) builds a new
+# encoder on every call, this one is re-used and still runs in C for everything but Decimals.
+# What we encode comes from DynamoDB and can't refer to itself, so we skip the check for
+# circular references which takes about a third of the time on a big list of comments.
+encoder = DecimalEncoder(check_circular=False)
+
 # Perform a scan operation on table. 
 # Can specify filter_key (col name) and its value to be filtered. 
 # This gets all pages of results. Returns list of items.
-# This is the only way to get all of the items match our particular page
-# without having to create a secondary index.
-# We also have to do this because we used a UUID for the primary key in our table
+# This reads every item in the table so only use it when you really want everything,
+# to get the comments for a page use query_page instead.
+# We used a UUID for the primary key in our table
 # We did that so people with the same name can leave a comment, or someone can leave more than one comment
 # If we had used the name or email, they would only be able to leave a single comment
 def scan_table_allpages(table, filter_key=None, filter_value=None):
+    kwargs = {}
     if filter_key and filter_value:
-        filtering_exp = boto3.dynamodb.conditions.Key(filter_key).eq(filter_value)
-        response = table.scan(FilterExpression=filtering_exp)
-    else:
-        response = table.scan()
+        # The filter has to be passed on every request, not just the first one
+        # otherwise the later pages come back unfiltered
+        kwargs['FilterExpression'] = Attr(filter_key).eq(filter_value)
+    response = table.scan(**kwargs)
 
     items = response['Items']
     while True:
         if response.get('LastEvaluatedKey'):
-            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'], **kwargs)
             items += response['Items']
         else:
             break
 
     return items
 
+# The continuation token we hand to callers is just DynamoDB's LastEvaluatedKey
+# made URL safe, so it can go straight back into a query string
+def encode_token(last_key):
+    if not last_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_key, sort_keys=True, cls=DecimalEncoder).encode('utf-8')).decode('ascii')
+
+def decode_token(token):
+    if not token:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise Exception('invalid continuation token')
+
+# Query the page index for the comments on one page. This only reads the items for that page.
+# With a limit we return at most that many items plus a token for the next set (None when there are no more),
+# without one we follow LastEvaluatedKey until we have all of them.
+def query_page(table, page, limit=None, token=None):
+    kwargs = {
+        'IndexName': page_index,
+        'KeyConditionExpression': Key('page').eq(page),
+        'ScanIndexForward': True
+    }
+    start_key = decode_token(token)
+    if limit:
+        kwargs['Limit'] = limit
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = table.query(**kwargs)
+        return response['Items'], encode_token(response.get('LastEvaluatedKey'))
+
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = table.query(**kwargs)
+    items = response['Items']
+    while response.get('LastEvaluatedKey'):
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        response = table.query(**kwargs)
+        items += response['Items']
+    return items, None
+
+# Turn a DynamoDB item into the shape we hand back to callers
+def format_comment(item):
+    return {
+        "name": 'Name: {}\n'.format(item["name"]),
+        "comment": item["comment"]
+    }
+
+# The JSON array of comments for a list of items. The formatted comments go straight into
+# a single encode so the whole array is serialized in one pass of the C encoder.
+def comments_json(items):
+    return encoder.encode([format_comment(item) for item in items])
+
+# The same array a chunk at a time, for a page too big to want the whole body in memory at once.
+# Write the pieces straight to a file or a socket as they come. Each chunk is still encoded in one go,
+# calling the encoder per comment is about twice as slow.
+def iter_comments_json(items, chunk_size=500):
+    yield '['
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(format_comment(item))
+        if len(chunk) == chunk_size:
+            yield ('' if first else ', ') + encoder.encode(chunk)[1:-1]
+            first = False
+            chunk = []
+    if chunk:
+        yield ('' if first else ', ') + encoder.encode(chunk)[1:-1]
+    yield ']'
+
+# When a comment was stored, in microseconds since the epoch. This is the sort key of the
+# page index so comments come back in the order they were made. Microseconds rather than
+# seconds so two comments on the same page practically never share a time.
+def created_now():
+    return int(time.time() * 1000000)
+
+# Check one submitted comment and turn it into the item we store.
+# Raises ValueError naming the first field that is missing.
+def new_item(entry, created=None):
+    if not isinstance(entry, dict):
+        raise ValueError('comment must be an object')
+    for field in ['page', 'name', 'comment']:
+        if not entry.get(field):
+            raise ValueError('%s not found in submission' % field)
+    # We use a UUID for the primary key so the same name can make multiple comments
+    return {
+        'uuid': str(uuid.uuid4()),
+        'name': entry['name'],
+        'comment': entry['comment'],
+        'page': entry['page'],
+        'created': created or created_now()
+    }
+
+# Give every comment stored before we recorded created one, so it shows up in the page index.
+# We don't know when they were really made so they all get a created of 0, which sorts them
+# before everything posted with a real time. Run it straight after the deploy that adds the
+# index, until then those comments don't show up (see serverless.yml):
+#   python -c "from comments import comments; from common import clients; comments.backfill_created(clients.table('hugo-comments-<id>'))"
+def backfill_created(table):
+    updated = 0
+    for item in scan_table_allpages(table):
+        if 'created' not in item:
+            table.update_item(Key={'uuid': item['uuid']},
+                              UpdateExpression='SET created = if_not_exists(created, :created)',
+                              ExpressionAttributeValues={':created': 0})
+            updated += 1
+    logger.info('Backfilled created for {0} comments'.format(updated))
+    return updated
+
+# Write up to batch_size items in one BatchWriteItem call, retrying anything DynamoDB
+# hands back unprocessed. Returns the uuids of the items that still weren't written,
+# each with the reason why.
+# If the call itself fails (DynamoDB throttling the whole batch with a
+# ProvisionedThroughputExceededException, say) everything still pending in this batch is
+# failed. Raising would lose the status of every other batch put_comments is writing.
+# The low level client the table hangs off is thread safe, the Table itself is not.
+def write_batch(table, items, retries=None, backoff=None, sleep=time.sleep):
+    retries = batch_retries if retries is None else retries
+    backoff = batch_backoff if backoff is None else backoff
+    table_name = table.name
+    pending = [{'PutRequest': {'Item': item}} for item in items]
+    error = 'not written after %d retries' % retries
+    attempt = 0
+    while pending:
+        try:
+            response = table.meta.client.batch_write_item(RequestItems={table_name: pending})
+        except Exception as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            error = 'not written: %s' % (code or e)
+            logger.error('Writing {0} comments failed: {1}'.format(len(pending), code or e))
+            break
+        pending = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not pending or attempt >= retries:
+            break
+        logger.info('Retrying {0} unprocessed comments'.format(len(pending)))
+        sleep(backoff * (2 ** attempt))
+        attempt += 1
+    return dict((request['PutRequest']['Item']['uuid'], error) for request in pending)
+
+# Store a list of comments. Every entry gets a status in the same order it was sent:
+# ok with the uuid it was stored under, invalid with the reason, or failed if DynamoDB
+# still had it unprocessed after all our retries or turned its whole batch down.
+def put_comments(table, entries):
+    results = []
+    items = []
+    # Comments in one request keep the order they were sent in
+    created = created_now()
+    for position, entry in enumerate(entries):
+        try:
+            item = new_item(entry, created + position)
+        except ValueError as e:
+            results.append({"status": "invalid", "error": str(e)})
+            continue
+        results.append({"status": "ok", "uuid": item['uuid'], "page": item['page']})
+        items.append(item)
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with ThreadPoolExecutor(max_workers=batch_workers) as pool:
+        failed = {}
+        for batch_failed in pool.map(lambda batch: write_batch(table, batch), batches):
+            failed.update(batch_failed)
+
+    for result in results:
+        if result.get('uuid') in failed:
+            result['status'] = 'failed'
+            result['error'] = failed[result['uuid']]
+    return results
+
 # This can be named whatever you want but a descriptive name is best if re-using functions
 # A common pattern is to use the matching HTTP verb for a RESTful API
+# Posting a list of comments (or {"comments": [...]}) stores them all in one go, see put_comments
 def post(event, context):
 
-    # Logging the entire event is a cheap simple way to make debugging easier
+    # Logging the entire event is a simple way to make debugging easier
     # Often times just being able to see the event information quickly can help
     # Troubleshoot an issue faster than hooking up a debugger
-    logger.info(event)
+    # It isn't free though, so we only do it at DEBUG (or for the sampled invocations)
+    # and the event is only serialized if it is actually going to be written
+    logs.sample(logger)
+    logger.debug('Event: %s', logs.payload(event))
+
+    # This came in as a proxy request, a direct API Gateway request or a boto3 invokation
+    # and the body could be a few different types. decode works out which and parses the
+    # body (once) so we always end up with a dict of parameters in event_json.
+    request = events.decode(event)
 
     # Short circuit if this is a Firefox pre-flight OPTIONS check
-    if event['httpMethod'] == "OPTIONS":
+    if request.method == "OPTIONS":
         logger.info("Allowing CORS")
         return cors_response({"message": "allowed"}, 200)
- 
-    logger.info(event['queryStringParameters'])
-    if "httpMethod" in event and event['httpMethod'] == "GET":
-        if "page" in event['queryStringParameters']:
-            try: 
-                event_json=json.loads(event['queryStringParameters'])
-            except:
-                event_json=event['queryStringParameters']
-    else: 
-        # Here we take a few steps to get the JSON into the event_json object
-        # If this came in as a proxy request, or a direct API Gateway request
-        # or a boto3 invokation the format of the body could be a few different types
-        # With this stepped approach we can gaurantee that no matter how this was caled
-        # we will have JSON in the event_json variable.
-        if "body" in event:
-            try:
-                event_json=json.loads(event['body'])
-            except:
-                pass
-        else:
-            try:
-                event_json=json.loads(event)
-            except:
-                event_json=event
+
+    logger.debug('Query: %s', logs.payload(request.query))
+
+    # A list of comments is an import or a replay, write them in batches and report how each one went
+    batch = request.body.get('comments') if isinstance(request.body, dict) else request.body
+    if isinstance(batch, list):
+        return post_batch(batch)
+
+    event_json = request.params
 
     # Short circuit to save time if we don't have any of the critical data
     try:
@@ -130,33 +373,60 @@ def post(event, context):
     # This is a boto3 "resource" the Lambda interactions that we do are a "client" type
     # It is important to notice that distinction otherwise it will error when trying
     # to initiate the setup
-    dynamodb = boto3.resource('dynamodb')
+    # The table comes from our shared registry so a warm container re-uses the
+    # resource it created on its first invocation instead of building a new one
     try:
-        table = dynamodb.Table(table_name)
+        table = clients.table(table_name)
     except:
         raise Exception('unable to connect to table for comments')
 
 
     # Put our comment into the table. We use a UUID for the primary key so the same name
     # can make multiple comments, otherwise it would be over-written every time
+    # created is when we stored it, the page index sorts on it
     response = table.put_item(
     Item={
             'uuid': str(uuid.uuid4()),
             'name': name,
             'comment': comment,
-            'page': page
+            'page': page,
+            'created': created_now()
             }
     )
 
-    # Logging is essentially free, log as much as possible, it saves troubleshooting time
-    logger.info("PutItem succeeded:")
-    # If you know you are logging JSON specifically it is really nice to specify an indent
-    # it makes reading large JSON blobs so much easier.
-    logger.info(json.dumps(response, indent=4, cls=DecimalEncoder))
+    # The page has a new comment so anything we have cached for it is out of date
+    page_cache.invalidate(page)
+
+    # The whole response is only worth logging when we are debugging
+    logger.info('PutItem succeeded for %s', page)
+    logger.debug('PutItem response: %s', logs.payload(response))
 
     # Give our CORS compliant response back, and pass a 200 status so the API gateway is happy
     return cors_response({"message": 'Comment added for %s' % page}, 200)
 
+# The batch half of post. The response lists a status for every comment we were sent,
+# 200 if all of them were stored and 207 if some of them weren't.
+def post_batch(entries):
+    try:
+        table_name = os.environ['table_name']
+    except:
+        raise Exception('DynamoDB table for comments not defined. Set the environment variable for the funcion')
+
+    try:
+        table = clients.table(table_name)
+    except:
+        raise Exception('unable to connect to table for comments')
+
+    results = put_comments(table, entries)
+    for result in results:
+        if 'page' in result:
+            page_cache.invalidate(result['page'])
+    written = len([r for r in results if r['status'] == 'ok'])
+    logger.info('Stored {0} of {1} comments'.format(written, len(results)))
+
+    status_code = 200 if written == len(results) else 207
+    return cors_response({"written": written, "failed": len(results) - written, "results": results}, status_code)
+
 # In the same file we are setting up another Lambda handler
 # We have a bunch of things in common with the other function so instead of
 # duplicating all of that code we can create another function and setup an 
@@ -168,43 +438,27 @@ def post(event, context):
 # A common pattern is to use the matching HTTP verb for a RESTful API
 def get(event, context):
 
-    # Logging the entire event is a cheap simple way to make debugging easier
+    # Logging the entire event is a simple way to make debugging easier
     # Often times just being able to see the event information quickly can help
     # Troubleshoot an issue faster than hooking up a debugger
-    logger.info(event)
+    # It isn't free though, so we only do it at DEBUG (or for the sampled invocations)
+    # and the event is only serialized if it is actually going to be written
+    logs.sample(logger)
+    logger.debug('Event: %s', logs.payload(event))
+
+    # See post, this gets us a dict of parameters however we were called
+    request = events.decode(event)
 
     # If it unlikely this is getting called by the webapp because we are
     # injecting into the markdown directly but by setting this
     # we could switch to rendering the comments on the page with JS if we wanted to
     # without having to change the function
-    if "httpMethod" in event and event['httpMethod'] == "OPTIONS":
+    if request.method == "OPTIONS":
         logger.info("Allowing CORS")
         return cors_response({"message": "allowed"}, 200)
-    
-    if "queryStringParameters" in event:
-        logger.info(event['queryStringParameters'])
-    if "httpMethod" in event and event['httpMethod'] == "GET":
-        if "page" in event['queryStringParameters']:
-            try: 
-                event_json=json.loads(event['queryStringParameters'])
-            except:
-                event_json=event['queryStringParameters']
-    else: 
-        # Here we take a few steps to get the JSON into the event_json object
-        # If this came in as a proxy request, or a direct API Gateway request
-        # or a boto3 invokation the format of the body could be a few different types
-        # With this stepped approach we can gaurantee that no matter how this was caled
-        # we will have JSON in the event_json variable.
-        if "body" in event:
-            try:
-                event_json=json.loads(event['body'])
-            except:
-                pass
-        else:
-            try:
-                event_json=json.loads(event)
-            except:
-                event_json=event
+
+    logger.debug('Query: %s', logs.payload(request.query))
+    event_json = request.params
 
     # Short circuit to save time if we don't have any of the critical data
     try:
@@ -212,6 +466,22 @@ def get(event, context):
     except:
         raise Exception('page not found in submission')
 
+    # Callers can page through the comments by passing a limit, and the cursor
+    # we gave them last time to carry on from where they left off
+    try:
+        limit = int(event_json['limit']) if event_json.get('limit') else None
+    except ValueError:
+        raise Exception('limit must be a number')
+    cursor = event_json.get('cursor')
+
+    # If we served this recently we can answer without going to DynamoDB at all.
+    # Everything cached for a page lives under the page so post can drop all of it at once.
+    if_none_match = request.header('if-none-match')
+    variant = (limit, cursor)
+    cached = page_cache.get(page)
+    if cached is not None and variant in cached:
+        return conditional_response(cached[variant], if_none_match)
+
     try:
         table_name = os.environ['table_name']
     except:
@@ -222,32 +492,92 @@ def get(event, context):
     # This is a boto3 "resource" the Lambda interactions that we do are a "client" type
     # It is important to notice that distinction otherwise it will error when trying
     # to initiate the setup
-    dynamodb = boto3.resource('dynamodb')
+    # The table comes from our shared registry so a warm container re-uses the
+    # resource it created on its first invocation instead of building a new one
     try:
-        table = dynamodb.Table(table_name)
+        table = clients.table(table_name)
     except:
         raise Exception('unable to connect to table for comments')
 
-    # Use our scan function to return a list of all the comments
-    # for a particular page that we are processing
-    items = scan_table_allpages(table, "page", page)
-    logger.info(items)
-
-    modified_items = []
-    for item in items:
-        modified_items.append({
-            "name": 'Name: {}\n'.format(item["name"]),
-            "comment": item["comment"]
-        })
+    # Query the page index for the comments on the page we are processing
+    items, next_cursor = query_page(table, page, limit, cursor)
+    logger.debug('Items: %s', logs.payload(items))
 
+    # We encode the comments straight from the items, see comments_json
+    body = comments_json(items)
 
+    # If the caller asked to paginate we wrap the comments so we can tell them
+    # where to start next time. cursor is null once there is nothing left.
+    if limit or cursor:
+        body = '{"comments": %s, "cursor": %s}' % (body, encoder.encode(next_cursor))
+        status_code = 200
     # If we find any comments return with the appropriate status code
-    if items:
-        return cors_response(modified_items, 200)
+    elif items:
+        status_code = 200
     # If not items are found use the appropriate HTTP code
     # In our local invokation of this in the webhook we aren't using the status
     # code we are counting the items that are returned but if this were being
     # called by a JS handler on the page we would need to use the status code
     # So it makes sense to future proof and return appropriately for both scenarios
     else:
-        return cors_response([], 404)
\ No newline at end of file
+        status_code = 404
+
+    response = (status_code, body, make_etag(body))
+    if cached is None:
+        cached = {}
+        page_cache.put(page, cached)
+    cached[variant] = response
+    return conditional_response(response, if_none_match)
+
+# A bulk version of get for the webhook. When we rebuild the site we need the comments for
+# every post and doing one invoke per post gets slower with every post we write.
+# This takes a list of pages and returns the comments for all of them grouped by page.
+# The page queries run concurrently so a whole site build only costs a handful of invokes.
+def get_many(event, context):
+
+    logs.sample(logger)
+
+    # This is only ever called directly by our own functions, so this is a dict or a JSON string of one
+    params = events.decode(event).params
+    try:
+        pages = set(params['pages'])
+    except:
+        raise Exception('pages not found in submission')
+
+    # With a limit we return at most that many comments per page and a cursor for every page
+    # that has more, which the caller passes back in cursors to carry on. See webhook.iter_comments
+    try:
+        limit = int(params['limit']) if params.get('limit') else None
+    except ValueError:
+        raise Exception('limit must be a number')
+    cursors = params.get('cursors') or {}
+
+    try:
+        table_name = os.environ['table_name']
+    except:
+        raise Exception('DynamoDB table for comments not defined. Set the environment variable for the funcion')
+
+    # The table comes from our shared registry so a warm container re-uses the
+    # resource it created on its first invocation instead of building a new one
+    try:
+        table = clients.table(table_name)
+    except:
+        raise Exception('unable to connect to table for comments')
+
+    # Every page we were asked about gets an entry, even if it has no comments,
+    # so the caller can tell the difference between no comments and not asked.
+    # The query only reads from the table, it doesn't change the Table object, so it is
+    # safe to share between the worker threads.
+    def comments_for(page):
+        items, next_cursor = query_page(table, page, limit, cursors.get(page))
+        return page, items, next_cursor
+
+    with ThreadPoolExecutor(max_workers=query_workers) as pool:
+        grouped = list(pool.map(comments_for, sorted(pages)))
+    logger.info('Found comments for {0} of {1} pages'.format(len([p for p, items, _ in grouped if items]), len(pages)))
+
+    # Encode each page's comments straight from the items like get does
+    body = '{%s}' % ', '.join('%s: %s' % (encoder.encode(page), comments_json(items)) for page, items, _ in grouped)
+    if limit:
+        body = '{"comments": %s, "cursors": %s}' % (body, encoder.encode({page: c for page, _, c in grouped}))
+    return cors_body(body, 200)
@@ -0,0 +1,54 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+# A small cache that lives at the module level of a handler, so it survives between
+# invocations of a warm container. Entries expire ttl seconds after they were stored and
+# once there are more than max_size of them the least recently used one goes.
+# Every container has its own copy, so anything cached can be up to ttl seconds stale
+# in the containers that didn't see the change. Keep ttl short.
+class TTLCache(object):
+    def __init__(self, max_size=256, ttl=10, clock=time.time):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is not None:
+                stored, value = entry
+                if self.clock() - stored < self.ttl:
+                    self.items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if not self.ttl or not self.max_size:
+            return
+        with self.lock:
+            self.items[key] = (self.clock(), value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,65 @@
+import os
+import logging
+import threading
+from common import lazy
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# Creating a boto3 client or resource means building a session, loading the service model and
+# setting up a connection pool. That costs tens of milliseconds every time, so we keep them
+# at the module level where they survive between invocations of a warm container.
+# Everything is keyed by (kind, service, region) so every handler can share the same cache.
+# boto3 itself is only imported when the first client is made, see common/lazy.py
+boto3 = lazy.module('boto3')
+_cache = {}
+_lock = threading.RLock()
+
+# How many clients/resources we have actually built since the container started (or since reset)
+# Tests and benchmarks use this to check that re-use is really happening
+created = 0
+
+
+def _region(region):
+    return region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+
+
+def _get(kind, service, region, factory):
+    global created
+    key = (kind, service, _region(region))
+    try:
+        return _cache[key]
+    except KeyError:
+        pass
+    # Only take the lock when we have to create something, the common warm path is a dict lookup
+    with _lock:
+        if key not in _cache:
+            logger.info('Creating boto3 {0} for {1} in {2}'.format(kind, service, key[2]))
+            _cache[key] = factory(service, region_name=key[2])
+            created += 1
+        return _cache[key]
+
+
+# The equivalent of boto3.client(service) but re-used across invocations
+def client(service, region=None):
+    return _get('client', service, region, boto3.client)
+
+
+# The equivalent of boto3.resource(service) but re-used across invocations
+def resource(service, region=None):
+    return _get('resource', service, region, boto3.resource)
+
+
+# A DynamoDB Table built from the shared resource. The Table object itself is cheap but we
+# keep it too so repeated invocations don't have to look anything up again.
+def table(name, region=None):
+    return _get('table', name, region, lambda n, region_name: resource('dynamodb', region_name).Table(n))
+
+
+# Forget everything we have created. Tests call this so each one starts from a cold container.
+def reset():
+    global created
+    with _lock:
+        _cache.clear()
+        created = 0
@@ -0,0 +1,121 @@
+import json
+import base64
+
+# Our handlers get called a few different ways and the event looks different for each:
+#  - through API Gateway (proxy integration), the JSON we care about is a string in event['body']
+#    or, for a GET, a dict in event['queryStringParameters']
+#  - invoked directly by another function or by hand, the event is the JSON itself
+#    (a dict, or a string of JSON if it was passed through something that didn't decode it)
+#  - from an SQS queue or a DynamoDB stream, the event is a batch of Records
+# decode works out which one we have once and hands back a Request, so the handlers don't
+# each have to guess with a cascade of json.loads calls.
+API_GATEWAY = 'api_gateway'
+DIRECT = 'direct'
+SQS = 'sqs'
+DYNAMODB_STREAM = 'dynamodb_stream'
+RECORDS = 'records'
+
+_RECORD_SOURCES = {
+    'aws:sqs': SQS,
+    'aws:dynamodb': DYNAMODB_STREAM,
+}
+
+_unparsed = object()
+
+# Shared by every request without headers or a query string, nothing writes to it
+_empty = {}
+
+
+# Everything a handler needs to know about the event it was called with.
+# The body is only parsed the first time something asks for it, and only once.
+class Request(object):
+    __slots__ = ('event', 'source', 'method', 'headers', 'query', 'raw_body', 'records', '_body')
+
+    def __init__(self, event, source, method=None, headers=None, query=None, raw_body=None, records=None, body=_unparsed):
+        self.event = event
+        self.source = source
+        self.method = method
+        self.headers = headers or _empty
+        self.query = query or _empty
+        self.raw_body = raw_body
+        self.records = records or ()
+        self._body = body
+
+    # The parsed JSON body. None if there wasn't one or it wasn't JSON.
+    @property
+    def body(self):
+        body = self._body
+        if body is _unparsed:
+            body = self._body = parse_json(self.raw_body)
+        return body
+
+    # The parameters of the request: the query string for a GET, otherwise the body if it is an object.
+    # Always a dict so handlers can look things up without checking the type first.
+    @property
+    def params(self):
+        if self.method == 'GET':
+            return self.query
+        body = self._body
+        if body is _unparsed:
+            body = self._body = parse_json(self.raw_body)
+        return body if isinstance(body, dict) else {}
+
+    # Look up a header without caring about its case
+    def header(self, name):
+        name = name.lower()
+        for key, value in self.headers.items():
+            if key.lower() == name:
+                return value
+        return None
+
+    def __repr__(self):
+        return 'Request(%s, %s)' % (self.source, self.method)
+
+
+# Parse a body that might already have been parsed. Strings and bytes are decoded as JSON,
+# anything else (a dict from SAM local or a test) is handed back as it is.
+def parse_json(raw):
+    if isinstance(raw, (str, bytes)):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+    return raw
+
+
+# An API Gateway proxy event. Most of our events are these so they are built with as little
+# as we can get away with, see benchmarks/bench_events.py.
+def _api_gateway(event):
+    raw_body = event.get('body')
+    if raw_body is not None and event.get('isBase64Encoded'):
+        raw_body = base64.b64decode(raw_body)
+    return Request(event, API_GATEWAY, event.get('httpMethod'), event.get('headers'),
+                   event.get('queryStringParameters'), raw_body)
+
+
+def decode(event):
+    # The common case first, before any of the checks the other shapes need
+    if type(event) is dict and 'httpMethod' in event:
+        return _api_gateway(event)
+
+    # A string event is a direct invoke of JSON that nobody decoded
+    if isinstance(event, (str, bytes)):
+        parsed = parse_json(event)
+        if not isinstance(parsed, dict):
+            return Request(event, DIRECT, raw_body=event, body=parsed)
+        event = parsed
+
+    if not isinstance(event, dict):
+        return Request(event, DIRECT, body=event)
+
+    if 'Records' in event:
+        records = event['Records'] or []
+        source = _RECORD_SOURCES.get(records[0].get('eventSource'), RECORDS) if records else RECORDS
+        return Request(event, source, records=records, body=None)
+
+    # Keys only an API Gateway proxy event has. A direct invoke could have a body key of its own
+    # (the webhook payloads we fake do not, but SAM local events do) so body counts too.
+    if 'httpMethod' in event or 'body' in event or 'requestContext' in event:
+        return _api_gateway(event)
+
+    return Request(event, DIRECT, body=event)
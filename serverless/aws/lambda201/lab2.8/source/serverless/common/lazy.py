@@ -0,0 +1,34 @@
+import sys
+import importlib.util
+
+# Importing pygit2 or boto3 takes a good part of a cold start (run benchmarks/profile_imports.py
+# to see how much), and plenty of invocations never use them: a ping, a push for a branch we
+# don't build or a badly signed request are all turned away before we touch git or AWS.
+# module() hands back the module straight away but only runs its code the first time
+# something on it is used, so those requests never pay for it:
+#   pygit2 = lazy.module('pygit2')
+#   ...
+#   pygit2.init_repository(path)   # pygit2 is really imported here
+# Anything that is already imported is returned as it is.
+def module(name):
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named {0}'.format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    lazy_module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazy_module
+    loader.exec_module(lazy_module)
+    return lazy_module
+
+
+# True once the module has really been imported, rather than just promised by module()
+def loaded(name):
+    lazy_module = sys.modules.get(name)
+    if lazy_module is None:
+        return False
+    return not isinstance(lazy_module, importlib.util._LazyModule)
@@ -0,0 +1,70 @@
+import os
+import json
+import random
+import logging
+
+# How much the handlers log is set per function with environment variables, so we can turn
+# it up while debugging without a deploy of new code:
+#  log_level        the standard level names, INFO if not set
+#  log_sample_rate  the fraction of invocations (0 to 1) that log at DEBUG anyway, so we still
+#                   see a few full events from a busy function running at INFO
+#  log_max_payload  the most characters of any one payload (an event, a response) we log
+# Full events and responses are only logged at DEBUG, and they are only serialized if the
+# record is actually going to be written out.
+DEFAULT_LEVEL = 'INFO'
+DEFAULT_SAMPLE_RATE = 0.0
+DEFAULT_MAX_PAYLOAD = 2048
+
+
+def level():
+    return os.environ.get('log_level', DEFAULT_LEVEL).upper()
+
+
+def sample_rate():
+    try:
+        return float(os.environ.get('log_sample_rate', DEFAULT_SAMPLE_RATE))
+    except ValueError:
+        return DEFAULT_SAMPLE_RATE
+
+
+def max_payload():
+    try:
+        return int(os.environ.get('log_max_payload', DEFAULT_MAX_PAYLOAD))
+    except ValueError:
+        return DEFAULT_MAX_PAYLOAD
+
+
+# Call at the start of every invocation. Sets the logger back to the configured level, or
+# to DEBUG for the sampled invocations. The level is set every time because a warm container
+# keeps whatever the last invocation left. Returns True if this invocation was sampled.
+def sample(logger=None):
+    logger = logger or logging.getLogger()
+    rate = sample_rate()
+    sampled = rate > 0 and random.random() < rate
+    logger.setLevel(logging.DEBUG if sampled else level())
+    return sampled
+
+
+# Wraps something we might log. It is only turned into a string when logging formats the
+# record, which doesn't happen at all if the level is filtered out:
+#   logger.debug('Event: %s', logs.payload(event))
+class Payload(object):
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        try:
+            text = json.dumps(self.value, default=str)
+        except (TypeError, ValueError):
+            text = repr(self.value)
+        limit = self.limit if self.limit is not None else max_payload()
+        if limit and len(text) > limit:
+            return '{0}... ({1} more characters)'.format(text[:limit], len(text) - limit)
+        return text
+
+
+def payload(value, limit=None):
+    return Payload(value, limit)
@@ -0,0 +1,102 @@
+import json
+import time
+import logging
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# A burst of comments shouldn't turn into a burst of full site rebuilds. We keep one item per
+# site in a small DynamoDB table that records which pages need rebuilding (pages), whether
+# something changed that we couldn't tie to a page (full_rebuild) and when we last started a
+# rebuild (last_trigger). Starting a rebuild takes a lease on the item, while the lease is held
+# new changes only get added to the dirty set. The rebuild gives the lease back when it is done
+# and starts another one if anything was marked dirty in the meantime. The quiet window is how
+# long a lease lasts if the rebuild never gives it back (it crashed or timed out).
+DEFAULT_WINDOW = 300
+
+
+def _error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+
+# Record that these pages need rebuilding. full means something changed that
+# we can't pin on a page (e.g. a deleted comment) so everything has to be rebuilt.
+def mark_dirty(table, site, pages, full=False):
+    updates = []
+    values = {}
+    if pages:
+        updates.append('ADD pages :pages')
+        values[':pages'] = set(pages)
+    if full:
+        updates.append('SET full_rebuild = :full')
+        values[':full'] = True
+    if not updates:
+        return
+    table.update_item(Key={'site': site},
+                      UpdateExpression=' '.join(updates),
+                      ExpressionAttributeValues=values)
+
+
+# Try to take the lease. If we get it the dirty set is cleared and handed back to us as
+# {'pages': set, 'full': bool, 'lease': last_trigger}, if someone else holds it we get None and
+# leave the dirty set alone. The lease is what release needs to give it back.
+def claim(table, site, window=DEFAULT_WINDOW, now=None):
+    now = int(now if now is not None else time.time())
+    try:
+        response = table.update_item(
+            Key={'site': site},
+            UpdateExpression='SET last_trigger = :now REMOVE pages, full_rebuild',
+            ConditionExpression='attribute_not_exists(last_trigger) OR last_trigger <= :cutoff',
+            ExpressionAttributeValues={':now': now, ':cutoff': now - window},
+            ReturnValues='ALL_OLD')
+    except Exception as e:
+        if _error_code(e) == 'ConditionalCheckFailedException':
+            return None
+        raise
+    old = response.get('Attributes', {})
+    return {'pages': set(old.get('pages', [])), 'full': bool(old.get('full_rebuild')), 'lease': now}
+
+
+# Give the lease back. Returns True if there is still work waiting for a rebuild.
+# Only the lease we took is removed. A rebuild that ran past the window may find someone else
+# took the lease since, that rebuild releases it (and picks up what is dirty) when it is done.
+def release(table, site, lease):
+    try:
+        response = table.update_item(Key={'site': site},
+                                     UpdateExpression='REMOVE last_trigger',
+                                     ConditionExpression='last_trigger = :lease',
+                                     ExpressionAttributeValues={':lease': lease},
+                                     ReturnValues='ALL_NEW')
+    except Exception as e:
+        if _error_code(e) == 'ConditionalCheckFailedException':
+            logger.info('Rebuild lease on {0} from {1} has been taken over, leaving it alone'.format(site, lease))
+            return False
+        raise
+    new = response.get('Attributes', {})
+    return bool(new.get('pages') or new.get('full_rebuild'))
+
+
+# Take the lease if we can and start one asynchronous rebuild carrying every dirty page.
+# payload is the fake webhook body, the pages, full flag and our lease are added to it.
+# Returns the payload we sent or None if a rebuild is already running.
+def trigger(table, lambda_client, function_name, site, payload, window=DEFAULT_WINDOW):
+    while True:
+        pending = claim(table, site, window)
+        if pending is None:
+            logger.info('Rebuild of {0} already running, changes will be picked up when it finishes'.format(site))
+            return None
+        if pending['pages'] or pending['full']:
+            break
+        # Someone else already built everything that was dirty, give the lease straight back.
+        # If something was marked dirty while we held it nobody else could start a rebuild, so go round again.
+        if not release(table, site, pending['lease']):
+            return None
+    # The rebuild gives the lease back when it is done, see webhook.run_pipeline
+    payload = dict(payload, pages=sorted(pending['pages']), full=pending['full'], rebuild_lease=pending['lease'])
+    logger.info('Triggering rebuild of {0} for {1} pages (full: {2})'.format(site, len(payload['pages']), payload['full']))
+    # Event is an asynchronous invoke, we don't wait around for the site to build
+    lambda_client.invoke(FunctionName=function_name,
+                         InvocationType='Event',
+                         Payload=json.dumps(payload))
+    return payload
@@ -1,22 +1,40 @@
-import boto3
 import logging
-import json
 import os
+from common import clients
+from common import rebuilds
+from common import events
+from common import logs
 
 # Setup our standard logger. We re-use the same format in most places so we have a standard presentation
+# The level comes from the log_level environment variable, see common/logs.py
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(logs.level())
 logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s'))
 
+# Pull the pages that changed out of the stream records. The table stream is set to NEW_IMAGE
+# so inserts and updates carry the page, deletes don't so we have to rebuild everything for those.
+# Returns (set of pages, True if a full rebuild is needed)
+def dirty_pages(event):
+    pages = set()
+    full = False
+    for record in events.decode(event).records:
+        try:
+            pages.add(record['dynamodb']['NewImage']['page']['S'])
+        except KeyError:
+            full = True
+    return pages, full
+
 # We are going to emulate the few bits we need to fire off the building of our hugo site
 # we will effectively fake the webhook. On the other side we check to see if this is 
 # from the mocked stream handler, if it is we do fewer checks for validity.
 def fake_webhook(event, context):
-    # We take in an event, that is the dynamodb change event but since we are building
-    # A static site that has to be compiled completely we aren't doing anything with it
-    # we are just using it as a trigger for an event that rebuilds the whole site.
-    # There are better less wasteful ways to do something like this but it works well for
-    # demonstrating how a stream event can be used as a generic trigger
+    logs.sample(logger)
+
+    # We take in an event, that is the dynamodb change event, and work out which pages
+    # have new comments. Rather than rebuilding the site for every batch we record those pages
+    # as dirty and only start a rebuild if one isn't already running. The running rebuild
+    # picks up anything marked dirty while it works, so a burst of comments costs one or two
+    # rebuilds instead of one per batch.
 
     # We need the full name of the repo, we can see this in the webhook that we logged in lab 1.3
     try:
@@ -36,6 +54,15 @@ def fake_webhook(event, context):
     except:
         raise Exception('Webhook Function not defined. Set the environment variable for the funcion')
 
+    # The table we keep the dirty pages and the rebuild lease in
+    try:
+        rebuild_table = os.environ['rebuild_table']
+    except:
+        raise Exception('Rebuild table not defined. Set the environment variable for the funcion')
+
+    # How long a rebuild holds the lease if it never gives it back, in seconds
+    window = int(os.environ.get('rebuild_window', rebuilds.DEFAULT_WINDOW))
+
     # Build our payload, using the same structure and the essential items from the real github webhook
     # Set a flag indicating that this payload is from another lambda function so that we can short circuit
     # some of our conditional login in the webhook and re-use the same function
@@ -47,14 +74,18 @@ def fake_webhook(event, context):
         "local_invoke": True
     }
 
-    # Create a lambda client. This client will inherit the IAM roles defined for the function
-    lambda_client = boto3.client('lambda')
+    # Get a lambda client. This client will inherit the IAM roles defined for the function
+    # It comes from the shared registry so warm invocations re-use the one we already made
+    lambda_client = clients.client('lambda')
+    table = clients.table(rebuild_table)
+
+    pages, full = dirty_pages(event)
+    logger.info('Marking {0} pages dirty (full: {1})'.format(len(pages), full))
+    rebuilds.mark_dirty(table, full_name, pages, full)
 
     # Using the webhook_function env variable we call a function by name with the webhook mock
-    # that we built above. We log the entire response for ease of debugging later, but don't 
-    # really have anything to do with it.
-    invoke_response = lambda_client.invoke(FunctionName=webhook_function,
-                                            Payload=json.dumps(payload))
-    logger.info(invoke_response)
+    # that we built above, plus the pages that need rebuilding. This is an asynchronous invoke
+    # so we don't sit here waiting for the site to build.
+    rebuilds.trigger(table, lambda_client, webhook_function, full_name, payload, window)
     return
 
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# The webhook has to answer GitHub (and API Gateway) quickly, but building the site takes far
+# longer than the 29 second API Gateway limit. So the webhook only checks the request is genuine
+# and drops a build job on a queue, and the worker does the actual building.
+# A job is the webhook body (the GitHub push payload, or the fake one from the stream handler)
+# plus a received timestamp so we can tell which of two jobs is newer.
+
+# Branch we build if the job doesn't say and we weren't given another default,
+# see webhook.default_branch
+DEFAULT_BRANCH = 'master'
+
+
+def make_job(body, received=None):
+    job = dict(body)
+    job['received'] = received if received is not None else time.time()
+    return job
+
+
+# The branch a job builds. Rebuilds for new comments don't come with a ref and get default.
+def job_branch(job, default=DEFAULT_BRANCH):
+    ref = job.get('ref') or ''
+    if ref.startswith('refs/heads/'):
+        return ref[len('refs/heads/'):]
+    if ref.startswith('refs/tags/'):
+        return 'tags/' + ref[len('refs/tags/'):]
+    return default
+
+
+# Jobs with the same key build the same thing, so only the newest one needs to run.
+# Pushes and comment rebuilds are kept apart because they plan their builds differently.
+def job_key(job, default=DEFAULT_BRANCH):
+    kind = 'comments' if job.get('local_invoke') else 'push'
+    return (job['repository']['full_name'], job_branch(job, default), kind)
+
+
+# Merge an older job into a newer one with the same key
+def _merge(newer, older):
+    merged = dict(newer)
+    if merged.get('local_invoke'):
+        # Rebuild every page either of them asked for
+        merged['pages'] = sorted(set(older.get('pages') or []) | set(newer.get('pages') or []))
+        merged['full'] = bool(older.get('full') or newer.get('full'))
+        # The newest rebuild's lease is the one that can still be held (see rebuilds.release),
+        # a job without one keeps the older job's
+        if merged.get('rebuild_lease') is None and older.get('rebuild_lease') is not None:
+            merged['rebuild_lease'] = older['rebuild_lease']
+    else:
+        # The newest push has the commit we want to build. We keep the commits of both so the
+        # list of changed files still covers everything since the last build (and if it gets too
+        # long the build plan knows not to trust it).
+        merged['commits'] = (older.get('commits') or []) + (newer.get('commits') or [])
+        if older.get('forced'):
+            merged['forced'] = True
+    return merged
+
+
+# Collapse a batch of jobs down to one per repo/branch/kind, keeping the newest commit.
+# Returns the jobs in the order their newest version was received.
+# default is the branch for jobs without a ref, see job_branch.
+def collapse(jobs, default=DEFAULT_BRANCH):
+    newest = {}
+    for job in sorted(jobs, key=lambda j: j.get('received', 0)):
+        key = job_key(job, default)
+        newest[key] = _merge(job, newest[key]) if key in newest else job
+    collapsed = sorted(newest.values(), key=lambda j: j.get('received', 0))
+    if len(collapsed) < len(jobs):
+        logger.info('Collapsed {0} build jobs into {1}'.format(len(jobs), len(collapsed)))
+    return collapsed
+
+
+# The queue we use in AWS. The worker function is subscribed to it so we never receive from
+# it ourselves, Lambda hands the worker batches of messages.
+class SqsQueue(object):
+    def __init__(self, queue_url, client):
+        self.queue_url = queue_url
+        self.client = client
+
+    def send(self, job):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(job))
+
+
+# An in-process queue for tests and running the whole flow locally
+class MemoryQueue(object):
+    def __init__(self):
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def send(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    def receive(self, max_jobs=10):
+        with self.lock:
+            jobs, self.jobs = self.jobs[:max_jobs], self.jobs[max_jobs:]
+        return jobs
+
+
+# A queue in a JSON lines file so separate local processes can share it. The file is locked
+# while we read or write it so a receive never sees half a job.
+class FileQueue(object):
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, job):
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(job) + '\n')
+
+    def receive(self, max_jobs=10):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            lines = [line for line in f.read().splitlines() if line]
+            f.seek(0)
+            f.truncate()
+            f.write(''.join(line + '\n' for line in lines[max_jobs:]))
+        return [json.loads(line) for line in lines[:max_jobs]]
+
+
+# Pick the queue from the environment: SQS when build_queue_url is set (in AWS),
+# a file queue when build_queue_file is set (running locally).
+def from_environment(client_factory):
+    if os.environ.get('build_queue_url'):
+        return SqsQueue(os.environ['build_queue_url'], client_factory('sqs'))
+    if os.environ.get('build_queue_file'):
+        return FileQueue(os.environ['build_queue_file'])
+    raise Exception('Build queue not defined. Set build_queue_url or build_queue_file for the function')
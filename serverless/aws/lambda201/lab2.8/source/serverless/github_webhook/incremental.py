@@ -0,0 +1,147 @@
+import os
+import logging
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# Anything under these directories (or these top level files) can change the output of
+# every page on the site, so if one of them changes we can't be clever and have to rebuild everything
+FULL_BUILD_PREFIXES = ('layouts/', 'themes/', 'archetypes/', 'static/', 'assets/', 'data/', 'i18n/', 'config/')
+FULL_BUILD_FILES = ('config.toml', 'config.yaml', 'config.yml', 'config.json')
+
+# Posts live in here, a change to one of these only affects that post and the list pages
+CONTENT_PREFIX = 'content/'
+
+# GitHub only lists the first 20 commits of a push in the payload, if we get that many
+# we can't trust the added/modified/removed lists to be complete
+PAYLOAD_COMMIT_LIMIT = 20
+
+# These outputs list or link to every post so they have to be uploaded whenever any post changes
+LIST_OUTPUTS = ('index.html', 'index.xml', 'sitemap.xml', '404.html', 'page/',
+                'posts/index.html', 'posts/index.xml', 'posts/page/', 'tags/', 'categories/')
+
+
+# Holds the outcome of comparing two commits. If full is set everything gets rebuilt and
+# the rest of the fields are ignored. Otherwise changed/removed are the content paths
+# relative to the root of the repo.
+class BuildPlan(object):
+    def __init__(self, full, changed=None, removed=None, reason=''):
+        self.full = full
+        self.changed = set(changed or [])
+        self.removed = set(removed or [])
+        self.reason = reason
+
+    def __repr__(self):
+        if self.full:
+            return 'BuildPlan(full, reason=%r)' % self.reason
+        return 'BuildPlan(changed=%r, removed=%r)' % (sorted(self.changed), sorted(self.removed))
+
+
+def full_build(reason):
+    return BuildPlan(True, reason=reason)
+
+
+# Pull the changed paths out of the push payload. GitHub gives us added/modified/removed
+# per commit so we fold them together in order, a file added and then removed in the same
+# push ends up removed. Returns None if the payload can't be trusted to be complete.
+def paths_from_payload(body):
+    commits = body.get('commits')
+    if not commits or len(commits) >= PAYLOAD_COMMIT_LIMIT or body.get('forced'):
+        return None
+    changed = set()
+    removed = set()
+    for commit in commits:
+        for path in commit.get('added', []) + commit.get('modified', []):
+            changed.add(path)
+            removed.discard(path)
+        for path in commit.get('removed', []):
+            removed.add(path)
+            changed.discard(path)
+    return changed, removed
+
+
+# The same as above but using the git objects we already have locally. This is the same as
+# running git diff --name-status old new on the command line.
+def paths_from_diff(repo, old_id, new_id):
+    changed = set()
+    removed = set()
+    diff = repo.diff(repo.get(old_id), repo.get(new_id))
+    for delta in diff.deltas:
+        if delta.status_char() == 'D':
+            removed.add(delta.old_file.path)
+        else:
+            changed.add(delta.new_file.path)
+            # A rename moves a post, so the old location has to go away
+            if delta.old_file.path != delta.new_file.path:
+                removed.add(delta.old_file.path)
+    return changed, removed
+
+
+# Decide if we can get away with an incremental build for this set of changed paths
+def plan_build(changed, removed):
+    for path in changed | removed:
+        if path in FULL_BUILD_FILES or path.startswith(FULL_BUILD_PREFIXES):
+            return full_build('%s changed' % path)
+    return BuildPlan(False,
+                     [p for p in changed if p.startswith(CONTENT_PREFIX)],
+                     [p for p in removed if p.startswith(CONTENT_PREFIX)])
+
+
+# Work out the build plan for a push. We prefer diffing the trees we already have because
+# it is exact, then fall back to the lists in the payload, and if all else fails do a full build.
+# old_id is the commit that was last published, new_id the one we are building (hex strings).
+def plan_from_push(repo, body, old_id, new_id):
+    if old_id is None:
+        return full_build('no record of the published commit')
+    if old_id == new_id:
+        return BuildPlan(False)
+    try:
+        return plan_build(*paths_from_diff(repo, old_id, new_id))
+    except Exception as e:
+        logger.info('Unable to diff {0}..{1}: {2}'.format(old_id, new_id, e))
+    # The payload only lists what changed since before, which is no use if something else was published
+    if body.get('before') != old_id:
+        return full_build('push does not start from the published commit')
+    paths = paths_from_payload(body)
+    if paths is None:
+        return full_build('push payload does not list every changed file')
+    return plan_build(*paths)
+
+
+# Comment changes from the stream tell us which pages to rebuild by name. Find the content
+# files for them so we can build an incremental plan just like we would for a push.
+def plan_for_pages(repo_path, pages):
+    pages = set(pages)
+    changed = []
+    for root, dirs, files in os.walk(os.path.join(repo_path, CONTENT_PREFIX)):
+        for name in files:
+            if name.endswith('.md') and page_name(name) in pages:
+                path = os.path.join(root, name)
+                changed.append(os.path.relpath(path, repo_path).replace(os.sep, '/'))
+    return BuildPlan(False, changed)
+
+
+# Convert a content path like content/posts/my-post.md into the directory hugo renders it to,
+# posts/my-post/. Bundles (content/posts/my-post/index.md) end up in the same place.
+def output_dir(content_path):
+    path = content_path[len(CONTENT_PREFIX):]
+    base, _ = os.path.splitext(path)
+    if os.path.basename(base) in ('index', '_index'):
+        base = os.path.dirname(base)
+    return base.lower() + '/'
+
+
+# The page name we look up comments with is the file name without the extension
+def page_name(content_path):
+    return os.path.basename(content_path).split('.')[0]
+
+
+# Returns the output paths (relative to the build directory) that need uploading and the ones that
+# need deleting for an incremental plan. Directories end with a / and mean everything under them.
+def affected_outputs(plan):
+    upload = set(LIST_OUTPUTS)
+    for path in plan.changed:
+        upload.add(output_dir(path))
+    delete = set(output_dir(path) for path in plan.removed) - upload
+    return upload, delete
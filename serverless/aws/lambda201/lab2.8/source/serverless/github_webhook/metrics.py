@@ -0,0 +1,120 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+# Every invocation writes a single JSON line to stdout in the CloudWatch embedded metric
+# format. CloudWatch Logs turns that into real metrics for us (no PutMetricData calls to wait on)
+# and the same line is still readable when we are looking through the logs.
+# https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+NAMESPACE = 'HugoBlog'
+
+# The unit we report for each kind of value we record against a phase
+UNITS = {
+    'time': 'Milliseconds',
+    'bytes': 'Bytes',
+    'items': 'Count',
+}
+
+# Collectors that want a copy of every record we emit. Benchmarks register one so they
+# can aggregate over many runs without having to parse stdout.
+_collectors = []
+
+
+# Records the wall time, bytes and item counts of each phase of one invocation
+class Metrics(object):
+    def __init__(self, dimensions=None, namespace=NAMESPACE):
+        self.namespace = namespace
+        self.dimensions = dimensions or {}
+        self.values = {}
+        self.properties = {}
+
+    # Time a block of work. The phase dict we yield can be given bytes and items counts,
+    # e.g. phase['bytes'] = 1024 and they are reported alongside the time.
+    @contextmanager
+    def phase(self, name):
+        values = {}
+        start = time.time()
+        try:
+            yield values
+        finally:
+            values['time'] = round((time.time() - start) * 1000, 3)
+            for kind, value in values.items():
+                self.record(name, kind, value)
+
+    def record(self, phase, kind, value):
+        key = '{0}.{1}'.format(phase, kind)
+        self.values[key] = self.values.get(key, 0) + value
+
+    # Extra context that goes into the log line but isn't a metric, like the build plan
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def to_emf(self, timestamp=None):
+        metrics = [{'Name': key, 'Unit': UNITS.get(key.rsplit('.', 1)[-1], 'None')} for key in sorted(self.values)]
+        record = {
+            '_aws': {
+                'Timestamp': int((timestamp or time.time()) * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [sorted(self.dimensions)],
+                    'Metrics': metrics,
+                }],
+            },
+        }
+        record.update(self.properties)
+        record.update(self.dimensions)
+        record.update(self.values)
+        return record
+
+    # Write the record to stdout (Lambda sends that to CloudWatch Logs) and to any collectors
+    def emit(self, stream=None):
+        record = self.to_emf()
+        (stream or sys.stdout).write(json.dumps(record) + '\n')
+        for collector in _collectors:
+            collector.add(record)
+        return record
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = int(round((len(ordered) - 1) * percent / 100.0))
+    return ordered[index]
+
+
+# Aggregates the records from many runs. Use it as a context manager so it only
+# listens while the code you are measuring runs:
+#   with metrics.Collector() as collector:
+#       ...
+#   print(collector.summary())
+class Collector(object):
+    def __init__(self):
+        self.records = []
+
+    def __enter__(self):
+        _collectors.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _collectors.remove(self)
+        return False
+
+    def add(self, record):
+        self.records.append(record)
+
+    # Every metric we have seen with its count, mean, p50, p99 and max
+    def summary(self):
+        series = {}
+        for record in self.records:
+            for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']:
+                series.setdefault(metric['Name'], []).append(record[metric['Name']])
+        summary = {}
+        for name, values in series.items():
+            summary[name] = {
+                'count': len(values),
+                'mean': sum(values) / float(len(values)),
+                'p50': _percentile(values, 50),
+                'p99': _percentile(values, 99),
+                'max': max(values),
+            }
+        return summary
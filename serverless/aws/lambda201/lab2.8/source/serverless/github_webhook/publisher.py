@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import logging
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# We keep a record of what we uploaded last time next to the site itself. files maps every
+# object key to the hash of its content so we can tell what changed without listing
+# or downloading anything else from the bucket. commit and render_key say what the site was
+# built from. Every container publishes to the same bucket so this, not what one container
+# remembers, is what the next build has to start from.
+MANIFEST_KEY = '.publish-manifest.json'
+
+# How many uploads we run at once. boto3 clients are thread safe and most of the
+# time is spent waiting on the network so this can be a lot higher than the CPU count.
+DEFAULT_WORKERS = 16
+
+# delete_objects takes at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+
+
+# Hash a file in chunks so we never have to hold a large asset in memory
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Walk the build directory and return {key: hash} for every file in it.
+# Keys always use / regardless of the platform so they match S3.
+# With a scope (see in_scope) we only walk and hash what is inside it, an incremental
+# publish shouldn't have to read the whole site.
+def local_manifest(local_path, scope=None):
+    manifest = {}
+    if scope is None:
+        tops = [local_path]
+    else:
+        tops = []
+        for path in scope:
+            full_path = os.path.join(local_path, path)
+            if path.endswith('/'):
+                tops.append(full_path)
+            elif os.path.isfile(full_path):
+                manifest[path] = hash_file(full_path)
+    for top in tops:
+        for root, dirs, files in os.walk(top):
+            for name in files:
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, local_path).replace(os.sep, '/')
+                manifest[key] = hash_file(path)
+    return manifest
+
+
+# List every key in the bucket. We only need this the first time we publish to a bucket
+# that was filled some other way, so we know which objects are orphans.
+def list_keys(s3, bucket):
+    keys = []
+    kwargs = {'Bucket': bucket}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        keys += [o['Key'] for o in response.get('Contents', [])]
+        if not response.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+    return keys
+
+
+# Read the manifest from the last publish. If there isn't one we don't know the hash of anything
+# in the bucket, so every existing key gets a hash of None which forces it to be re-uploaded
+# (or deleted if we don't have it any more), and we don't know what it was built from.
+def remote_manifest(s3, bucket):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=MANIFEST_KEY)
+    except Exception as e:
+        code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+        if code in ('NoSuchKey', '404'):
+            logger.info('No publish manifest found in {0}, uploading everything'.format(bucket))
+            files = dict((key, None) for key in list_keys(s3, bucket) if key != MANIFEST_KEY)
+            return {'files': files, 'commit': None, 'render_key': None}
+        raise
+    manifest = json.loads(response['Body'].read())
+    # Manifests written before we recorded the commit are just the files
+    if not isinstance(manifest.get('files'), dict):
+        manifest = {'files': manifest}
+    manifest.setdefault('commit', None)
+    manifest.setdefault('render_key', None)
+    return manifest
+
+
+# Does the key fall under any of the given paths. Paths ending in / match everything below them.
+def in_scope(key, paths):
+    for path in paths:
+        if key == path or (path.endswith('/') and key.startswith(path)):
+            return True
+    return False
+
+
+# Compare the two manifests and return (keys to upload, keys to delete, number unchanged).
+# If scope is given only keys inside it are considered, everything else keeps its old entry.
+def plan_publish(local, remote, scope=None):
+    if scope is not None:
+        local = dict((k, v) for k, v in local.items() if in_scope(k, scope))
+        remote = dict((k, v) for k, v in remote.items() if in_scope(k, scope))
+    upload = sorted(k for k, v in local.items() if remote.get(k) != v)
+    delete = sorted(k for k in remote if k not in local)
+    return upload, delete, len(local) - len(upload)
+
+
+def upload_file(s3, bucket, local_path, key):
+    # upload_file doesn't guess a content type the way the CLI does, without this
+    # the browser would download our html instead of showing it
+    content_type = mimetypes.guess_type(key)[0] or 'binary/octet-stream'
+    path = os.path.join(local_path, key)
+    s3.upload_file(path, bucket, key, ExtraArgs={'ContentType': content_type})
+    return os.path.getsize(path)
+
+
+# Remove keys from the bucket. Returns the ones S3 couldn't delete.
+def delete_keys(s3, bucket, keys):
+    failed = []
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True})
+        for error in response.get('Errors', []):
+            logger.error('Unable to delete {0}: {1}'.format(error.get('Key'), error.get('Message', error.get('Code'))))
+            failed.append(error['Key'])
+    return failed
+
+
+# Publish the contents of local_path to bucket only touching objects that changed.
+# scope limits the publish to part of the site (see incremental.affected_outputs).
+# New and changed files go up first and orphans are only removed after that, so the site is
+# never missing pages while we publish. The manifest goes last. Anything we failed to delete
+# stays in it so the next publish tries again instead of forgetting about it.
+# remote is the manifest if the caller already read it, commit and render_key are recorded in
+# the new one (see MANIFEST_KEY).
+def publish(s3, bucket, local_path, scope=None, workers=DEFAULT_WORKERS, remote=None, commit=None, render_key=None):
+    local = local_manifest(local_path, scope)
+    if remote is None:
+        remote = remote_manifest(s3, bucket)
+    remote = remote['files']
+    upload, delete, unchanged = plan_publish(local, remote, scope)
+    logger.info('Publishing to {0}: {1} to upload, {2} to delete, {3} unchanged'.format(
+        bucket, len(upload), len(delete), unchanged))
+
+    uploaded_bytes = 0
+    if upload:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for size in pool.map(lambda key: upload_file(s3, bucket, local_path, key), upload):
+                uploaded_bytes += size
+
+    failed = set(delete_keys(s3, bucket, delete))
+
+    # Merge so a scoped publish doesn't forget about the rest of the site
+    manifest = dict(remote)
+    for key in delete:
+        if key not in failed:
+            manifest.pop(key, None)
+    for key in upload:
+        manifest[key] = local[key]
+    manifest = {'files': manifest, 'commit': commit, 'render_key': render_key}
+    s3.put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest, sort_keys=True).encode('utf-8'),
+                  ContentType='application/json')
+
+    return {
+        'uploaded': len(upload),
+        'deleted': len(delete) - len(failed),
+        'unchanged': unchanged,
+        'bytes': uploaded_bytes,
+    }
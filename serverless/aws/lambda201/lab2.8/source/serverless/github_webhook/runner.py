@@ -0,0 +1,77 @@
+import os
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# How long a single command gets before we kill it, in seconds. Keep this under
+# the function timeout so we fail with a useful error instead of being cut off by Lambda.
+DEFAULT_TIMEOUT = 240
+
+# How many commands run_commands runs at once
+DEFAULT_CONCURRENCY = 2
+
+
+def _kill(process):
+    # The command runs in its own process group so this also gets anything it started
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+# Run a command and log its output a line at a time as it is produced, so a big build never
+# sits in memory and we can watch it in the logs while it runs. stderr is merged into the same
+# stream so errors show up next to the output that caused them.
+# command can be a list of arguments or a string which is split like the shell would.
+# Raises subprocess.TimeoutExpired if it runs longer than timeout and
+# subprocess.CalledProcessError if it exits with anything but 0.
+def run_command(command, timeout=DEFAULT_TIMEOUT, cwd=None):
+    args = shlex.split(command) if isinstance(command, str) else list(command)
+    name = os.path.basename(args[0])
+    logger.info("Running shell command: \"{0}\"".format(' '.join(args)))
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
+                               universal_newlines=True, bufsize=1, start_new_session=True)
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        _kill(process)
+
+    timer = threading.Timer(timeout, expire) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    try:
+        for line in process.stdout:
+            logger.info('[%s] %s', name, line.rstrip('\n'))
+        returncode = process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        process.stdout.close()
+
+    if timed_out.is_set():
+        logger.error("Command timed out after {0}s: {1}".format(timeout, ' '.join(args)))
+        raise subprocess.TimeoutExpired(args, timeout)
+    if returncode != 0:
+        logger.error("Command exited with {0}: {1}".format(returncode, ' '.join(args)))
+        raise subprocess.CalledProcessError(returncode, args)
+    return True
+
+
+# Run independent commands at the same time, at most concurrency at once.
+# Every command is allowed to finish, then the first failure (in the order given) is raised.
+def run_commands(commands, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_command, command, timeout) for command in commands]
+    for future in futures:
+        future.result()
+    return True
@@ -0,0 +1,77 @@
+import os
+import mmap
+import logging
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# Posts opt in to comments by having this heading in them
+MARKER = b'### Comments'
+
+# Results from earlier scans, kept at the module level so they survive between warm invocations.
+# Keyed by path and then either the git blob id of the file or its mtime and size, so if the
+# file changes the old result simply stops matching.
+_cache = {}
+
+# How many files we actually had to open on the last scan, handy for checking the cache works
+last_reads = 0
+
+
+# Search for the marker without reading the whole file into Python. mmap lets the OS page in
+# only as much as find needs and we stop at the first match.
+def has_marker(path):
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m.find(MARKER) != -1
+        except ValueError:
+            # mmap can't map an empty file, and an empty file can't have the marker
+            return False
+
+
+# Walk the tree with scandir, which gives us the file type and stat info without an extra
+# system call per file. Only files ending in .md are returned.
+def markdown_files(root):
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            for found in markdown_files(entry.path):
+                yield found
+        elif entry.name.endswith('.md') and entry.is_file():
+            yield entry
+
+
+# Return the paths of every markdown file under root that has the comments marker.
+# blob_ids is an optional dict of path to git blob id. When we have one for a file we key the cache on it,
+# otherwise we use its mtime and size. only_files restricts the scan to those paths.
+def find_marked(root, blob_ids=None, only_files=None):
+    global last_reads
+    last_reads = 0
+    marked = []
+    for entry in markdown_files(root):
+        if only_files is not None and entry.path not in only_files:
+            continue
+        blob_id = blob_ids.get(entry.path) if blob_ids else None
+        if blob_id is not None:
+            key = ('blob', blob_id)
+        else:
+            stat = entry.stat()
+            key = ('stat', stat.st_mtime_ns, stat.st_size)
+        cached = _cache.get(entry.path)
+        if cached is not None and cached[0] == key:
+            found = cached[1]
+        else:
+            found = has_marker(entry.path)
+            last_reads += 1
+            _cache[entry.path] = (key, found)
+        if found:
+            marked.append(entry.path)
+    return marked
+
+
+def reset():
+    _cache.clear()
@@ -0,0 +1,86 @@
+import hmac
+import hashlib
+
+# GitHub signs every delivery with the webhook secret and sends the result in a header.
+# X-Hub-Signature-256 (HMAC sha256) is the one GitHub recommends, X-Hub-Signature (HMAC sha1)
+# is still sent for older integrations. We check the strongest one the request carries.
+# Header names are lower case here, API Gateway doesn't promise to keep the case GitHub used.
+ALGORITHMS = (
+    ('x-hub-signature-256', 'sha256', hashlib.sha256),
+    ('x-hub-signature', 'sha1', hashlib.sha1),
+)
+
+# Parsed key sets, keyed by the raw github_secrets string. The environment doesn't change
+# during the life of a container so we only split and prepare the keys on a cold start.
+_keysets = {}
+
+
+# The webhook secrets for this function, split on , like the github_secrets environment variable.
+# For each algorithm we keep an HMAC per key with the key already absorbed, so verifying a request
+# only costs a copy of that HMAC and a pass over the body.
+class KeySet(object):
+    def __init__(self, secrets):
+        self.keys = [k.encode('utf-8') for k in secrets.split(',') if k]
+        self.prepared = {}
+        # The key that last matched for each repo. Each repo normally has its own secret so
+        # trying that one first means a valid delivery usually takes a single HMAC however many
+        # keys we have.
+        self.hints = {}
+
+    def prepared_for(self, name, digestmod):
+        prepared = self.prepared.get(name)
+        if prepared is None:
+            prepared = [hmac.new(k, digestmod=digestmod) for k in self.keys]
+            self.prepared[name] = prepared
+        return prepared
+
+    # Check signature ('sha256=<hex>') against body (bytes) with every key until one matches.
+    # Each comparison is constant time so we don't leak how much of a signature was right.
+    def verify(self, body, name, digestmod, signature, hint=None):
+        prepared = self.prepared_for(name, digestmod)
+        expected = signature.encode('utf-8')
+        order = list(range(len(prepared)))
+        first = self.hints.get(hint)
+        if first is not None and first < len(order):
+            order.remove(first)
+            order.insert(0, first)
+        for i in order:
+            mac = prepared[i].copy()
+            mac.update(body)
+            computed = (name + '=' + mac.hexdigest()).encode('ascii')
+            if hmac.compare_digest(computed, expected):
+                if hint is not None:
+                    self.hints[hint] = i
+                return True
+        return False
+
+
+def keyset(secrets):
+    keys = _keysets.get(secrets)
+    if keys is None:
+        keys = KeySet(secrets)
+        _keysets[secrets] = keys
+    return keys
+
+
+# The body exactly as GitHub signed it. API Gateway hands us a string (events.decode has already
+# undone any base64). GitHub sends UTF-8 so that is how we turn it back into bytes.
+def raw_body(request):
+    body = request.raw_body or ''
+    if isinstance(body, bytes):
+        return body
+    return body.encode('utf-8')
+
+
+# True if the request (an events.Request) carries a signature that matches one of our keys.
+# hint is anything that identifies who sent it (we use the repo name) so we can try their key first next time.
+def verify(request, secrets, hint=None):
+    for header_name, name, digestmod in ALGORITHMS:
+        signature = request.header(header_name)
+        if signature is not None:
+            return keyset(secrets).verify(raw_body(request), name, digestmod, signature, hint)
+    return False
+
+
+def reset():
+    _keysets.clear()
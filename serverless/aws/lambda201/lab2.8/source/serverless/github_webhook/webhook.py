@@ -1,179 +1,410 @@
-from pygit2 import discover_repository, Repository, clone_repository, GIT_RESET_HARD
-import boto3
 import os
 import stat
 import shutil
 import logging
-import hmac
-import hashlib
 import json
-import subprocess
+import hashlib
+from github_webhook import incremental
+from github_webhook import metrics
+from github_webhook import scanner
+from github_webhook import build_queue
+from github_webhook import workspace
+from github_webhook import signatures
+from common import clients
+from common import rebuilds
+from common import events
+from common import logs
+from common import lazy
+
+# pygit2 (libgit2 and its TLS setup) and the modules we only need for a build (subprocess and
+# the thread pools behind runner and publisher) are only imported the first time we use them.
+# Pings, pushes for branches we don't build and bad signatures are answered without them,
+# see benchmarks/profile_imports.py for what each one costs.
+pygit2 = lazy.module('pygit2')
+inspect = lazy.module('inspect')
+runner = lazy.module('github_webhook.runner')
+publisher = lazy.module('github_webhook.publisher')
 
 # Setup our standard logger. We re-use the same format in most places so we have a standard presentation
+# The level comes from the log_level environment variable, see common/logs.py
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(logs.level())
 logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s'))
 
-# If true the function will delete all files at the end of each run
+# If true the function will delete the workspace at the end of each run
 cleanup = False
 
 # If true the function will hard reset the repo to head after each run
-# This is needed because we are injecting comments directly into the markdown
-# before compiling the site with Hugo. If we don't do this git will error
-# with an error about locally changed files
-reset = True
-
-# The path that we will build hugo into for uploading to S3
-build_path = "/tmp/hugo/public"
-
-# In a real implementation this would be dynamic but we know we are only triggering
-# on master. In a larger environment you might have different functions of logic
-# depending on the branch that you were receiving a webhook for.
-branch_name = "master"
+# We used to need this because we injected comments directly into the markdown
+# and git would error about locally changed files on the next run. Comments now go
+# into a data directory git ignores so the working tree is never touched.
+reset = False
+
+# Where we write the comments for each page, relative to the repo. Hugo loads everything in
+# data/ so the theme can read them as .Site.Data.comments
+comment_data_dir = "data/comments"
+
+# If true we compare the new commit against the one we last built in this container
+# and only inject comments into and upload the posts that changed. Changes to layouts,
+# themes or config still trigger a full build.
+incremental_builds = True
+
+# Pushes are built for the branch in their ref as long as it is in the build_branches
+# environment variable (defaults to this branch).
+branch_name = build_queue.DEFAULT_BRANCH
+
+# Every repo/branch we build gets its own checkout and output directory under /tmp. The manager
+# lives at the module level so warm invocations re-use the open Repository handles, and it evicts
+# the least recently used checkouts when /tmp starts to fill up.
+workspaces = workspace.WorkspaceManager()
+
+# Every branch publishes to the root of output_bucket and shares its publish manifest, so a
+# second branch would replace the live site with its own output and incremental builds of the
+# first would then patch on top of it. Until each branch has somewhere of its own to go we
+# only take one.
+def build_branches():
+    branches = [b.strip() for b in os.environ.get('build_branches', branch_name).split(',') if b.strip()]
+    if len(branches) > 1:
+        raise Exception('Only one branch can be published to the output bucket, build_branches is %s' % ', '.join(branches))
+    return branches
+
+# The branch we build when we aren't told one, rebuilds for new comments don't come with a ref.
+# That is the one in build_branches, so a site built from main gets its comments on main too.
+def default_branch():
+    branches = build_branches()
+    return branches[0] if branches else branch_name
+
+# Open a checkout left in /tmp by an earlier invocation
+# discover_repository returns None when there isn't one, and newer pygit2 versions happily
+# hand back an empty in-memory repo for Repository(None), so we have to check ourselves
+def open_repo(repo_path):
+    path = pygit2.discover_repository(repo_path)
+    if path is None:
+        raise KeyError('No repo at {0}'.format(repo_path))
+    return pygit2.Repository(path)
+
+# How much history we fetch. We only ever build the tip of the branch so one commit is enough.
+# 0 fetches everything, the same as a normal clone.
+fetch_depth = 1
+
+# pygit2 only supports shallow fetches from 1.14 (libgit2 1.7), older versions still benefit
+# from only fetching the one branch. We look at Remote.fetch once, on the first fetch.
+_fetch_supports_depth = None
+
+def fetch_supports_depth():
+    global _fetch_supports_depth
+    if _fetch_supports_depth is None:
+        try:
+            _fetch_supports_depth = 'depth' in inspect.signature(pygit2.Remote.fetch).parameters
+        except (TypeError, ValueError):
+            # No signature to look at, go by the version instead
+            version = tuple(int(v) for v in pygit2.__version__.split('.')[:2] if v.isdigit())
+            _fetch_supports_depth = version >= (1, 14)
+        if not _fetch_supports_depth:
+            logger.info('pygit2 {0} can not fetch shallow, fetching the whole branch'.format(pygit2.__version__))
+    return _fetch_supports_depth
+
+# libgit2 calls transfer_progress as the pack downloads so we can see how much a fetch cost us
+# The class is made on the first fetch, subclassing RemoteCallbacks up here would import pygit2
+_transfer_progress = None
+
+def transfer_progress():
+    global _transfer_progress
+    if _transfer_progress is None:
+        class TransferProgress(pygit2.RemoteCallbacks):
+            def __init__(self):
+                super(TransferProgress, self).__init__()
+                self.received_bytes = 0
+                self.received_objects = 0
+                self.total_objects = 0
+
+            def transfer_progress(self, stats):
+                self.received_bytes = stats.received_bytes
+                self.received_objects = stats.received_objects
+                self.total_objects = stats.total_objects
+        _transfer_progress = TransferProgress
+    return _transfer_progress()
+
+# The refspec for just the branch we build. The default refspec (+refs/*:refs/*) pulls down
+# every branch, tag and pull request ref in the repo which we never look at.
+def branch_refspec(branch_name):
+    if branch_name.startswith('tags/'):
+        return '+refs/{0}:refs/{0}'.format(branch_name)
+    return '+refs/heads/{0}:refs/remotes/origin/{0}'.format(branch_name)
 
-# Initialized a repo, similar to running git init on the command line
-def init_remote(repo, name, url):
-    remote = repo.remotes.create(name, url, '+refs/*:refs/*')
+# Configured a remote/upstream association. The same as setting a remote on your repo via cli
+def init_remote(repo, name, url, branch_name):
+    remote = repo.remotes.create(name, url, branch_refspec(branch_name))
     return remote
 
-# Configured a remote/upstream association. The same as setting a remote on your repo via cli
-def create_repo(repo_path, remote_url):
+# Initialized a repo, similar to running git init on the command line
+# We don't clone because that would download the whole history of every branch,
+# pull_repo fetches only what we need into it
+def create_repo(repo_path, remote_url, branch_name):
     if os.path.exists(repo_path):
         logger.info('Cleaning up repo path...')
         shutil.rmtree(repo_path)
-    repo = clone_repository(remote_url, repo_path)
+    repo = pygit2.init_repository(repo_path)
+    init_remote(repo, 'origin', remote_url, branch_name)
 
     return repo
 
+# Fetch only the branch we build at a shallow depth. The objects end up in packfiles in the repo
+# under /tmp which survives between warm invocations, so later fetches only download what is new.
+def fetch_branch(remote, branch_name):
+    progress = transfer_progress()
+    refspecs = [branch_refspec(branch_name)]
+    if fetch_supports_depth():
+        remote.fetch(refspecs, callbacks=progress, depth=fetch_depth)
+    else:
+        remote.fetch(refspecs, callbacks=progress)
+    logger.info('Fetched {0} of {1} objects ({2} bytes)'.format(
+        progress.received_objects, progress.total_objects, progress.received_bytes))
+    return progress
+
 # Pull the repo from the remote. Similar to doing a git clone, or git pull via the cli
+# Returns the transfer progress of the fetch so the caller can see what it cost
 def pull_repo(repo, branch_name, remote_url):
-    remote_exists = False
-    for r in repo.remotes:
-        if r.url == remote_url:
-            remote_exists = True
-            remote = r
-    if not remote_exists:
-        remote = repo.create_remote('origin', remote_url)
+    # Every workspace is one repo with one remote called origin, so we can look it up by name
+    try:
+        remote = repo.remotes['origin']
+        if remote.url != remote_url:
+            repo.remotes.set_url('origin', remote_url)
+            remote = repo.remotes['origin']
+    except KeyError:
+        remote = init_remote(repo, 'origin', remote_url, branch_name)
     logger.info('Fetching and merging changes from %s branch %s', remote_url, branch_name)
-    remote.fetch()
+    progress = fetch_branch(remote, branch_name)
     if(branch_name.startswith('tags/')):
         ref = 'refs/' + branch_name
     else:
         ref = 'refs/remotes/origin/' + branch_name
     remote_branch_id = repo.lookup_reference(ref).target
     repo.checkout_tree(repo.get(remote_branch_id))
-    repo.head.set_target(remote_branch_id)
-    return repo
+    # A freshly initialised repo has no HEAD yet so we point it straight at the commit we built
+    repo.set_head(remote_branch_id)
+    return progress
 
-# This requires Python 3.5 or above, subprocess runs a command as if it were in the shell
-# It also gives us the standard and error output for logging
-def run_command(command):
-    command_list = command.split(' ')
-    try:
-        logger.info("Running shell command: \"{0}\"".format(command))
-        result = subprocess.run(command_list, stdout=subprocess.PIPE);
-        logger.info("Command output:\n---\n{0}\n---".format(result.stdout.decode('UTF-8')))
-    except Exception as e:
-        logger.error("Exception: {0}".format(e))
-        raise e
-    return True
+# How long hugo gets to build the site before we give up, in seconds
+build_timeout = 240
+
+# Where the hugo layer puts the binary. The local benchmarks point this at a stand-in.
+hugo_binary = "/opt/hugo"
 
+# If true we remember what each workspace last rendered and skip hugo when nothing it reads
+# has changed since, see render_key. A comment rebuild where the comments came back the same
+# or a push that only touched files hugo ignores then costs no build at all.
+render_cache = True
 
 # Builds a hugo website using the source (the repo)
 # and destination for the public content
-def build_hugo(source_dir, destination_dir,debug=False):
+# The output is streamed to the log as hugo runs and a failed build raises instead
+# of carrying on and publishing whatever was left in the destination
+# Hugo keeps processed resources in cache_dir, we keep that with the workspace so
+# warm invocations don't redo them
+def build_hugo(source_dir, destination_dir,debug=False, cache_dir=None):
     logger.info("Building Hugo site")
-    run_command("/opt/hugo -s {0} -d {1}".format(source_dir,destination_dir))
-    run_command("ls -l {0}".format(destination_dir))
-
-# Uploads the built website to S3. We are using the AWS CLI because it has
-# the sync feature which is a lot faster than doing a pure python implementation
-# It might seem like an anti-pattern to shell out in a function when you could
-# Do the same thing purely in code, but time is money on Lambda and this is
-# significantly faster than doing a file at a time walking the directory
-def upload_to_s3(local_path,s3_path):
+    command = [hugo_binary, "-s", source_dir, "-d", destination_dir]
+    if cache_dir:
+        command += ["--cacheDir", cache_dir]
+    runner.run_command(command, timeout=build_timeout)
+    runner.run_command(["ls", "-l", destination_dir], timeout=10)
+
+# Everything hugo reads in one hash: the git tree of the commit we checked out (every tracked
+# file, content, layouts, themes and config alike) plus the comment data files, which git
+# doesn't know about. The same key means hugo would write out exactly what is already there.
+def render_key(repo, data_path):
+    digest = hashlib.sha1()
+    digest.update(hugo_binary.encode('utf-8'))
+    digest.update(str(repo.get(repo.head.target).tree_id).encode('ascii'))
+    for name in sorted(os.listdir(data_path)):
+        digest.update(b'\0' + name.encode('utf-8') + b'\0')
+        with open(os.path.join(data_path, name), 'rb') as datafile:
+            digest.update(datafile.read())
+    return digest.hexdigest()
+
+# Uploads the built website to S3. We keep a manifest of content hashes in the bucket
+# so only new or changed files are uploaded and only files that disappeared are deleted.
+# The site stays up the whole time instead of being wiped and re-synced.
+# If scope is given (an incremental build) only those output paths are published.
+def upload_to_s3(local_path, s3_path, scope=None, remote=None, commit=None, render_key=None):
     logger.info('Uploading Hugo site to S3: {0}'.format(s3_path))
-    run_command('/opt/aws s3 rm s3://{0} --recursive'.format(s3_path))
-    run_command('/opt/aws s3 sync {0} s3://{1}'.format(local_path,s3_path))
-    run_command('/opt/aws s3 ls {0}'.format(s3_path))
+    s3_client = clients.client('s3')
+    result = publisher.publish(s3_client, s3_path, local_path, scope,
+                               remote=remote, commit=commit, render_key=render_key)
+    logger.info('Published {uploaded} files ({bytes} bytes), deleted {deleted}, {unchanged} unchanged'.format(**result))
+    return result
+
+
+# How many pages we ask the comments function about in one invoke. This keeps each
+# response comfortably under the 6MB Lambda payload limit.
+comment_batch_size = 100
+
+# The most comments we ask for per page in one invoke. A page with more comes back with a
+# cursor and we fetch the rest of it in later invokes, so one busy post can't blow the limit.
+comment_page_size = 500
+
+# Find every post that has a comments section. We walk the hugo posts directory and find every .md file,
+# strip the file type off and use that as the key to look for comments with.
+# The scanner remembers what it found for each file (by git blob id when we have one) so
+# posts that haven't changed since the last warm invocation don't get read again.
+# Returns a dict of page name to the list of files for it.
+def find_comment_pages(local_path, only_files=None, blob_ids=None):
+    pages = {}
+    for file_path in scanner.find_marked(local_path, blob_ids, only_files):
+        file_name = os.path.basename(file_path).split('.')[0]
+        pages.setdefault(file_name, []).append(file_path)
+    logger.info('Found {0} posts with comments, read {1} files'.format(len(pages), scanner.last_reads))
+    return pages
+
+# The git blob id of every file under prefix in the index, keyed by its path on disk.
+# Right after checkout the files match the index so the blob id identifies their content
+# without us having to read them.
+def index_blob_ids(repo, repo_path, prefix):
+    blob_ids = {}
+    for entry in repo.index:
+        if entry.path.startswith(prefix):
+            blob_ids[os.path.join(repo_path, entry.path)] = str(entry.id)
+    return blob_ids
+
+# Fetch the comments for a set of pages from the bulk comments function, a batch of pages
+# and at most comment_page_size comments per page at a time. Yields (page, comments) as soon
+# as we have every comment for a page, so we only ever hold the pages that are still coming.
+# Comments come oldest first.
+def iter_comments(pages, comment_function):
+    lambda_client = clients.client('lambda')
+    pending = [(page, None) for page in sorted(pages)]
+    partial = {}
+    while pending:
+        batch, pending = pending[:comment_batch_size], pending[comment_batch_size:]
+        payload = {
+            "pages": [page for page, _ in batch],
+            "limit": comment_page_size,
+            "cursors": {page: cursor for page, cursor in batch if cursor}
+        }
+        invoke_response = lambda_client.invoke(FunctionName=comment_function, Payload=json.dumps(payload))
+        lambda_response = json.loads(invoke_response['Payload'].read())
+        result = json.loads(lambda_response["body"])
+        for page, _ in batch:
+            page_comments = partial.pop(page, [])
+            page_comments.extend(result["comments"].get(page, []))
+            cursor = result["cursors"].get(page)
+            if cursor:
+                partial[page] = page_comments
+                pending.append((page, cursor))
+            else:
+                yield page, page_comments
+
+# The same as a dict of page name to list of comments
+def get_comments(pages, comment_function):
+    return dict(iter_comments(pages, comment_function))
+
+# Write the comments for a page to its data file. Hugo reads every data file on every build
+# so we only write when the comments actually changed, that keeps the mtime of everything
+# else the same. Pages without comments don't get a file. Returns True if we changed anything.
+def write_comment_data(data_path, page, comments):
+    file_path = os.path.join(data_path, page + '.json')
+    if not comments:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            return True
+        return False
+    content = json.dumps(comments, sort_keys=True)
+    try:
+        with open(file_path, 'r') as datafile:
+            if datafile.read() == content:
+                return False
+    except IOError:
+        pass
+    with open(file_path, 'w') as datafile:
+        datafile.write(content)
+    return True
 
+# Make sure the comment data directory exists and that git ignores it. We use the repo's
+# own exclude file rather than .gitignore so we don't change anything that is tracked.
+def prepare_comment_data(repo_path):
+    data_path = os.path.join(repo_path, comment_data_dir)
+    if not os.path.isdir(data_path):
+        os.makedirs(data_path)
+    exclude_path = os.path.join(repo_path, '.git', 'info', 'exclude')
+    pattern = '/' + comment_data_dir + '/'
+    try:
+        with open(exclude_path, 'r') as exclude:
+            if pattern in exclude.read().splitlines():
+                return data_path
+    except IOError:
+        if not os.path.isdir(os.path.dirname(exclude_path)):
+            os.makedirs(os.path.dirname(exclude_path))
+    with open(exclude_path, 'a') as exclude:
+        exclude.write(pattern + '\n')
+    return data_path
+
+# The comments are only shown if a template renders them from .Site.Data.comments, like the
+# comments partial in the lab 2.5 theme (themes/ananke/layouts/partials/comments.html). A theme
+# that still expects them in the markdown will quietly show none, so we look for one.
+comment_data_markers = ('.Site.Data.comments', 'site.Data.comments')
+
+def theme_reads_comment_data(repo_path):
+    for top in ('layouts', 'themes'):
+        for root, dirs, files in os.walk(os.path.join(repo_path, top)):
+            for name in files:
+                if not name.endswith('.html'):
+                    continue
+                try:
+                    with open(os.path.join(root, name), 'r') as template:
+                        content = template.read()
+                except (IOError, UnicodeDecodeError):
+                    continue
+                if any(marker in content for marker in comment_data_markers):
+                    return True
+    return False
 
 # This is functional but likely isn't how you would really want to do this in production
 # it will work perfectly well for our little site though and demonstrates how you can take
 # Lambda and use it to glue things together in novel and highly functional ways.
 
-# We are going to invoke the lambda function to read the comments based on the page name.
-# We walk the hugo posts directory and find every .md file, strip the file type off and use 
-# that as the key to look for comments with. On the Hugo side our template has a feature baked in
-# where the comments form that is shown is injected with a hidden page value that matches the file name.
+# We look up the comments for every post that has a comments section, using the file name as the page.
+# On the Hugo side our template has a feature baked in where the comments form that is shown is
+# injected with a hidden page value that matches the file name, and the comments we write to
+# data/comments/<page>.json are rendered under it.
 # That allows us to tie the two things together using a static site and back end functions
-def add_comments(local_path, comment_function):
-    lambda_client = boto3.client('lambda')
-    # r=root, d=directories, f = files
-    for r, d, f in os.walk(local_path):
-        for file in f:
-            # We only care about md files as those are posts we will inject into
-            if '.md' in file:
-                # We are setting this as a short circuit. We only want to look for
-                # comments if the post has an appropriate comments section
-                # this saves us lambda invokations for posts or files that don't have it
-                show_comments = False
-                file_name = file.split('.')[0]
-                file_path = os.path.join(r, file)
-                with open(file_path, 'r') as searchfile:
-                        for line in searchfile:
-                            if '### Comments' in line:
-                                show_comments = True
-                if show_comments:  
-                    invoke_response = lambda_client.invoke(FunctionName=comment_function,
-                                            Payload=json.dumps('{"page": "' + file_name + '"}'))
-                    lambda_response = json.loads(invoke_response['Payload'].read())
-                    comments = json.loads(lambda_response["body"])
-                    logger.info(comments)
-                    # Make sure we actually have some comments to write before trying to touch the file
-                    if len(comments) > 0:
-                        with open(file_path, 'a') as postfile:
-                            # We inject the comments as simple unordered lists at the end of the file
-                            # This is really brittle and requires writing our posts in a specific way
-                            # but it works well for this lab
-                            for comment in comments:
-                                postfile.write('- {}\n'.format(comment["name"]))
-                                postfile.write('  - {}\n'.format(comment["comment"]))
+# If only_files is given we skip every post that isn't in it, this is how incremental builds
+# avoid looking up comments for posts we aren't going to upload.
+# Returns the number of pages we looked up and the number of comments we found.
+def add_comments(local_path, comment_function, data_path, only_files=None, blob_ids=None):
+    pages = find_comment_pages(local_path, only_files, blob_ids)
+    if not pages:
+        return 0, 0
+    # Each page is written out as soon as all of its comments are in
+    found = 0
+    written = 0
+    for page, page_comments in iter_comments(pages, comment_function):
+        found += len(page_comments)
+        if write_comment_data(data_path, page, page_comments):
+            written += 1
+    logger.info('Found {0} comments, updated {1} of {2} comment data files'.format(found, written, len(pages)))
+    return len(pages), found
 
 
 # This can be named whatever you want but a descriptive name is best if re-using functions
 # A common pattern is to use the matching HTTP verb for a RESTful API
 # We consume a webhook post, and a local invokation but we will just call this post.
 def post(event, context):
-    # Logging the entire event is a cheap simple way to make debugging easier
+    # Logging the entire event is a simple way to make debugging easier
     # Often times just being able to see the event information quickly can help
     # Troubleshoot an issue faster than hooking up a debugger
-    logger.info(event)
+    # It isn't free though, so we only do it at DEBUG (or for the sampled invocations)
+    # and the event is only serialized if it is actually going to be written
+    logs.sample(logger)
+    logger.debug('Event: %s', logs.payload(event))
 
     # We always want to take the shortest path through our functions. Check for anything fatal first.
-    try:
-        output_bucket = os.environ['output_bucket']
-    except:
-        raise Exception('Output Bucket not defined. Set the environment variable for the function')
-    
-    try:
-        comment_function = os.environ['comment_function']
-    except:
-        raise Exception('Comment Function not defined. Set the environment variable for the function')
-
-    # Here we take a few steps to get the JSON into the body object
     # If this came in as a proxy request, or a direct API Gateway request
     # or a boto3 invokation the format of the body could be a few different types
-    # With this stepped approach we can guarantee that no matter how this was called
-    # we will have JSON in the body variable.
-    if "body" in event:
-        body = json.loads(event['body'])
-    else:
-        try:
-            body = json.loads(event)
-        except:
-            body = event
- 
+    # decode works out which so we always have the JSON as a dict in the body variable.
+    request = events.decode(event)
+    body = request.params
+
     # We will still validate this before doing anything with it, but if we are missing
     # any essential components we should end early to save processing time.
     # No point in computing hashes for a payload that is missing data we need.
@@ -182,24 +413,27 @@ def post(event, context):
     except KeyError:
         raise Exception('Failed to find full_name in json post body')
 
-    try:
-        remote_url = body['repository']['clone_url']
-    except KeyError:
+    # The worker clones from it, we only need to know it is there
+    if 'clone_url' not in body['repository']:
         raise Exception('Failed to find clone_url name in json post body')
 
     # Another short circuit. If we know this wasn't called locally then it was likely
     # called via the webhook or some HTTP entity so we need to see what kind of event
     # it is and process it appropriately. Otherwise we can save ourself a bunch of validation
-    if "local_invoke" not in body:
+    # Only a direct invoke (the stream handler's, or by hand) can be local. Anyone can put
+    # local_invoke in the body of a POST to API Gateway, that still has to be signed.
+    local_invoke = "local_invoke" in body and request.source == events.DIRECT
+    if not local_invoke:
         
         try:
             github_secrets = os.environ['github_secrets']
         except:
             raise Exception('Github secrets not defined. Set the environment variable for the function')
 
-        if "headers" in event and "X-GitHub-Event" in event['headers']:
+        github_event = request.header('x-github-event')
+        if github_event is not None:
             # We only care about push events, if this isn't one politely exit
-            if event['headers']['X-GitHub-Event'] != "push":
+            if github_event != "push":
                 return {
                     "statusCode": 200,
                     "body": json.dumps('Skipping - Not a push event')
@@ -209,64 +443,168 @@ def post(event, context):
         # endpoints, multiple repos etc. It is best practice to have a secret per repo
         # so even if we use this exact endpoint we can still feed it multiple repos with multiple
         # keys. We define each key with a , to separate them.
-        apikeys = github_secrets.split(',')
-
-        # set a validation key, we will check multiple keys so it holds our result
-        secure = False
-
-        # Compute out the hash and validate the signature. If it passes set secure, otherwise throw an error
-        if 'X-Hub-Signature' in event['headers'].keys():
-            signature = event['headers']['X-Hub-Signature']
-            for k in apikeys:
-                computed_hash = hmac.new(k.encode('ascii'), event['body'].encode('ascii'), hashlib.sha1)
-                computed_signature = '='.join(['sha1', computed_hash.hexdigest()])
-                hmac.compare_digest(computed_signature.encode('ascii'), signature.encode('ascii'))
-                if hmac.compare_digest(computed_signature.encode('ascii'), signature.encode('ascii')):
-                    secure = True
-        if secure == False:
+        # The keys are parsed once per container and we stop at the first one that matches,
+        # see signatures.py. X-Hub-Signature-256 is checked when GitHub sends it.
+        if not signatures.verify(request, github_secrets, hint=full_name):
             raise Exception('Failed to validate authenticity of webhook message')
     
 
-    repo_name = full_name + '/branch/' + branch_name
-    repo_path = '/tmp/%s' % repo_name
+    # We only build the branches we were told to, anything else is politely ignored
+    if not local_invoke and build_queue.job_branch(body) not in build_branches():
+        return {
+            "statusCode": 200,
+            "body": json.dumps('Skipping - Branch %s is not built' % build_queue.job_branch(body))
+        }
+
+    # Queue the build and answer straight away. Building takes far longer than the 29s API Gateway
+    # allows, this way GitHub gets a proper response and doesn't mark the delivery as failed.
+    # The building happens in the worker (see worker.py), all we need is somewhere to put the job.
+    # We only look the queue up now because the SQS client means importing boto3, which the
+    # requests we turned away above never need.
+    queue = build_queue.from_environment(clients.client)
+    queue.send(build_queue.make_job(body))
+    logger.info('Queued build of %s' % full_name)
+    return {
+            "statusCode": 202,
+            "body": json.dumps('Queued build of %s' % full_name)
+    }
+
+# Work out what needs building. A push can tell us exactly which posts changed since the
+# commit that was last published (whichever container published it, see publisher.MANIFEST_KEY),
+# comment updates from the stream tell us which pages got new comments.
+# Anything we can't be sure about gets a full build.
+def build_plan(body, repo, repo_path, published_commit):
+    head = str(repo.head.target)
+    if not incremental_builds:
+        return incremental.full_build('incremental builds disabled')
+    if "local_invoke" not in body:
+        return incremental.plan_from_push(repo, body, published_commit, head)
+    # A comment rebuild only uploads its own pages, so if the bucket has some other commit
+    # (a push that never made it out, or one we haven't fetched yet) it has to publish everything
+    if published_commit != head:
+        return incremental.full_build('last published commit is not the one checked out')
+    if body.get('pages') and not body.get('full'):
+        return incremental.plan_for_pages(repo_path, body['pages'])
+    return incremental.full_build('comment change without a page')
+
+# Everything after we have decided the request is genuine: fetch the repo, inject comments,
+# build and publish. Each phase is timed and we write one metrics record per run, even
+# if the build fails part way through, so we can see which phase dominates.
+def build_site(body, context, output_bucket, comment_function):
+    full_name = body['repository']['full_name']
+    run_metrics = metrics.Metrics({'FunctionName': getattr(context, 'function_name', 'local')})
+    run_metrics.set_property('repository', full_name)
+    run_metrics.set_property('status', 'failed')
+    try:
+        response = run_pipeline(body, context, output_bucket, comment_function, run_metrics)
+        run_metrics.set_property('status', 'ok')
+        return response
+    finally:
+        run_metrics.emit()
+
+def run_pipeline(body, context, output_bucket, comment_function, run_metrics):
+    full_name = body['repository']['full_name']
+    remote_url = body['repository']['clone_url']
+    branch = build_queue.job_branch(body, default_branch())
+    repo_name = full_name + '/branch/' + branch
 
     # If we have an existing repo (if this function is still warm / is not a cold start)
     # we can re-use that repo on the file system and update it to save us some time and bandwidth
-    try:
-        repository_path = discover_repository(repo_path)
-        repo = Repository(repository_path)
-        logger.info('found existing repo, using that...')
-    # If a previous repo is not found we will create it
-    except Exception:
-        logger.info('creating new repo for %s in %s' % (remote_url, repo_path))
-        repo = create_repo(repo_path, remote_url)
+    with run_metrics.phase('checkout'):
+        ws, created = workspaces.acquire(full_name, branch, open_repo,
+                                         lambda path: create_repo(path, remote_url, branch))
+        repo = ws.repo
+        repo_path = ws.repo_path
+        build_path = ws.build_path
+    run_metrics.set_property('cold_repo', created)
+    run_metrics.set_property('branch', branch)
 
     # Re-used or created, we now have a repo reference to pull against
-    pull_repo(repo, branch_name, remote_url)
-
-    # Now that we have the raw markdown files we can inject our comments
-    # Into the markdown files before we compile the site so we take advantage
-    # of all of the theme styling with minimal effort
-    add_comments(repo_path + "/content/posts/", comment_function)
-
-    # Compile the site to our pre-defined path
-    build_hugo(repo_path, build_path)
-
-    # Sync the site to our public s3 bucket for hosting
-    upload_to_s3(build_path, output_bucket)
+    with run_metrics.phase('fetch') as phase:
+        progress = pull_repo(repo, branch, remote_url)
+        phase['bytes'] = progress.received_bytes
+        phase['items'] = progress.received_objects
+
+    # What is in the bucket now, we build on top of that and publish compares against it
+    with run_metrics.phase('manifest'):
+        published = publisher.remote_manifest(clients.client('s3'), output_bucket)
+
+    plan = build_plan(body, repo, repo_path, published['commit'])
+    logger.info('Build plan: {0}'.format(plan))
+    run_metrics.set_property('full_build', plan.full)
+
+    # Now that we have the raw markdown files we can look up our comments and
+    # write them where Hugo reads its data from before we compile the site so we
+    # take advantage of all of the theme styling with minimal effort
+    with run_metrics.phase('comments') as phase:
+        blob_ids = index_blob_ids(repo, repo_path, 'content/posts/')
+        data_path = prepare_comment_data(repo_path)
+        if plan.full:
+            # Any change to layouts/ or themes/ makes a full build, so that is the only time we look
+            if not theme_reads_comment_data(repo_path):
+                logger.warning('No template in layouts/ or themes/ reads .Site.Data.comments, '
+                               'comments will not be shown. See the comments partial in lab 2.5')
+            pages, injected = add_comments(repo_path + "/content/posts/", comment_function, data_path,
+                                           blob_ids=blob_ids)
+        else:
+            changed_files = set(os.path.join(repo_path, p) for p in plan.changed)
+            pages, injected = add_comments(repo_path + "/content/posts/", comment_function, data_path,
+                                           changed_files, blob_ids)
+        phase['items'] = injected
+        run_metrics.set_property('comment_pages', pages)
+
+    # Compile the site to our pre-defined path, unless what is already there came from exactly
+    # the same input. The previous output and hugo's cache stay in the workspace either way.
+    key = render_key(repo, data_path) if render_cache else None
+    cache_hit = key is not None and key == ws.render_key and os.path.isdir(build_path)
+    run_metrics.set_property('render_cache', 'hit' if cache_hit else 'miss')
+    if cache_hit:
+        logger.info('Render cache hit for {0} ({1}), skipping the hugo build'.format(repo_name, key))
+    else:
+        logger.info('Render cache miss for {0} ({1}, last built {2})'.format(repo_name, key, ws.render_key))
+        # A build that fails part way leaves build_path half written
+        ws.render_key = None
+        with run_metrics.phase('build'):
+            build_hugo(repo_path, build_path, cache_dir=ws.cache_path)
+        ws.render_key = key
+
+    # Sync the site to our public s3 bucket for hosting. If what is in the bucket was built
+    # from exactly the same input there is nothing to send.
+    if key is not None and published['render_key'] == key:
+        logger.info('Output of {0} is already published'.format(key))
+    else:
+        with run_metrics.phase('upload') as phase:
+            scope = None
+            if not plan.full:
+                upload_paths, delete_paths = incremental.affected_outputs(plan)
+                scope = upload_paths | delete_paths
+            result = upload_to_s3(build_path, output_bucket, scope, remote=published,
+                                  commit=str(repo.head.target), render_key=key)
+            phase['bytes'] = result['bytes']
+            phase['items'] = result['uploaded'] + result['deleted']
 
     if reset:
         logger.info('Resetting Repo...')
-        repo.reset(repo.head.target, GIT_RESET_HARD)
+        with run_metrics.phase('reset'):
+            repo.reset(repo.head.target, pygit2.GIT_RESET_HARD)
 
     if cleanup:
         logger.info('Cleanup Lambda container...')
-        shutil.rmtree(repo_path)
+        workspaces.remove(ws)
+    else:
+        workspaces.release(ws)
+
+    # If the stream started this rebuild we hold the rebuild lease, give it back and
+    # start another rebuild if more comments came in while we were busy.
+    # That goes back through the webhook function so it gets queued like everything else.
+    if body.get('rebuild_lease') is not None and os.environ.get('rebuild_table'):
+        table = clients.table(os.environ['rebuild_table'])
+        if rebuilds.release(table, full_name, body['rebuild_lease']):
+            payload = {"repository": body['repository'], "local_invoke": True}
+            window = int(os.environ.get('rebuild_window', rebuilds.DEFAULT_WINDOW))
+            webhook_function = os.environ.get('webhook_function', getattr(context, 'function_name', None))
+            rebuilds.trigger(table, clients.client('lambda'), webhook_function, full_name, payload, window)
 
-    # We have to return a status code otherwise the API Gateway will give a server error
-    # however we are likely exceeding the 29s hard timeout limit on the API gateway
-    # but if we can return correctly we should attempt to, that window could be changed later
-    # or we could execute in time occasionally
     return {
             "statusCode": 200,
             "body": json.dumps('Successfully updated %s' % repo_name)
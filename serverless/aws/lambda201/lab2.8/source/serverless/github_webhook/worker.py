@@ -0,0 +1,57 @@
+import os
+import json
+import logging
+from github_webhook import webhook
+from github_webhook import build_queue
+from common import events
+from common import logs
+
+# Setup our standard logger. We re-use the same format in most places so we have a standard presentation
+# The level comes from the log_level environment variable, see common/logs.py
+logger = logging.getLogger()
+logger.setLevel(logs.level())
+logger.handlers[0].setFormatter(logging.Formatter('[%(asctime)s][%(levelname)s] %(message)s'))
+
+# Pull the jobs out of the event. From SQS we get a batch of records each holding a job,
+# anything else is treated as a single job (handy for invoking the worker by hand).
+def jobs_from_event(event):
+    request = events.decode(event)
+    if request.source == events.SQS:
+        return [json.loads(record['body']) for record in request.records]
+    return [request.params]
+
+# Build every job, once each. Several pushes to the same branch in one batch only build
+# the newest commit, several comment rebuilds are merged into one.
+def run_jobs(jobs, context):
+    try:
+        output_bucket = os.environ['output_bucket']
+    except:
+        raise Exception('Output Bucket not defined. Set the environment variable for the function')
+
+    try:
+        comment_function = os.environ['comment_function']
+    except:
+        raise Exception('Comment Function not defined. Set the environment variable for the function')
+
+    results = []
+    default = webhook.default_branch()
+    for job in build_queue.collapse(jobs, default):
+        logger.info('Building %s', build_queue.job_key(job, default))
+        results.append(webhook.build_site(job, context, output_bucket, comment_function))
+    return results
+
+# The entry point Lambda calls with batches from the build queue.
+# If a build fails we raise so SQS makes the batch visible again and it gets retried.
+def drain(event, context):
+    logs.sample(logger)
+    return run_jobs(jobs_from_event(event), context)
+
+# Run everything waiting on a local queue (MemoryQueue or FileQueue), for testing the
+# whole flow offline. Returns the number of builds we ran.
+def drain_queue(queue, context, batch_size=10):
+    builds = 0
+    while True:
+        jobs = queue.receive(batch_size)
+        if not jobs:
+            return builds
+        builds += len(run_jobs(jobs, context))
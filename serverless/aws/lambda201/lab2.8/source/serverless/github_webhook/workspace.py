@@ -0,0 +1,104 @@
+import os
+import time
+import shutil
+import logging
+from collections import OrderedDict
+
+# Helper modules don't configure the logger themselves, the handler that imports them
+# has already set up the standard format on the root logger
+logger = logging.getLogger()
+
+# Lambda only gives us 512MB of /tmp and every repo/branch we build needs a checkout and
+# its built site. We keep the ones we used most recently and evict the rest once we have
+# too many of them or they take up too much room.
+DEFAULT_ROOT = '/tmp/workspaces'
+DEFAULT_MAX_WORKSPACES = 4
+DEFAULT_MAX_BYTES = 384 * 1024 * 1024
+
+
+# The space a directory takes up on disk
+def disk_usage(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+# One checked out repo/branch. repo is the open Repository handle which we keep between
+# warm invocations so we don't have to discover and open the repo again every time.
+class Workspace(object):
+    def __init__(self, full_name, branch, path):
+        self.full_name = full_name
+        self.branch = branch
+        self.path = path
+        self.repo_path = os.path.join(path, 'repo')
+        self.build_path = os.path.join(path, 'public')
+        # Hugo's resource cache (processed images, fetched resources), kept with the checkout
+        self.cache_path = os.path.join(path, 'hugo_cache')
+        # The render key of what is in build_path, see webhook.render_key. What was last
+        # published is in the bucket's publish manifest, any container may have done it.
+        self.render_key = None
+        self.repo = None
+        self.size = 0
+        self.last_used = 0
+
+    def __repr__(self):
+        return 'Workspace(%s, %s)' % (self.full_name, self.branch)
+
+
+class WorkspaceManager(object):
+    def __init__(self, root=DEFAULT_ROOT, max_workspaces=DEFAULT_MAX_WORKSPACES, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_workspaces = max_workspaces
+        self.max_bytes = max_bytes
+        # Least recently used first
+        self.workspaces = OrderedDict()
+
+    # Get the workspace for a repo/branch. If we already have it open we hand it straight back,
+    # otherwise open_repo(path) is tried (a checkout left by an earlier container) and if that
+    # fails create_repo(path) makes a new one. Returns (workspace, True if it was freshly created).
+    def acquire(self, full_name, branch, open_repo, create_repo):
+        key = (full_name, branch)
+        workspace = self.workspaces.get(key)
+        if workspace is not None and workspace.repo is not None and os.path.isdir(workspace.repo_path):
+            logger.info('Re-using open workspace for {0} {1}'.format(full_name, branch))
+            self.workspaces.move_to_end(key)
+            workspace.last_used = time.time()
+            return workspace, False
+
+        workspace = Workspace(full_name, branch, os.path.join(self.root, full_name, branch))
+        created = False
+        try:
+            workspace.repo = open_repo(workspace.repo_path)
+            logger.info('Opened existing repo for {0} {1}'.format(full_name, branch))
+        except Exception:
+            logger.info('Creating new repo for {0} {1} in {2}'.format(full_name, branch, workspace.repo_path))
+            workspace.repo = create_repo(workspace.repo_path)
+            created = True
+        workspace.last_used = time.time()
+        self.workspaces[key] = workspace
+        self.workspaces.move_to_end(key)
+        return workspace, created
+
+    # Call once a build is done. We measure what the workspace takes up now and evict the least
+    # recently used ones until we are back under our limits. The one just used is never evicted.
+    def release(self, workspace):
+        workspace.size = disk_usage(workspace.path)
+        while len(self.workspaces) > 1:
+            total = sum(w.size for w in self.workspaces.values())
+            if len(self.workspaces) <= self.max_workspaces and total <= self.max_bytes:
+                break
+            key, oldest = next(iter(self.workspaces.items()))
+            if oldest is workspace:
+                break
+            self.remove(oldest)
+
+    def remove(self, workspace):
+        logger.info('Evicting workspace {0} ({1} bytes)'.format(workspace, workspace.size))
+        self.workspaces.pop((workspace.full_name, workspace.branch), None)
+        workspace.repo = None
+        shutil.rmtree(workspace.path, ignore_errors=True)
@@ -0,0 +1,54 @@
+import io
+
+import pytest
+
+
+class FakeS3Error(Exception):
+    """ Looks enough like a botocore ClientError for our error handling"""
+
+    def __init__(self, code):
+        super(FakeS3Error, self).__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3(object):
+    """ In-process stand-in for the handful of S3 client calls we make"""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        # Keys delete_objects reports an error for
+        self.undeletable = set()
+
+    def get_object(self, Bucket, Key):
+        self.calls.append(("get_object", Key))
+        if Key not in self.objects:
+            raise FakeS3Error("NoSuchKey")
+        return {"Body": io.BytesIO(self.objects[Key]["Body"])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append(("put_object", Key))
+        self.objects[Key] = dict(kwargs, Body=Body)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        self.calls.append(("upload_file", Key))
+        with open(Filename, "rb") as f:
+            self.objects[Key] = dict(ExtraArgs or {}, Body=f.read())
+
+    def delete_objects(self, Bucket, Delete):
+        errors = []
+        for o in Delete["Objects"]:
+            self.calls.append(("delete_object", o["Key"]))
+            if o["Key"] in self.undeletable:
+                errors.append({"Key": o["Key"], "Code": "AccessDenied", "Message": "Access Denied"})
+                continue
+            self.objects.pop(o["Key"], None)
+        return {"Errors": errors} if errors else {}
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        return {"Contents": [{"Key": k} for k in sorted(self.objects)], "IsTruncated": False}
+
+
+@pytest.fixture()
+def fake_s3():
+    return FakeS3()
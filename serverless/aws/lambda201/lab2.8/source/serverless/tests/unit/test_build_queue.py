@@ -0,0 +1,60 @@
+import pytest
+
+from github_webhook import build_queue
+
+
+def push(sha, received, ref="refs/heads/master", name="student00/blog"):
+    return {
+        "ref": ref,
+        "after": sha,
+        "repository": {"full_name": name, "clone_url": "file:///tmp/blog.git"},
+        "commits": [{"id": sha, "added": [], "modified": ["content/posts/%s.md" % sha], "removed": []}],
+        "received": received,
+    }
+
+
+def test_collapse_keeps_newest_commit_per_branch():
+    jobs = [push("b", 2), push("a", 1), push("c", 3, ref="refs/heads/draft")]
+
+    collapsed = build_queue.collapse(jobs)
+
+    assert [j["after"] for j in collapsed] == ["b", "c"]
+    assert [c["id"] for c in collapsed[0]["commits"]] == ["a", "b"]
+
+
+def test_collapse_merges_comment_pages():
+    base = {"repository": {"full_name": "student00/blog"}, "local_invoke": True}
+    jobs = [dict(base, pages=["one"], received=1), dict(base, pages=["two"], full=False, received=2)]
+
+    collapsed = build_queue.collapse(jobs)
+
+    assert len(collapsed) == 1
+    assert collapsed[0]["pages"] == ["one", "two"]
+
+
+def test_pushes_and_comments_are_not_merged():
+    comments = {"repository": {"full_name": "student00/blog"}, "local_invoke": True, "received": 2}
+
+    assert len(build_queue.collapse([push("a", 1), comments])) == 2
+
+
+def test_jobs_without_a_ref_build_the_default_branch():
+    comments = {"repository": {"full_name": "student00/blog"}, "local_invoke": True, "received": 2}
+
+    assert build_queue.job_branch(comments) == "master"
+    assert build_queue.job_key(comments, "main") == ("student00/blog", "main", "comments")
+    assert build_queue.job_branch(push("a", 1, ref="refs/heads/draft"), "main") == "draft"
+
+
+@pytest.mark.parametrize("make_queue", [
+    lambda tmp_path: build_queue.MemoryQueue(),
+    lambda tmp_path: build_queue.FileQueue(str(tmp_path / "builds.jsonl")),
+])
+def test_queue_round_trip(tmp_path, make_queue):
+    queue = make_queue(tmp_path)
+    for i in range(3):
+        queue.send(push(str(i), i))
+
+    assert [j["after"] for j in queue.receive(2)] == ["0", "1"]
+    assert [j["after"] for j in queue.receive(2)] == ["2"]
+    assert queue.receive(2) == []
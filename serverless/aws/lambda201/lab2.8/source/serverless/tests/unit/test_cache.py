@@ -0,0 +1,44 @@
+from common import cache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    c = cache.TTLCache(ttl=10, clock=clock)
+    c.put("page", "body")
+
+    clock.now += 9
+    assert c.get("page") == "body"
+    clock.now += 2
+    assert c.get("page") is None
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_least_recently_used_goes_first():
+    c = cache.TTLCache(max_size=2, ttl=10)
+    c.put("a", 1)
+    c.put("b", 2)
+    c.get("a")
+    c.put("c", 3)
+
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+
+
+def test_invalidate_and_disabled_cache():
+    c = cache.TTLCache(ttl=10)
+    c.put("a", 1)
+    c.invalidate("a")
+    assert c.get("a") is None
+
+    off = cache.TTLCache(ttl=0)
+    off.put("a", 1)
+    assert len(off) == 0
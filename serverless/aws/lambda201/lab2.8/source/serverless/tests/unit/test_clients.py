@@ -0,0 +1,40 @@
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+
+from common import clients
+
+
+@pytest.fixture()
+def factory(monkeypatch):
+    made = []
+
+    def fake_client(service, region_name=None):
+        made.append((service, region_name))
+        return object()
+
+    clients.reset()
+    monkeypatch.setattr(clients.boto3, "client", fake_client)
+    yield made
+    clients.reset()
+
+
+def test_client_is_reused(factory):
+    assert clients.client("lambda", "us-east-1") is clients.client("lambda", "us-east-1")
+    assert clients.created == 1
+
+
+def test_client_is_keyed_by_service_and_region(factory):
+    clients.client("lambda", "us-east-1")
+    clients.client("lambda", "eu-west-1")
+    clients.client("s3", "us-east-1")
+
+    assert clients.created == 3
+
+
+def test_reset_forgets_clients(factory):
+    first = clients.client("s3", "us-east-1")
+    clients.reset()
+
+    assert clients.client("s3", "us-east-1") is not first
+    assert clients.created == 1
@@ -0,0 +1,288 @@
+import json
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+
+from comments import comments
+from common import clients
+
+
+class FakeClientError(Exception):
+    """ Looks enough like a botocore ClientError for our error handling"""
+
+    def __init__(self, code):
+        super(FakeClientError, self).__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeClient(object):
+    """ The low level client behind FakeTable, leaves the first unprocessed count items of each batch"""
+
+    def __init__(self, table):
+        self.table = table
+        self.unprocessed = 0
+        self.calls = 0
+        # Calls (counting from 1) that fail outright instead
+        self.throttled = set()
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        if self.calls in self.throttled:
+            raise FakeClientError("ProvisionedThroughputExceededException")
+        requests = RequestItems[self.table.name]
+        assert len(requests) <= 25
+        left, self.unprocessed = requests[:self.unprocessed], max(self.unprocessed - 1, 0)
+        for request in requests[len(left):]:
+            self.table.items.append(request["PutRequest"]["Item"])
+        return {"UnprocessedItems": {self.table.name: left} if left else {}}
+
+
+class FakeTable(object):
+    """ In-process stand-in for a DynamoDB Table resource"""
+
+    def __init__(self, items):
+        self.name = "comments"
+        self.items = items
+        self.scans = 0
+        self.queries = 0
+        self.meta = type("Meta", (object,), {})()
+        self.meta.client = FakeClient(self)
+
+    def scan(self, **kwargs):
+        self.scans += 1
+        return {"Items": list(self.items)}
+
+    def query(self, IndexName, KeyConditionExpression, Limit=None, ExclusiveStartKey=None, ScanIndexForward=True):
+        assert IndexName == "page-created-index"
+        self.queries += 1
+        page = KeyConditionExpression.get_expression()["values"][1]
+        # Like the page index, comments without created aren't in it
+        items = sorted([i for i in self.items if i["page"] == page and "created" in i],
+                       key=lambda i: i["created"], reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            items = items[[i["uuid"] for i in items].index(ExclusiveStartKey["uuid"]) + 1:]
+        response = {"Items": items[:Limit] if Limit else items}
+        if Limit and len(items) > Limit:
+            last = items[Limit - 1]
+            response["LastEvaluatedKey"] = {"uuid": last["uuid"], "page": last["page"], "created": last["created"]}
+        return response
+
+
+@pytest.fixture()
+def table(monkeypatch):
+    table = FakeTable([
+        {"uuid": "3", "page": "first-post", "name": "Cy", "comment": "Agreed", "created": 30},
+        {"uuid": "2", "page": "second-post", "name": "Bob", "comment": "Meh", "created": 20},
+        {"uuid": "1", "page": "first-post", "name": "Ada", "comment": "Nice", "created": 10},
+    ])
+
+    class FakeResource(object):
+        def Table(self, name):
+            return table
+
+    clients.reset()
+    comments.page_cache.clear()
+    monkeypatch.setenv("table_name", "comments")
+    monkeypatch.setattr(clients.boto3, "resource", lambda *args, **kwargs: FakeResource())
+    yield table
+    clients.reset()
+
+
+def test_get_many_groups_by_page(table):
+    ret = comments.get_many({"pages": ["first-post", "third-post"]}, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == "200"
+    assert [c["comment"] for c in data["first-post"]] == ["Nice", "Agreed"]
+    assert data["third-post"] == []
+    assert "second-post" not in data
+    assert table.scans == 0
+
+
+def test_get_queries_page_index(table):
+    ret = comments.get({"httpMethod": "GET", "queryStringParameters": {"page": "first-post"}}, "")
+
+    assert [c["comment"] for c in json.loads(ret["body"])] == ["Nice", "Agreed"]
+    assert table.queries == 1
+    assert table.scans == 0
+
+
+def test_get_paginates_with_cursor(table):
+    params = {"page": "first-post", "limit": "1"}
+    first = json.loads(comments.get({"httpMethod": "GET", "queryStringParameters": params}, "")["body"])
+    params["cursor"] = first["cursor"]
+    second = json.loads(comments.get({"httpMethod": "GET", "queryStringParameters": params}, "")["body"])
+
+    assert [c["comment"] for c in first["comments"]] == ["Nice"]
+    assert [c["comment"] for c in second["comments"]] == ["Agreed"]
+    assert second["cursor"] is None
+
+
+def test_warm_invocations_reuse_the_table(table):
+    comments.get({"httpMethod": "GET", "queryStringParameters": {"page": "first-post"}}, "")
+    comments.get({"httpMethod": "GET", "queryStringParameters": {"page": "second-post"}}, "")
+
+    # One resource and one table, no matter how many invocations
+    assert clients.created == 2
+
+
+def test_post_batch_writes_in_batches_of_25(table, monkeypatch):
+    monkeypatch.setattr(comments, "batch_workers", 1)
+    entries = [{"page": "import", "name": "N%d" % i, "comment": "C%d" % i} for i in range(60)]
+
+    ret = comments.post({"httpMethod": "POST", "queryStringParameters": None, "body": json.dumps(entries)}, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == "200"
+    assert data["written"] == 60
+    assert table.meta.client.calls == 3
+    assert len([i for i in table.items if i["page"] == "import"]) == 60
+
+
+def test_post_batch_retries_unprocessed_and_reports_each_item(table, monkeypatch):
+    monkeypatch.setattr(comments, "batch_backoff", 0)
+    table.meta.client.unprocessed = 2
+    entries = [{"page": "p", "name": "Ada", "comment": "Hi"}, {"page": "p", "name": "Bob"}, {"page": "p", "name": "Cy", "comment": "Yo"}]
+
+    ret = comments.post({"httpMethod": "POST", "queryStringParameters": None, "body": json.dumps({"comments": entries})}, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == "207"
+    assert [r["status"] for r in data["results"]] == ["ok", "invalid", "ok"]
+    assert data["results"][1]["error"] == "comment not found in submission"
+    # Two unprocessed on the first call, one on the retry, then everything is in
+    assert table.meta.client.calls == 3
+
+
+def test_write_batch_gives_up_after_retries(table):
+    table.meta.client.unprocessed = 100
+    sleeps = []
+    failed = comments.write_batch(table, [comments.new_item({"page": "p", "name": "A", "comment": "B"})],
+                                  retries=2, backoff=0.1, sleep=sleeps.append)
+
+    assert len(failed) == 1
+    assert sleeps == [0.1, 0.2]
+
+
+def test_post_batch_fails_only_the_batch_dynamodb_turned_down(table, monkeypatch):
+    monkeypatch.setattr(comments, "batch_workers", 1)
+    table.meta.client.throttled = {2}
+    entries = [{"page": "import", "name": "N%d" % i, "comment": "C%d" % i} for i in range(60)]
+
+    ret = comments.post({"httpMethod": "POST", "queryStringParameters": None, "body": json.dumps(entries)}, "")
+    data = json.loads(ret["body"])
+
+    assert ret["statusCode"] == "207"
+    assert data["written"] == 35
+    assert [r["status"] for r in data["results"]] == ["ok"] * 25 + ["failed"] * 25 + ["ok"] * 10
+    assert data["results"][25]["error"] == "not written: ProvisionedThroughputExceededException"
+    assert len([i for i in table.items if i["page"] == "import"]) == 35
+
+
+def test_post_get_without_page_reports_missing_page(table):
+    with pytest.raises(Exception, match="page not found in submission"):
+        comments.post({"httpMethod": "GET", "queryStringParameters": None}, "")
+
+
+def test_decimals_become_ints_or_floats():
+    import decimal
+
+    assert comments.encoder.encode([decimal.Decimal("3"), decimal.Decimal("2.50"), decimal.Decimal("-1.0")]) == "[3, 2.5, -1]"
+
+
+def test_streamed_comments_match_the_body():
+    items = [{"name": "N%d" % i, "comment": "C%d" % i} for i in range(7)]
+
+    streamed = "".join(comments.iter_comments_json(items, chunk_size=3))
+
+    assert streamed == comments.comments_json(items)
+    assert json.loads(streamed)[6] == {"name": "Name: N6\n", "comment": "C6"}
+    assert "".join(comments.iter_comments_json([])) == "[]"
+
+
+def get_page(page, headers=None):
+    return comments.get({"httpMethod": "GET", "headers": headers or {}, "queryStringParameters": {"page": page}}, "")
+
+
+def test_get_serves_repeat_requests_from_cache(table):
+    first = get_page("first-post")
+    second = get_page("first-post")
+
+    assert table.queries == 1
+    assert second["body"] == first["body"]
+    assert second["headers"]["ETag"] == first["headers"]["ETag"]
+
+
+def test_get_honours_if_none_match(table):
+    etag = get_page("first-post")["headers"]["ETag"]
+
+    ret = get_page("first-post", {"If-None-Match": "W/" + etag})
+
+    assert ret["statusCode"] == "304"
+    assert ret["body"] == ""
+    assert get_page("first-post", {"If-None-Match": '"stale"'})["statusCode"] == "200"
+
+
+def test_post_invalidates_cached_page(table):
+    etag = get_page("first-post")["headers"]["ETag"]
+    table.put_item = lambda Item: table.items.append(Item) or {}
+
+    comments.post({"httpMethod": "POST", "queryStringParameters": None,
+                   "body": json.dumps({"page": "first-post", "name": "Di", "comment": "Late"})}, "")
+    ret = get_page("first-post", {"If-None-Match": etag})
+
+    assert ret["statusCode"] == "200"
+    assert table.queries == 2
+    assert [c["comment"] for c in json.loads(ret["body"])][-1] == "Late"
+
+
+def test_get_many_pages_with_cursors(table):
+    first = json.loads(comments.get_many({"pages": ["first-post", "second-post"], "limit": 1}, "")["body"])
+
+    assert [c["comment"] for c in first["comments"]["first-post"]] == ["Nice"]
+    assert first["cursors"]["second-post"] is None
+
+    rest = json.loads(comments.get_many({"pages": ["first-post"], "limit": 1, "cursors": first["cursors"]}, "")["body"])
+    assert [c["comment"] for c in rest["comments"]["first-post"]] == ["Agreed"]
+
+
+def test_batch_keeps_the_order_comments_were_sent(table, monkeypatch):
+    monkeypatch.setattr(comments, "created_now", lambda: 1000)
+    entries = [{"page": "import", "name": "N", "comment": "C%d" % i} for i in range(3)]
+
+    comments.post({"httpMethod": "POST", "queryStringParameters": None, "body": json.dumps(entries)}, "")
+
+    stored = sorted([i for i in table.items if i["page"] == "import"], key=lambda i: i["created"])
+    assert [i["comment"] for i in stored] == ["C0", "C1", "C2"]
+    assert [i["created"] for i in stored] == [1000, 1001, 1002]
+
+
+def test_backfill_created_adds_missing_timestamps(table):
+    table.items.append({"uuid": "4", "page": "first-post", "name": "Old", "comment": "Before"})
+    updates = []
+    table.update_item = lambda **kwargs: updates.append(kwargs["Key"])
+
+    assert comments.backfill_created(table) == 1
+    assert updates == [{"uuid": "4"}]
+
+
+
+def test_comments_show_up_once_backfilled(table):
+    table.items.append({"uuid": "4", "page": "first-post", "name": "Old", "comment": "Before"})
+    params = {"page": "first-post", "limit": "1"}
+    before = json.loads(comments.get({"httpMethod": "GET", "queryStringParameters": params}, "")["body"])
+
+    def update_item(Key, UpdateExpression, ExpressionAttributeValues):
+        for item in table.items:
+            if item["uuid"] == Key["uuid"]:
+                item.setdefault("created", ExpressionAttributeValues[":created"])
+    table.update_item = update_item
+    comments.backfill_created(table)
+    comments.page_cache.clear()
+    after = json.loads(comments.get({"httpMethod": "GET", "queryStringParameters": params}, "")["body"])
+
+    # One query of the one index per request, however many comments the page has
+    assert table.queries == 2
+    assert [c["comment"] for c in before["comments"]] == ["Nice"]
+    assert [c["comment"] for c in after["comments"]] == ["Before"]
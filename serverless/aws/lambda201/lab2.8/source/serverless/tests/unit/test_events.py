@@ -0,0 +1,59 @@
+import json
+
+from common import events
+
+
+def test_api_gateway_post_parses_body_once():
+    request = events.decode({"httpMethod": "POST", "headers": {"Content-Type": "application/json"},
+                             "queryStringParameters": None, "body": json.dumps({"page": "first-post"})})
+
+    assert request.source == events.API_GATEWAY
+    assert request.params == {"page": "first-post"}
+    assert request.body is request.body
+    assert request.query == {}
+    assert request.header("content-type") == "application/json"
+
+
+def test_api_gateway_get_uses_query_string():
+    request = events.decode({"httpMethod": "GET", "queryStringParameters": {"page": "first-post"}, "body": None})
+
+    assert request.params == {"page": "first-post"}
+    assert request.body is None
+
+
+def test_get_without_query_string_has_empty_params():
+    request = events.decode({"httpMethod": "GET", "queryStringParameters": None})
+
+    assert request.params == {}
+
+
+def test_body_that_is_already_a_dict_is_not_parsed():
+    body = {"page": "first-post"}
+    request = events.decode({"httpMethod": "POST", "body": body})
+
+    assert request.params is body
+
+
+def test_bad_json_body_gives_empty_params():
+    request = events.decode({"httpMethod": "POST", "body": "{not json"})
+
+    assert request.body is None
+    assert request.params == {}
+
+
+def test_direct_invoke_dict_and_string():
+    payload = {"repository": {"full_name": "student00/blog"}, "local_invoke": True}
+
+    assert events.decode(payload).source == events.DIRECT
+    assert events.decode(payload).params is payload
+    assert events.decode(json.dumps(payload)).params == payload
+
+
+def test_records_are_classified_by_source():
+    sqs = events.decode({"Records": [{"eventSource": "aws:sqs", "body": "{}"}]})
+    stream = events.decode({"Records": [{"eventSource": "aws:dynamodb", "dynamodb": {}}]})
+
+    assert sqs.source == events.SQS
+    assert stream.source == events.DYNAMODB_STREAM
+    assert len(stream.records) == 1
+    assert events.decode({"Records": []}).source == events.RECORDS
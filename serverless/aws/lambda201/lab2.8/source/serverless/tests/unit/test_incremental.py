@@ -0,0 +1,65 @@
+import pytest
+
+from github_webhook import incremental
+
+
+@pytest.fixture()
+def push_body():
+    """ Generates the parts of a GitHub push payload we look at"""
+
+    return {
+        "before": "a" * 40,
+        "after": "b" * 40,
+        "commits": [
+            {"added": ["content/posts/new-post.md"], "modified": [], "removed": []},
+            {"added": [], "modified": ["content/posts/first-post.md"], "removed": ["content/posts/old-post.md"]},
+        ],
+    }
+
+
+def test_paths_from_payload(push_body):
+    changed, removed = incremental.paths_from_payload(push_body)
+
+    assert changed == {"content/posts/new-post.md", "content/posts/first-post.md"}
+    assert removed == {"content/posts/old-post.md"}
+
+
+def test_paths_from_payload_truncated(push_body):
+    push_body["commits"] = push_body["commits"] * 10
+
+    assert incremental.paths_from_payload(push_body) is None
+
+
+def test_plan_build_content_only():
+    plan = incremental.plan_build({"content/posts/first-post.md", "README.md"}, set())
+
+    assert not plan.full
+    assert plan.changed == {"content/posts/first-post.md"}
+
+
+@pytest.mark.parametrize("path", ["config.toml", "config/_default/params.toml", "layouts/partials/comments.html",
+                                  "themes/ananke/theme.toml"])
+def test_plan_build_falls_back_to_full(path):
+    plan = incremental.plan_build({"content/posts/first-post.md", path}, set())
+
+    assert plan.full
+
+
+def test_plan_from_push_cold_container(push_body):
+    assert incremental.plan_from_push(None, push_body, None, "b" * 40).full
+
+
+def test_plan_from_push_uses_payload_only_from_the_published_commit(push_body):
+    # No repo to diff in, like a shallow checkout without the published commit
+    assert not incremental.plan_from_push(None, push_body, "a" * 40, "b" * 40).full
+    # Someone else published c since, the payload doesn't cover c..b
+    assert incremental.plan_from_push(None, push_body, "c" * 40, "b" * 40).full
+
+
+def test_affected_outputs():
+    plan = incremental.plan_build({"content/posts/First-Post.md"}, {"content/posts/old-post.md"})
+    upload, delete = incremental.affected_outputs(plan)
+
+    assert "posts/first-post/" in upload
+    assert "index.html" in upload
+    assert delete == {"posts/old-post/"}
@@ -0,0 +1,32 @@
+import sys
+
+import pytest
+
+from common import lazy
+
+
+def test_module_only_runs_on_first_use(tmp_path, monkeypatch):
+    (tmp_path / "lazy_example.py").write_text("import sys\nsys.lazy_example_runs = getattr(sys, 'lazy_example_runs', 0) + 1\nvalue = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "lazy_example", raising=False)
+    monkeypatch.setattr(sys, "lazy_example_runs", 0, raising=False)
+
+    module = lazy.module("lazy_example")
+    assert sys.lazy_example_runs == 0
+    assert not lazy.loaded("lazy_example")
+
+    assert module.value == 42
+    assert sys.lazy_example_runs == 1
+    assert lazy.loaded("lazy_example")
+    assert lazy.module("lazy_example") is module
+
+
+def test_imported_modules_are_returned_as_they_are():
+    assert lazy.module("json") is sys.modules["json"]
+    assert lazy.loaded("json")
+    assert not lazy.loaded("no_such_module_here")
+
+
+def test_missing_module_fails_straight_away():
+    with pytest.raises(ImportError):
+        lazy.module("no_such_module_here")
@@ -0,0 +1,42 @@
+import logging
+
+from common import logs
+
+
+class Exploding(object):
+    """ Fails the test if anything tries to turn it into a string"""
+
+    def __repr__(self):
+        raise AssertionError("payload was formatted")
+
+
+def test_payload_is_not_formatted_when_filtered(caplog):
+    logger = logging.getLogger("test_logs")
+    logger.setLevel(logging.INFO)
+
+    logger.debug("Event: %s", logs.payload({"big": Exploding()}))
+
+
+def test_payload_is_capped():
+    text = str(logs.payload({"comment": "x" * 100}, limit=20))
+
+    assert text.startswith('{"comment": "xxxxxxx')
+    assert text.endswith("... (95 more characters)")
+
+
+def test_payload_cap_from_environment(monkeypatch):
+    monkeypatch.setenv("log_max_payload", "10")
+
+    assert len(str(logs.payload(list(range(100)))).split("...")[0]) == 10
+
+
+def test_sample_sets_level_every_invocation(monkeypatch):
+    logger = logging.getLogger("test_logs_sample")
+    monkeypatch.setenv("log_level", "warning")
+    monkeypatch.setenv("log_sample_rate", "1")
+    assert logs.sample(logger)
+    assert logger.level == logging.DEBUG
+
+    monkeypatch.setenv("log_sample_rate", "0")
+    assert not logs.sample(logger)
+    assert logger.level == logging.WARNING
@@ -0,0 +1,50 @@
+import io
+import json
+
+from github_webhook import metrics
+
+
+def test_emits_embedded_metric_format():
+    run_metrics = metrics.Metrics({"FunctionName": "github-webhook"})
+    with run_metrics.phase("upload") as phase:
+        phase["bytes"] = 2048
+        phase["items"] = 3
+    run_metrics.set_property("status", "ok")
+
+    out = io.StringIO()
+    run_metrics.emit(out)
+    record = json.loads(out.getvalue())
+
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Dimensions"] == [["FunctionName"]]
+    assert {"Name": "upload.bytes", "Unit": "Bytes"} in directive["Metrics"]
+    assert {"Name": "upload.time", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert record["upload.bytes"] == 2048
+    assert record["upload.items"] == 3
+    assert record["FunctionName"] == "github-webhook"
+    assert record["status"] == "ok"
+
+
+def test_phase_is_recorded_when_it_fails():
+    run_metrics = metrics.Metrics()
+    try:
+        with run_metrics.phase("build"):
+            raise RuntimeError("hugo failed")
+    except RuntimeError:
+        pass
+
+    assert "build.time" in run_metrics.values
+
+
+def test_collector_aggregates_runs():
+    with metrics.Collector() as collector:
+        for size in [10, 20, 30]:
+            run_metrics = metrics.Metrics()
+            run_metrics.record("upload", "bytes", size)
+            run_metrics.emit(io.StringIO())
+    run_metrics.emit(io.StringIO())
+
+    summary = collector.summary()["upload.bytes"]
+    assert summary["count"] == 3
+    assert summary["mean"] == 20
+    assert summary["max"] == 30
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from github_webhook import publisher
+
+
+@pytest.fixture()
+def site(tmp_path):
+    """ Generates a tiny built site"""
+
+    (tmp_path / "posts" / "first-post").mkdir(parents=True)
+    (tmp_path / "index.html").write_text("<html>home</html>")
+    (tmp_path / "posts" / "first-post" / "index.html").write_text("<html>first</html>")
+    return tmp_path
+
+
+def uploads(fake_s3):
+    return sorted(key for call, key in fake_s3.calls if call == "upload_file")
+
+
+def test_first_publish_uploads_everything(site, fake_s3):
+    result = publisher.publish(fake_s3, "bucket", str(site))
+
+    assert result["uploaded"] == 2
+    assert fake_s3.objects["index.html"]["ContentType"] == "text/html"
+    manifest = json.loads(fake_s3.objects[publisher.MANIFEST_KEY]["Body"])
+    assert sorted(manifest["files"]) == ["index.html", "posts/first-post/index.html"]
+
+
+def test_first_publish_removes_unknown_objects(site, fake_s3):
+    fake_s3.objects["stale.html"] = {"Body": b"old"}
+
+    publisher.publish(fake_s3, "bucket", str(site))
+
+    assert "stale.html" not in fake_s3.objects
+
+
+def test_republish_only_uploads_changes(site, fake_s3):
+    publisher.publish(fake_s3, "bucket", str(site))
+    fake_s3.calls = []
+    (site / "index.html").write_text("<html>home v2</html>")
+    (site / "posts" / "first-post" / "index.html").unlink()
+
+    result = publisher.publish(fake_s3, "bucket", str(site))
+
+    assert uploads(fake_s3) == ["index.html"]
+    assert result["deleted"] == 1
+    assert "posts/first-post/index.html" not in fake_s3.objects
+
+
+def test_scoped_publish_leaves_the_rest_alone(site, fake_s3):
+    publisher.publish(fake_s3, "bucket", str(site))
+    fake_s3.calls = []
+    (site / "index.html").write_text("<html>home v2</html>")
+    (site / "posts" / "first-post" / "index.html").write_text("<html>first v2</html>")
+
+    publisher.publish(fake_s3, "bucket", str(site), scope={"posts/first-post/"})
+
+    assert uploads(fake_s3) == ["posts/first-post/index.html"]
+    manifest = json.loads(fake_s3.objects[publisher.MANIFEST_KEY]["Body"])
+    assert "index.html" in manifest["files"]
+
+
+def test_manifest_records_what_was_published(site, fake_s3):
+    publisher.publish(fake_s3, "bucket", str(site), commit="c" * 40, render_key="key")
+
+    manifest = publisher.remote_manifest(fake_s3, "bucket")
+    assert manifest["commit"] == "c" * 40
+    assert manifest["render_key"] == "key"
+
+
+def test_reads_manifests_from_before_the_commit_was_recorded(site, fake_s3):
+    fake_s3.objects[publisher.MANIFEST_KEY] = {"Body": json.dumps({"index.html": "abc"}).encode("utf-8")}
+
+    manifest = publisher.remote_manifest(fake_s3, "bucket")
+
+    assert manifest == {"files": {"index.html": "abc"}, "commit": None, "render_key": None}
+
+
+def test_scoped_publish_only_hashes_the_scope(site, fake_s3, monkeypatch):
+    publisher.publish(fake_s3, "bucket", str(site))
+    hashed = []
+    hash_file = publisher.hash_file
+    monkeypatch.setattr(publisher, "hash_file", lambda path: hashed.append(path) or hash_file(path))
+
+    publisher.publish(fake_s3, "bucket", str(site), scope={"posts/first-post/", "posts/missing/", "404.html"})
+
+    assert hashed == [str(site / "posts" / "first-post" / "index.html")]
+
+
+def test_failed_deletes_stay_in_the_manifest(site, fake_s3):
+    publisher.publish(fake_s3, "bucket", str(site))
+    (site / "posts" / "first-post" / "index.html").unlink()
+    fake_s3.undeletable.add("posts/first-post/index.html")
+
+    result = publisher.publish(fake_s3, "bucket", str(site))
+
+    assert result["deleted"] == 0
+    assert "posts/first-post/index.html" in publisher.remote_manifest(fake_s3, "bucket")["files"]
+
+    fake_s3.undeletable.clear()
+    assert publisher.publish(fake_s3, "bucket", str(site))["deleted"] == 1
+    assert "posts/first-post/index.html" not in fake_s3.objects
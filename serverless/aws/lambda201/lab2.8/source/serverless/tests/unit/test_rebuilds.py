@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from common import rebuilds
+
+
+class ConditionFailed(Exception):
+    def __init__(self):
+        super(ConditionFailed, self).__init__("ConditionalCheckFailedException")
+        self.response = {"Error": {"Code": "ConditionalCheckFailedException"}}
+
+
+class FakeRebuildTable(object):
+    """ Understands just the update expressions rebuilds uses"""
+
+    def __init__(self):
+        self.item = {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None,
+                    ReturnValues=None):
+        values = ExpressionAttributeValues or {}
+        old = dict(self.item)
+        last_trigger = self.item.get("last_trigger")
+        if ConditionExpression and ":cutoff" in values and last_trigger is not None and last_trigger > values[":cutoff"]:
+            raise ConditionFailed()
+        if ConditionExpression and ":lease" in values and last_trigger != values[":lease"]:
+            raise ConditionFailed()
+        if "ADD pages" in UpdateExpression:
+            self.item["pages"] = self.item.get("pages", set()) | values[":pages"]
+        if "SET full_rebuild" in UpdateExpression:
+            self.item["full_rebuild"] = True
+        if "SET last_trigger" in UpdateExpression:
+            self.item["last_trigger"] = values[":now"]
+            self.item.pop("pages", None)
+            self.item.pop("full_rebuild", None)
+        if UpdateExpression == "REMOVE last_trigger":
+            self.item.pop("last_trigger", None)
+        return {"Attributes": old if ReturnValues == "ALL_OLD" else dict(self.item)}
+
+
+class FakeLambda(object):
+    def __init__(self):
+        self.invokes = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invokes.append(json.loads(Payload))
+
+
+@pytest.fixture()
+def table():
+    return FakeRebuildTable()
+
+
+@pytest.fixture()
+def lambda_client():
+    return FakeLambda()
+
+
+def test_burst_is_coalesced(table, lambda_client):
+    for page in ["first-post", "second-post", "first-post"]:
+        rebuilds.mark_dirty(table, "site", {page})
+        rebuilds.trigger(table, lambda_client, "webhook", "site", {"local_invoke": True})
+
+    assert len(lambda_client.invokes) == 1
+    assert lambda_client.invokes[0]["pages"] == ["first-post"]
+    assert table.item["pages"] == {"first-post", "second-post"}
+
+
+def test_release_hands_on_pending_pages(table, lambda_client):
+    rebuilds.mark_dirty(table, "site", {"first-post"})
+    payload = rebuilds.trigger(table, lambda_client, "webhook", "site", {})
+    rebuilds.mark_dirty(table, "site", {"second-post"})
+    rebuilds.trigger(table, lambda_client, "webhook", "site", {})
+
+    assert rebuilds.release(table, "site", payload["rebuild_lease"])
+    rebuilds.trigger(table, lambda_client, "webhook", "site", {})
+
+    assert [i["pages"] for i in lambda_client.invokes] == [["first-post"], ["second-post"]]
+
+
+def test_expired_lease_can_be_taken(table):
+    table.item["last_trigger"] = 1000
+
+    assert rebuilds.claim(table, "site", window=60, now=1030) is None
+    assert rebuilds.claim(table, "site", window=60, now=1061) == {"pages": set(), "full": False, "lease": 1061}
+
+
+def test_release_after_the_lease_was_taken_over_leaves_it(table):
+    first = rebuilds.claim(table, "site", window=60, now=1000)
+    rebuilds.mark_dirty(table, "site", {"first-post"})
+    # The first rebuild overran the window
+    second = rebuilds.claim(table, "site", window=60, now=1061)
+
+    assert not rebuilds.release(table, "site", first["lease"])
+    assert table.item["last_trigger"] == second["lease"]
+    rebuilds.release(table, "site", second["lease"])
+    assert "last_trigger" not in table.item
+
+
+def test_nothing_dirty_releases_lease(table, lambda_client):
+    assert rebuilds.trigger(table, lambda_client, "webhook", "site", {}) is None
+    assert "last_trigger" not in table.item
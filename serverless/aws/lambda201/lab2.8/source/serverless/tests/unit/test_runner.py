@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+import pytest
+
+from github_webhook import runner
+
+
+def test_output_is_streamed_to_the_log(caplog):
+    caplog.set_level("INFO")
+    runner.run_command([sys.executable, "-c", "print('one'); print('two')"])
+
+    lines = [r.getMessage() for r in caplog.records]
+    assert "[{0}] one".format(runner.os.path.basename(sys.executable)) in lines
+
+
+def test_non_zero_exit_raises():
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.run_command([sys.executable, "-c", "import sys; sys.exit(3)"])
+
+
+def test_timeout_kills_the_command():
+    with pytest.raises(subprocess.TimeoutExpired):
+        runner.run_command([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.5)
+
+
+def test_run_commands_runs_everything_then_raises(tmp_path):
+    marker = tmp_path / "ran"
+    commands = [
+        [sys.executable, "-c", "import sys; sys.exit(1)"],
+        [sys.executable, "-c", "open({0!r}, 'w').close()".format(str(marker))],
+    ]
+
+    with pytest.raises(subprocess.CalledProcessError):
+        runner.run_commands(commands, concurrency=2)
+    assert marker.exists()
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from github_webhook import scanner
+
+
+@pytest.fixture()
+def posts(tmp_path):
+    """ Generates a posts directory with a mix of files"""
+
+    scanner.reset()
+    (tmp_path / "2019").mkdir()
+    (tmp_path / "first-post.md").write_text("# First\n\n### Comments\n")
+    (tmp_path / "2019" / "nested-post.md").write_text("# Nested\n\n### Comments\n")
+    (tmp_path / "no-comments.md").write_text("# Quiet\n")
+    (tmp_path / "empty.md").write_text("")
+    (tmp_path / "notes.md.bak").write_text("### Comments\n")
+    yield tmp_path
+    scanner.reset()
+
+
+def names(paths):
+    return sorted(os.path.basename(p) for p in paths)
+
+
+def test_finds_marked_markdown_only(posts):
+    assert names(scanner.find_marked(str(posts))) == ["first-post.md", "nested-post.md"]
+
+
+def test_unchanged_files_are_not_read_again(posts):
+    scanner.find_marked(str(posts))
+    scanner.find_marked(str(posts))
+
+    assert scanner.last_reads == 0
+
+
+def test_changed_file_is_read_again(posts):
+    scanner.find_marked(str(posts))
+    (posts / "no-comments.md").write_text("# Quiet no more\n\n### Comments\n- hi\n")
+
+    assert "no-comments.md" in names(scanner.find_marked(str(posts)))
+    assert scanner.last_reads == 1
+
+
+def test_blob_id_keys_the_cache(posts):
+    path = str(posts / "first-post.md")
+    scanner.find_marked(str(posts), blob_ids={path: "abc"})
+    # A checkout rewrites the file (new mtime) but the blob is the same
+    os.utime(path, ns=(1, 1))
+
+    scanner.find_marked(str(posts), blob_ids={path: "abc"})
+    assert scanner.last_reads == 0
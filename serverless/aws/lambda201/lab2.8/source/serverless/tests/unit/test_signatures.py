@@ -0,0 +1,80 @@
+import hmac
+import base64
+import hashlib
+
+import pytest
+
+from github_webhook import signatures
+from common import events
+
+
+@pytest.fixture(autouse=True)
+def clean_keysets():
+    signatures.reset()
+    yield
+    signatures.reset()
+
+
+def sign(secret, body, digestmod=hashlib.sha256, prefix='sha256'):
+    return prefix + '=' + hmac.new(secret.encode('utf-8'), body, digestmod).hexdigest()
+
+
+def event_for(body, headers):
+    return events.decode({"body": body.decode('utf-8'), "headers": headers})
+
+
+def test_verifies_sha256_with_any_key():
+    body = '{"name": "Zoë"}'.encode('utf-8')
+    event = event_for(body, {"X-Hub-Signature-256": sign("second", body)})
+
+    assert signatures.verify(event, "first,second,third")
+
+
+def test_verifies_legacy_sha1():
+    body = b'{"ref": "refs/heads/master"}'
+    event = event_for(body, {"X-Hub-Signature": sign("secret", body, hashlib.sha1, 'sha1')})
+
+    assert signatures.verify(event, "secret")
+
+
+def test_prefers_sha256_when_both_are_sent():
+    body = b'{}'
+    event = event_for(body, {
+        "X-Hub-Signature-256": sign("secret", body),
+        "X-Hub-Signature": "sha1=" + "0" * 40,
+    })
+
+    assert signatures.verify(event, "secret")
+
+
+def test_rejects_bad_or_missing_signatures():
+    body = b'{}'
+    assert not signatures.verify(event_for(body, {"X-Hub-Signature-256": sign("wrong", body)}), "secret")
+    assert not signatures.verify(event_for(body, {}), "secret")
+    assert not signatures.verify(events.decode({"body": "{}"}), "secret")
+
+
+def test_header_case_does_not_matter():
+    body = b'{}'
+    event = event_for(body, {"x-hub-signature-256": sign("secret", body)})
+
+    assert signatures.verify(event, "secret")
+
+
+def test_base64_bodies_are_decoded():
+    body = b'{"binary": true}'
+    event = events.decode({"body": base64.b64encode(body).decode('ascii'), "isBase64Encoded": True,
+                           "headers": {"X-Hub-Signature-256": sign("secret", body)}})
+
+    assert signatures.verify(event, "secret")
+
+
+def test_keys_parsed_once_and_matching_key_remembered():
+    body = b'{}'
+    event = event_for(body, {"X-Hub-Signature-256": sign("c", body)})
+
+    assert signatures.verify(event, "a,b,c", hint="student00/blog")
+    keys = signatures.keyset("a,b,c")
+    assert signatures.keyset("a,b,c") is keys
+    assert keys.hints == {"student00/blog": 2}
+    assert signatures.verify(event, "a,b,c", hint="student00/blog")
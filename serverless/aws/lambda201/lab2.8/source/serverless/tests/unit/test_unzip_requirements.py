@@ -0,0 +1,183 @@
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import sys
+import zipfile
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                           "node_modules", "serverless-python-requirements", "unzip_requirements.py")
+
+
+@pytest.fixture()
+def unzip(tmp_path, monkeypatch):
+    """ Loads unzip_requirements against an empty archive, so the tests can install their own"""
+
+    (tmp_path / "task").mkdir()
+    zipfile.ZipFile(str(tmp_path / "task" / ".requirements.zip"), "w").close()
+    monkeypatch.setenv("LAMBDA_TASK_ROOT", str(tmp_path / "task"))
+    monkeypatch.setenv("UNZIP_REQUIREMENTS_DIR", str(tmp_path / "empty"))
+    monkeypatch.setenv("UNZIP_REQUIREMENTS_MODE", "extract")
+    monkeypatch.delenv("IS_LOCAL", raising=False)
+    # Whatever gets installed is gone again after the test
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    monkeypatch.setattr(sys, "meta_path", list(sys.meta_path))
+    spec = importlib.util.spec_from_file_location("unzip_requirements_under_test", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    modules = set(sys.modules)
+    yield module
+    for name in set(sys.modules) - modules:
+        del sys.modules[name]
+
+
+def make_archive(path, members):
+    with zipfile.ZipFile(str(path), "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in sorted(members.items()):
+            archive.writestr(name, data)
+    return str(path)
+
+
+def pyc(source):
+    """ The bytecode pip would have written for source, in the layout ArchiveModuleLoader checks"""
+
+    code = compile(source, "<archive>", "exec")
+    return (importlib.util.MAGIC_NUMBER + b"\0\0\0\0" + b"\0\0\0\0" +
+            len(source).to_bytes(4, "little") + marshal.dumps(code))
+
+
+EXTENSION = "zipext" + importlib.machinery.EXTENSION_SUFFIXES[0]
+
+
+@pytest.fixture()
+def archive(tmp_path):
+    return make_archive(tmp_path / "lazy.zip", {
+        "zipmod.py": b"VALUE = 'module'\n",
+        "zippkg/__init__.py": b"NAME = 'package'\n",
+        "zippkg/sub.py": b"from . import NAME\nVALUE = NAME + '.sub'\n",
+        "zipcached.py": b"VALUE = 'source'\n",
+        "__pycache__/zipcached.%s.pyc" % sys.implementation.cache_tag: pyc(b"VALUE = 'cached'\n"),
+        EXTENSION: b"not really a shared object",
+        "zipext.libs/libzip.so.1": b"a library it links against",
+    })
+
+
+def test_lazy_imports_python_modules_from_the_archive(unzip, archive, tmp_path):
+    target = str(tmp_path / "target")
+    unzip.install_lazy(archive, target)
+
+    import zipmod
+
+    assert zipmod.VALUE == "module"
+    assert zipmod.__file__ == os.path.join(archive, "zipmod.py")
+    assert os.listdir(target) == [unzip.stamp_name]
+
+
+def test_lazy_imports_package_submodules(unzip, archive, tmp_path):
+    unzip.install_lazy(archive, str(tmp_path / "target"))
+
+    from zippkg import sub
+
+    assert sub.VALUE == "package.sub"
+    assert isinstance(sub.__loader__, unzip.ArchiveModuleLoader)
+
+
+def test_lazy_uses_bytecode_compiled_for_a_source_of_the_same_size(unzip, archive, tmp_path):
+    unzip.install_lazy(archive, str(tmp_path / "target"))
+
+    import zipcached
+
+    assert zipcached.VALUE == "cached"
+
+
+def test_lazy_extracts_extensions_when_they_are_imported(unzip, archive, tmp_path):
+    target = tmp_path / "target"
+    finder = unzip.install_lazy(archive, str(target))
+    assert not (target / EXTENSION).exists()
+
+    spec = finder.find_spec("zipext")
+
+    assert spec.origin == str(target / EXTENSION)
+    assert (target / EXTENSION).read_bytes() == b"not really a shared object"
+    assert (target / "zipext.libs" / "libzip.so.1").exists()
+    assert finder.extracted == 2
+
+    finder.find_spec("zipext")
+    assert finder.extracted == 2
+
+
+def test_lazy_wipes_the_directory_when_the_archive_changes(unzip, archive, tmp_path):
+    target = tmp_path / "target"
+    unzip.install_lazy(archive, str(target))
+    (target / "left-behind").write_text("from this archive")
+
+    unzip.install_lazy(archive, str(target))
+    assert (target / "left-behind").exists()
+
+    other = make_archive(tmp_path / "other.zip", {"zipmod.py": b"VALUE = 'other'\n"})
+    unzip.install_lazy(other, str(target))
+
+    assert not (target / "left-behind").exists()
+    assert unzip.read_stamp(str(target)) == "lazy " + unzip.archive_hash(zipfile.ZipFile(other))
+
+
+@pytest.fixture()
+def extract_archive(tmp_path):
+    return make_archive(tmp_path / "extract.zip", {
+        "zipdata/__init__.py": b"",
+        "zipdata/one.txt": b"one" * 100,
+        "zipdata/two.txt": b"two" * 100,
+    })
+
+
+def test_extract_repairs_only_files_of_the_wrong_size(unzip, extract_archive, tmp_path):
+    target = tmp_path / "target"
+    assert unzip.install_extract(extract_archive, str(target)) == 3
+    (target / "zipdata" / "one.txt").write_bytes(b"short")
+    # Same size, a size check can't tell
+    (target / "zipdata" / "two.txt").write_bytes(b"owt" * 100)
+
+    assert unzip.install_extract(extract_archive, str(target)) == 1
+
+    assert (target / "zipdata" / "one.txt").read_bytes() == b"one" * 100
+    assert (target / "zipdata" / "two.txt").read_bytes() == b"owt" * 100
+
+
+def test_extract_repairs_files_with_the_wrong_crc(unzip, extract_archive, tmp_path, monkeypatch):
+    target = tmp_path / "target"
+    unzip.install_extract(extract_archive, str(target))
+    (target / "zipdata" / "two.txt").write_bytes(b"owt" * 100)
+    monkeypatch.setattr(unzip, "verify_mode", "crc")
+
+    assert unzip.install_extract(extract_archive, str(target)) == 1
+
+    assert (target / "zipdata" / "one.txt").read_bytes() == b"one" * 100
+    assert (target / "zipdata" / "two.txt").read_bytes() == b"two" * 100
+
+
+def test_extract_starts_again_for_a_different_archive(unzip, extract_archive, tmp_path):
+    target = tmp_path / "target"
+    unzip.install_extract(extract_archive, str(target))
+    (target / "left-behind").write_text("from the old archive")
+
+    other = make_archive(tmp_path / "other.zip", {"zipdata/__init__.py": b"", "zipdata/three.txt": b"3"})
+
+    assert unzip.install_extract(other, str(target)) == 2
+    assert sorted(os.listdir(str(target / "zipdata"))) == ["__init__.py", "three.txt"]
+    assert not (target / "left-behind").exists()
+
+
+def test_extract_all_raises_the_first_worker_error(unzip, extract_archive, tmp_path, monkeypatch):
+    extract_member = unzip.extract_member
+
+    def failing(archive, info, target, atomic=True):
+        if info.filename == "zipdata/two.txt":
+            raise IOError("disk full")
+        return extract_member(archive, info, target, atomic)
+    monkeypatch.setattr(unzip, "extract_member", failing)
+    infos = zipfile.ZipFile(extract_archive).infolist()
+
+    with pytest.raises(IOError, match="disk full"):
+        unzip.extract_all(extract_archive, infos, str(tmp_path / "target"), workers=2)
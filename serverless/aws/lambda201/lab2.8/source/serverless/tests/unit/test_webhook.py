@@ -0,0 +1,197 @@
+import json
+import os
+
+import pytest
+
+pygit2 = pytest.importorskip("pygit2")
+pytest.importorskip("boto3")
+
+from github_webhook import webhook
+
+
+def test_comment_data_only_written_when_changed(tmp_path):
+    comments = [{"name": "Name: Ada\n", "comment": "Nice"}]
+
+    assert webhook.write_comment_data(str(tmp_path), "first-post", comments)
+    os.utime(str(tmp_path / "first-post.json"), (1, 1))
+
+    assert not webhook.write_comment_data(str(tmp_path), "first-post", comments)
+    assert os.stat(str(tmp_path / "first-post.json")).st_mtime == 1
+    assert json.loads((tmp_path / "first-post.json").read_text()) == comments
+
+
+def test_comment_data_removed_when_comments_go(tmp_path):
+    webhook.write_comment_data(str(tmp_path), "first-post", [{"name": "Name: Ada\n", "comment": "Nice"}])
+
+    assert webhook.write_comment_data(str(tmp_path), "first-post", [])
+    assert not (tmp_path / "first-post.json").exists()
+
+
+def test_comment_data_is_excluded_from_git(tmp_path):
+    (tmp_path / ".git" / "info").mkdir(parents=True)
+
+    webhook.prepare_comment_data(str(tmp_path))
+    webhook.prepare_comment_data(str(tmp_path))
+
+    exclude = (tmp_path / ".git" / "info" / "exclude").read_text().splitlines()
+    assert exclude == ["/data/comments/"]
+    assert (tmp_path / "data" / "comments").is_dir()
+
+
+def test_theme_reads_comment_data(tmp_path):
+    partials = tmp_path / "themes" / "ananke" / "layouts" / "partials"
+    partials.mkdir(parents=True)
+    (partials / "comments.html").write_text("<form></form>")
+
+    assert not webhook.theme_reads_comment_data(str(tmp_path))
+
+    (partials / "comments.html").write_text("{{ range index .Site.Data.comments .File.BaseFileName }}{{ end }}")
+    assert webhook.theme_reads_comment_data(str(tmp_path))
+
+
+def test_open_repo_fails_when_there_is_no_checkout(tmp_path):
+    with pytest.raises(Exception):
+        webhook.open_repo(str(tmp_path / "repo"))
+
+
+def test_default_branch_is_the_built_branch(monkeypatch):
+    monkeypatch.setenv("build_branches", " main ")
+    assert webhook.default_branch() == "main"
+
+    monkeypatch.delenv("build_branches")
+    assert webhook.default_branch() == webhook.branch_name
+
+
+def test_fetch_checks_for_shallow_support_once(monkeypatch):
+    calls = []
+
+    class OldRemote(object):
+        # Remote.fetch before pygit2 1.14, a TypeError from in here must not be retried
+        def fetch(self, refspecs, callbacks=None):
+            calls.append(refspecs)
+
+    monkeypatch.setattr(webhook, "_fetch_supports_depth", None)
+    assert webhook.fetch_supports_depth() is True
+
+    monkeypatch.setattr(webhook, "_fetch_supports_depth", False)
+    webhook.fetch_branch(OldRemote(), "master")
+
+    assert calls == [["+refs/heads/master:refs/remotes/origin/master"]]
+
+
+def test_only_one_branch_can_be_built(monkeypatch):
+    monkeypatch.setenv("build_branches", "master,draft")
+
+    with pytest.raises(Exception, match="Only one branch"):
+        webhook.build_branches()
+
+
+def test_post_queues_build_and_returns_202(tmp_path, monkeypatch):
+    queue_file = str(tmp_path / "builds.jsonl")
+    monkeypatch.setenv("build_queue_file", queue_file)
+    body = {"repository": {"full_name": "student00/blog", "clone_url": "file:///tmp/blog.git"}, "local_invoke": True}
+
+    ret = webhook.post(body, "")
+
+    assert ret["statusCode"] == 202
+    jobs = webhook.build_queue.FileQueue(queue_file).receive()
+    assert jobs[0]["repository"]["full_name"] == "student00/blog"
+
+
+def test_post_through_api_gateway_must_be_signed_even_if_local(tmp_path, monkeypatch):
+    queue_file = str(tmp_path / "builds.jsonl")
+    monkeypatch.setenv("build_queue_file", queue_file)
+    monkeypatch.setenv("github_secrets", "secret")
+    body = {"repository": {"full_name": "student00/blog", "clone_url": "https://example.com/evil.git"}, "local_invoke": True}
+
+    with pytest.raises(Exception, match="Failed to validate authenticity"):
+        webhook.post({"httpMethod": "POST", "headers": {}, "body": json.dumps(body)}, "")
+
+    assert webhook.build_queue.FileQueue(queue_file).receive() == []
+
+
+class FakeCommentsLambda(object):
+    """ Answers invokes like comments.get_many with a limit, two comments per response"""
+
+    def __init__(self, comments):
+        self.comments = comments
+        self.payloads = []
+
+    def invoke(self, FunctionName, Payload):
+        import io
+
+        payload = json.loads(Payload)
+        self.payloads.append(payload)
+        found, cursors = {}, {}
+        for page in payload["pages"]:
+            start = int(payload["cursors"].get(page, 0))
+            found[page] = self.comments.get(page, [])[start:start + 2]
+            more = start + 2 < len(self.comments.get(page, []))
+            cursors[page] = str(start + 2) if more else None
+        body = json.dumps({"comments": found, "cursors": cursors})
+        return {"Payload": io.BytesIO(json.dumps({"body": body}).encode("utf-8"))}
+
+
+def test_iter_comments_follows_cursors(monkeypatch):
+    fake = FakeCommentsLambda({"busy": [{"comment": str(i)} for i in range(5)], "quiet": [{"comment": "a"}]})
+    monkeypatch.setattr(webhook.clients, "client", lambda service: fake)
+
+    pages = list(webhook.iter_comments(["busy", "quiet", "empty"], "comments"))
+
+    # Finished pages come out first, the busy one once its last comments are in
+    assert [page for page, _ in pages] == ["empty", "quiet", "busy"]
+    assert [c["comment"] for c in dict(pages)["busy"]] == ["0", "1", "2", "3", "4"]
+    assert len(fake.payloads) == 3
+
+
+def commit_file(repo, path, content):
+    full_path = os.path.join(repo.workdir, path)
+    if not os.path.isdir(os.path.dirname(full_path)):
+        os.makedirs(os.path.dirname(full_path))
+    with open(full_path, "wb") as f:
+        f.write(content)
+    repo.index.add(path)
+    repo.index.write()
+    signature = pygit2.Signature("Test", "test@example.com")
+    parents = [] if repo.head_is_unborn else [repo.head.target]
+    repo.create_commit("HEAD", signature, signature, "Commit", repo.index.write_tree(), parents)
+
+
+def test_render_key_follows_tree_and_comment_data(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path / "repo"))
+    commit_file(repo, "config.toml", b'title = "Blog"\n')
+    data_path = webhook.prepare_comment_data(str(tmp_path / "repo"))
+
+    first = webhook.render_key(repo, data_path)
+    assert webhook.render_key(repo, data_path) == first
+
+    webhook.write_comment_data(data_path, "first-post", [{"name": "Ada", "comment": "Nice"}])
+    with_comments = webhook.render_key(repo, data_path)
+    assert with_comments != first
+
+    commit_file(repo, "config.toml", b'title = "New title"\n')
+    assert webhook.render_key(repo, data_path) not in (first, with_comments)
+
+
+def test_redelivered_push_diffs_from_the_published_commit(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path / "repo"))
+    commit_file(repo, "content/posts/first-post.md", b"Revision 0\n")
+    published = str(repo.head.target)
+    # The push that fails to publish, HEAD has already moved on when it is redelivered
+    commit_file(repo, "content/posts/first-post.md", b"Revision 1\n")
+    body = {"repository": {"full_name": "owner/blog"}, "commits": []}
+
+    plan = webhook.build_plan(body, repo, str(tmp_path / "repo"), published)
+    assert not plan.full
+    assert plan.changed == {"content/posts/first-post.md"}
+
+    assert webhook.build_plan(body, repo, str(tmp_path / "repo"), None).full
+
+
+def test_comment_rebuild_is_full_until_the_head_is_published(tmp_path):
+    repo = pygit2.init_repository(str(tmp_path / "repo"))
+    commit_file(repo, "content/posts/first-post.md", b"Revision 0\n")
+    body = {"repository": {"full_name": "owner/blog"}, "local_invoke": True, "pages": ["first-post"]}
+
+    assert webhook.build_plan(body, repo, str(tmp_path / "repo"), None).full
+    assert not webhook.build_plan(body, repo, str(tmp_path / "repo"), str(repo.head.target)).full
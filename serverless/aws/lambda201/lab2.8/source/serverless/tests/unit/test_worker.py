@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+pytest.importorskip("pygit2")
+pytest.importorskip("boto3")
+
+from github_webhook import worker
+
+
+def push(sha, received):
+    return {
+        "ref": "refs/heads/master",
+        "after": sha,
+        "repository": {"full_name": "student00/blog", "clone_url": "file:///tmp/blog.git"},
+        "commits": [{"id": sha, "added": [], "modified": [], "removed": []}],
+        "received": received,
+    }
+
+
+def sqs_event(jobs):
+    return {"Records": [{"eventSource": "aws:sqs", "body": json.dumps(job)} for job in jobs]}
+
+
+@pytest.fixture()
+def builds(monkeypatch):
+    """ Records what the worker builds instead of building it"""
+
+    built = []
+    monkeypatch.setenv("output_bucket", "bucket")
+    monkeypatch.setenv("comment_function", "comments")
+    monkeypatch.delenv("build_branches", raising=False)
+    monkeypatch.setattr(worker.webhook, "build_site",
+                        lambda job, context, output_bucket, comment_function: built.append(job) or job["received"])
+    return built
+
+
+def test_drain_builds_each_branch_once(builds):
+    comments = {"repository": {"full_name": "student00/blog"}, "local_invoke": True, "pages": ["first-post"],
+                "received": 2}
+
+    results = worker.drain(sqs_event([push("a", 1), comments, push("b", 3)]), None)
+
+    assert [job.get("after") for job in builds] == [None, "b"]
+    assert [c["id"] for c in builds[1]["commits"]] == ["a", "b"]
+    assert results == [2, 3]
+
+
+def test_drain_raises_when_a_build_fails(builds, monkeypatch):
+    def fail(job, context, output_bucket, comment_function):
+        raise Exception("hugo failed")
+    monkeypatch.setattr(worker.webhook, "build_site", fail)
+
+    # SQS only makes the batch visible again if we raise
+    with pytest.raises(Exception, match="hugo failed"):
+        worker.drain(sqs_event([push("a", 1)]), None)
+
+
+def test_run_jobs_needs_an_output_bucket(builds, monkeypatch):
+    monkeypatch.delenv("output_bucket")
+
+    with pytest.raises(Exception, match="Output Bucket not defined"):
+        worker.run_jobs([push("a", 1)], None)
+    assert builds == []
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from github_webhook import workspace
+
+
+class FakeRepos(object):
+    """ Stands in for pygit2, records which repos were opened and created"""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.opened = []
+        self.created = []
+
+    def open_repo(self, path):
+        if not os.path.isdir(path):
+            raise Exception('no repo at %s' % path)
+        self.opened.append(path)
+        return object()
+
+    def create_repo(self, path):
+        os.makedirs(path)
+        with open(os.path.join(path, 'blob'), 'wb') as f:
+            f.write(b'x' * self.size)
+        self.created.append(path)
+        return object()
+
+
+@pytest.fixture()
+def repos():
+    return FakeRepos()
+
+
+def test_creates_then_reuses_open_workspace(tmp_path, repos):
+    manager = workspace.WorkspaceManager(root=str(tmp_path))
+
+    first, created = manager.acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+    assert created
+    assert first.repo_path == os.path.join(str(tmp_path), 'owner/blog', 'master', 'repo')
+
+    again, created = manager.acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+    assert not created
+    assert again is first
+    assert len(repos.created) == 1
+    assert repos.opened == []
+
+
+def test_opens_repo_left_by_earlier_container(tmp_path, repos):
+    workspace.WorkspaceManager(root=str(tmp_path)).acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+
+    fresh = workspace.WorkspaceManager(root=str(tmp_path))
+    ws, created = fresh.acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+    assert not created
+    assert repos.opened == [ws.repo_path]
+
+
+def test_branches_get_separate_workspaces(tmp_path, repos):
+    manager = workspace.WorkspaceManager(root=str(tmp_path))
+    master, _ = manager.acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+    draft, _ = manager.acquire('owner/blog', 'draft', repos.open_repo, repos.create_repo)
+    assert master.path != draft.path
+    assert master.build_path != draft.build_path
+
+
+def test_evicts_least_recently_used_by_count(tmp_path, repos):
+    manager = workspace.WorkspaceManager(root=str(tmp_path), max_workspaces=2)
+    for branch in ['a', 'b']:
+        manager.release(manager.acquire('owner/blog', branch, repos.open_repo, repos.create_repo)[0])
+    # Touch a so b is now the oldest
+    manager.release(manager.acquire('owner/blog', 'a', repos.open_repo, repos.create_repo)[0])
+    c, _ = manager.acquire('owner/blog', 'c', repos.open_repo, repos.create_repo)
+    manager.release(c)
+
+    assert [key[1] for key in manager.workspaces] == ['a', 'c']
+    assert not os.path.exists(os.path.join(str(tmp_path), 'owner/blog', 'b'))
+
+
+def test_evicts_by_size_but_never_the_current_one(tmp_path):
+    repos = FakeRepos(size=64 * 1024)
+    manager = workspace.WorkspaceManager(root=str(tmp_path), max_workspaces=10, max_bytes=100 * 1024)
+    a, _ = manager.acquire('owner/blog', 'a', repos.open_repo, repos.create_repo)
+    manager.release(a)
+    b, _ = manager.acquire('owner/blog', 'b', repos.open_repo, repos.create_repo)
+    manager.release(b)
+
+    assert list(manager.workspaces) == [('owner/blog', 'b')]
+    assert os.path.isdir(b.repo_path)
+    assert a.repo is None
+
+
+def test_remove_deletes_checkout(tmp_path, repos):
+    manager = workspace.WorkspaceManager(root=str(tmp_path))
+    ws, _ = manager.acquire('owner/blog', 'master', repos.open_repo, repos.create_repo)
+    manager.remove(ws)
+    assert not os.path.exists(ws.path)
+    assert manager.workspaces == {}